@@ -0,0 +1,542 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.policy import SMTP
+
+try:
+    import aiosmtplib
+except Exception:
+    aiosmtplib = None
+
+import metrics
+from compression import prepare_attachments
+from config_cache import is_allowed
+from packing import pack_files, raw_budget
+from send_email import (
+    MAX_MESSAGE_BYTES, SEND_ATTACHMENTS, SEND_WORKERS, STREAM_THRESHOLD, SUJET_FICHIERS,
+    _rate_limiter, build_payload, deliver_streamed, is_permanent_error,
+)
+from smtp_pool import SMTP_KEEPALIVE, SMTP_POOL_SIZE, SMTP_TIMEOUT, get_pool
+
+
+ASYNC_QUEUE_SIZE = int(os.getenv('ASYNC_QUEUE_SIZE', '1000'))  # fichiers max en attente entre deux étages
+ASYNC_IO_THREADS = int(os.getenv('ASYNC_IO_THREADS', '8'))  # threads des lectures, compressions, copies et du journal
+ASYNC_BATCH_WINDOW = float(os.getenv('ASYNC_BATCH_WINDOW', '0.2'))  # attente (s) pour regrouper des fichiers par message
+ASYNC_BATCH_FILES = int(os.getenv('ASYNC_BATCH_FILES', '100'))  # fichiers max par message
+
+
+class _Job:
+    """Un fichier dans le pipeline : destinataires restants, pièce jointe préparée, parties reçues par destinataire."""
+
+    __slots__ = ("path", "record", "recipients", "blocked", "attachment", "size", "tmpdir", "expected", "received",
+                 "failed", "pending_lots")
+
+    def __init__(self, path, record, recipients, blocked):
+        self.path = path
+        self.record = record
+        self.recipients = recipients
+        self.blocked = blocked  # un destinataire attend son backoff : pas de sauvegarde à l'issue de cet envoi
+        self.attachment = path
+        self.size = record.size
+        self.tmpdir = None
+        self.expected = 0
+        self.received = {}
+        self.failed = {}
+        self.pending_lots = 0
+
+
+class _Message:
+    __slots__ = ("parts", "jobs", "recipients", "subject")
+
+    def __init__(self, parts, jobs, recipients, subject):
+        self.parts = parts
+        self.jobs = jobs  # {pièce jointe: _Job}
+        self.recipients = recipients
+        self.subject = subject
+
+
+class AsyncSMTPSender:
+    """Sessions aiosmtplib authentifiées, réutilisées ; au plus `size` envois simultanés.
+    Comme smtp_pool : une session inactive depuis plus de keepalive secondes est vérifiée par NOOP avant
+    réutilisation, une session morte est fermée et remplacée par une nouvelle connexion."""
+
+    def __init__(self, smtp_server, smtp_port, email_exp, password, size=SMTP_POOL_SIZE, keepalive=SMTP_KEEPALIVE,
+                 timeout=SMTP_TIMEOUT, logger=None):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.email_exp = email_exp
+        self.password = password
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.logger = logger
+        self._slots = asyncio.Semaphore(max(1, size))
+        self._idle = []  # [(client, last_used)]
+
+    async def _connect(self):
+        client = aiosmtplib.SMTP(hostname=self.smtp_server, port=self.smtp_port, use_tls=True, timeout=self.timeout)
+        start = time.perf_counter()
+        await client.connect()
+        metrics.smtp_connect_seconds.observe(time.perf_counter() - start)
+        start = time.perf_counter()
+        try:
+            await client.login(self.email_exp, self.password)
+        except Exception:
+            client.close()
+            raise
+        metrics.smtp_login_seconds.observe(time.perf_counter() - start)
+        if self.logger:
+            self.logger.info(f"Session SMTP asynchrone ouverte vers {self.smtp_server}:{self.smtp_port}")
+        return client
+
+    async def _is_alive(self, client):
+        try:
+            return client.is_connected and (await client.noop()).code == 250
+        except Exception:
+            return False
+
+    async def _acquire(self):
+        while self._idle:
+            client, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.keepalive or await self._is_alive(client):
+                return client
+            if self.logger:
+                self.logger.info("Session SMTP asynchrone expirée, reconnexion")
+            client.close()
+        return await self._connect()
+
+    async def send(self, recipient, message):
+        async with self._slots:
+            client = await self._acquire()
+            try:
+                await client.sendmail(self.email_exp, [recipient], message)
+            except aiosmtplib.SMTPRecipientsRefused:
+                self._idle.append((client, time.monotonic()))
+                raise
+            except Exception:
+                client.close()
+                raise
+            self._idle.append((client, time.monotonic()))
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for client, _ in idle:
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
+
+
+class ThreadedSMTPSender:
+    """Même interface, sur le pool smtplib (smtp_pool) exécuté dans les threads de l'exécuteur."""
+
+    def __init__(self, pool, executor):
+        self.pool = pool
+        self.executor = executor
+
+    def _send(self, recipient, message):
+        with self.pool.connection() as serveur:
+            serveur.sendmail(self.pool.email_exp, [recipient], message)
+
+    async def send(self, recipient, message):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._send, recipient, message)
+
+    async def close(self):
+        pass
+
+
+def _is_permanent(exc):
+    if aiosmtplib is not None:
+        if isinstance(exc, aiosmtplib.SMTPAuthenticationError):
+            return False
+        if isinstance(exc, aiosmtplib.SMTPRecipientsRefused):
+            codes = [r.code for r in exc.recipients]
+            return bool(codes) and all(500 <= code < 600 for code in codes)
+        if isinstance(exc, aiosmtplib.SMTPResponseException):
+            return 500 <= exc.code < 600
+    return is_permanent_error(exc)
+
+
+class AsyncPipeline:
+    """Pipeline asyncio d'une route : admission -> préparation (compression) -> regroupement en messages
+    -> envoi -> sauvegarde, chaque étage relié au suivant par une file bornée (contre-pression).
+    - submit() / submit_threadsafe() (depuis le thread de l'observer) ne bloquent jamais ; un chemin déjà
+      dans le pipeline est ignoré
+    - lectures, compressions, copies et écritures du journal passent par un exécuteur de ASYNC_IO_THREADS threads ;
+      les envois passent par aiosmtplib s'il est installé, sinon par le pool smtplib dans l'exécuteur
+    - les fichiers en vol ne coûtent qu'un objet chacun, pas un thread
+    Les règles (journal, baux, doublons, dead-letter, sauvegarde) sont celles du moteur synchrone :
+    - prefilter(fichiers, journal, route): retire les doublons déjà livrés
+    - backup(fichiers, route, journal): sauvegarde et retire de la source les fichiers livrés
+    - dead_letter(fichiers, journal, emails): écarte les fichiers définitivement en échec
+    - digest(fichiers, route, journal): mode récapitulatif ; les fichiers admis y sont inscrits et sauvegardés
+      sans passer par la préparation ni l'envoi
+    Issues signalées (notifications du moteur synchrone) : on_done(fichiers terminés), on_dead_letter(fichiers
+    abandonnés), on_error(exception) ; appelées dans l'exécuteur.
+    """
+
+    def __init__(self, route, smtp_server, smtp_port, email_exp, password, journal, backup, dead_letter,
+                 prefilter=None, digest=None, leases=None, executor=None, logger=None, queue_size=ASYNC_QUEUE_SIZE,
+                 on_done=None, on_dead_letter=None, on_error=None):
+        self.route = route
+        self.smtp = (smtp_server, smtp_port, email_exp, password)
+        self.email_exp = email_exp
+        self.journal = journal
+        self.backup = backup
+        self.dead_letter = dead_letter
+        self.prefilter = prefilter
+        self.digest = digest
+        self.on_done = on_done
+        self.on_dead_letter = on_dead_letter
+        self.on_error = on_error
+        self.leases = leases
+        self.executor = executor
+        self.logger = logger
+        self.attachments_mode = SEND_ATTACHMENTS in ('1', 'true', 'True')
+        self.budget = raw_budget(MAX_MESSAGE_BYTES)
+        self._queue_size = queue_size
+        self._paths = set()
+        self._tasks = []
+        self._loop = None
+        self._sender = None
+        self._threaded = None
+
+    # ----- entrée -----
+
+    def submit(self, path):
+        if path in self._paths:
+            return
+        self._paths.add(path)
+        self._idle.clear()
+        self._intake.put_nowait(path)
+
+    def submit_threadsafe(self, path):
+        self._loop.call_soon_threadsafe(self.submit, path)
+
+    async def wait_idle(self):
+        """Attend que tous les fichiers soumis soient sortis du pipeline."""
+        await self._idle.wait()
+
+    # ----- cycle de vie -----
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._intake = asyncio.Queue()
+        self._admitted = asyncio.Queue(self._queue_size)
+        self._prepared = asyncio.Queue(self._queue_size)
+        self._messages = asyncio.Queue(max(2, SEND_WORKERS * 2))
+        self._to_backup = asyncio.Queue(self._queue_size)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tmp = tempfile.mkdtemp(prefix=f"sendfiles-{self.route.name}-")
+        # quota de sessions propre à la route (cf. Route.sessions), comme dans le moteur synchrone
+        sessions = self.route.sessions or SMTP_POOL_SIZE
+        self._threaded = ThreadedSMTPSender(
+            get_pool(*self.smtp, logger=self.logger, name=self.route.name, size=sessions), self.executor,
+        )
+        self._sender = (AsyncSMTPSender(*self.smtp, size=sessions, logger=self.logger) if aiosmtplib is not None
+                        else self._threaded)
+        workers = (
+            [self._admit_worker] * 4 + [self._prepare_worker] * ASYNC_IO_THREADS + [self._batcher]
+            + [self._send_worker] * max(1, SEND_WORKERS) + [self._backup_worker] * 2
+        )
+        self._tasks = [asyncio.create_task(worker(), name=f"{self.route.name}-{worker.__name__}") for worker in workers]
+        return self
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._sender.close()
+        shutil.rmtree(self._tmp, ignore_errors=True)
+
+    async def _run(self, func, *args):
+        return await self._loop.run_in_executor(self.executor, func, *args)
+
+    async def _worker_loop(self, queue, handle):
+        while True:
+            item = await queue.get()
+            try:
+                await handle(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                if self.logger:
+                    self.logger.exception(f"{self.route.name}: erreur dans le pipeline asynchrone: {exc}")
+                await self._report_error(exc)
+                await self._abandon(item)
+
+    async def _report_error(self, exc):
+        if self.on_error is None:
+            return
+        try:
+            await self._run(self.on_error, exc)
+        except Exception as e:
+            if self.logger:
+                self.logger.exception(f"{self.route.name}: erreur de notification: {e}")
+
+    async def _abandon(self, item):
+        """Sort du pipeline les fichiers d'un élément en erreur ; ils restent dans la source (et le journal)."""
+        if isinstance(item, str):
+            await self._finish(item)
+        elif isinstance(item, _Job):
+            await self._finish(item.path, item)
+        elif isinstance(item, _Message):
+            for job in set(item.jobs.values()):
+                job.pending_lots -= 1
+                if job.pending_lots <= 0:
+                    await self._finish(job.path, job)
+        else:
+            for job in item:
+                await self._finish(job.path, job)
+
+    def _cleanup(self, path, job):
+        if job is not None and job.tmpdir:
+            shutil.rmtree(job.tmpdir, ignore_errors=True)
+        if self.leases is not None:
+            self.leases.release([path])
+
+    async def _finish(self, path, job=None):
+        try:
+            await self._run(self._cleanup, path, job)
+        finally:
+            self._paths.discard(path)
+            if not self._paths:
+                self._idle.set()
+
+    def depth(self):
+        """Fichiers présents dans le pipeline, tous étages confondus."""
+        return len(self._paths)
+
+    # ----- étage 1 : admission (extension, bail, doublons, journal) -----
+
+    def _admit(self, path):
+        if not os.path.isfile(path) or path.endswith('.success'):
+            return None
+        metrics.files_discovered.inc(route=self.route.name)
+        if not is_allowed(path, self.route.allowed_extensions()):
+            metrics.files_rejected.inc(route=self.route.name)
+            if self.logger:
+                self.logger.warning(f"Extension non autorisée : {path}")
+            return None
+        metrics.files_accepted.inc(route=self.route.name)
+        if self.leases is not None and not self.leases.claim([path], root=self.route.directory,
+                                                             namespace=self.route.name, tag=self.route.name):
+            return None
+        if self.prefilter is not None and not self.prefilter([path], self.journal, self.route):
+            return None
+        record = self.journal.begin(path)
+        deja = self.journal.delivered_to(record.id)
+        attente = self.journal.blocked_recipients(record.id)
+        emails = [e for e in dict.fromkeys(self.route.emails()) if e not in deja]
+        restants = tuple(e for e in emails if e not in attente)
+        blocked = len(restants) < len(emails)
+        if not restants and blocked:
+            return None  # tous les destinataires restants attendent leur nouvelle tentative
+        return _Job(path, record, restants, blocked)
+
+    async def _admit_worker(self):
+        async def handle(path):
+            job = await self._run(self._admit, path)
+            if job is None:
+                await self._finish(path)
+            elif not job.recipients:
+                await self._to_backup.put(job)  # déjà reçu par tout le monde lors d'une exécution précédente
+            elif self.digest is not None:
+                await self._run(self._digest, job)
+                await self._finish(path, job)
+            else:
+                await self._admitted.put(job)
+        await self._worker_loop(self._intake, handle)
+
+    # ----- étage 2 : préparation (compression) -----
+
+    def _prepare(self, job):
+        job.tmpdir = tempfile.mkdtemp(dir=self._tmp)
+        attachments = prepare_attachments([job.path], job.tmpdir, logger=self.logger)
+        job.attachment = next(iter(attachments), job.path)
+        job.size = os.path.getsize(job.attachment)
+
+    async def _prepare_worker(self):
+        async def handle(job):
+            if self.attachments_mode:
+                await self._run(self._prepare, job)
+            await self._prepared.put(job)
+        await self._worker_loop(self._admitted, handle)
+
+    # ----- étage 3 : regroupement des fichiers en messages -----
+
+    async def _batcher(self):
+        groupes = {}  # destinataires -> [jobs, octets, échéance]
+        while True:
+            now = time.monotonic()
+            timeout = min((g[2] for g in groupes.values()), default=None)
+            try:
+                job = await asyncio.wait_for(self._prepared.get(), None if timeout is None else max(0.0, timeout - now))
+            except asyncio.TimeoutError:
+                job = None
+            if job is not None:
+                groupe = groupes.setdefault(job.recipients, [[], 0, time.monotonic() + ASYNC_BATCH_WINDOW])
+                groupe[0].append(job)
+                groupe[1] += job.size
+                # sans pièces jointes (message informatif), la taille des fichiers n'entre pas dans le message
+                if (self.attachments_mode and groupe[1] >= self.budget) or len(groupe[0]) >= ASYNC_BATCH_FILES:
+                    del groupes[job.recipients]
+                    await self._flush(job.recipients, groupe[0])
+            now = time.monotonic()
+            for recipients in [r for r, g in groupes.items() if g[2] <= now]:
+                await self._flush(recipients, groupes.pop(recipients)[0])
+
+    async def _flush(self, recipients, jobs):
+        try:
+            await self._emit_messages(recipients, jobs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            if self.logger:
+                self.logger.exception(f"{self.route.name}: impossible de préparer les messages: {exc}")
+            await self._abandon(jobs)
+
+    async def _emit_messages(self, recipients, jobs):
+        if not self.attachments_mode:
+            for job in jobs:
+                job.expected, job.pending_lots = 1, 1
+            await self._messages.put(_Message(None, {job.path: job for job in jobs}, recipients, SUJET_FICHIERS))
+            return
+        par_piece = {job.attachment: job for job in jobs}
+        lots = await self._run(pack_files, list(par_piece), self.budget)
+        for lot in lots:
+            for part in lot:
+                par_piece[part.path].expected += 1
+            for path in {part.path for part in lot}:
+                par_piece[path].pending_lots += 1
+        for numero, lot in enumerate(lots, 1):
+            subject = SUJET_FICHIERS if len(lots) == 1 else f"{SUJET_FICHIERS} ({numero}/{len(lots)})"
+            await self._messages.put(_Message(lot, {p.path: par_piece[p.path] for p in lot}, recipients, subject))
+
+    # ----- étage 4 : envoi -----
+
+    async def _deliver(self, send, email):
+        delay = _rate_limiter.reserve(email)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        start = time.perf_counter()
+        try:
+            await send(email)
+        except Exception as exc:
+            metrics.smtp_send_seconds.observe(time.perf_counter() - start, result="error")
+            if self.logger:
+                self.logger.error(f"Échec de l'envoi à {email}: {exc}")
+            return exc
+        metrics.smtp_send_seconds.observe(time.perf_counter() - start, result="ok")
+        return None
+
+    async def _send_message(self, message):
+        parts = message.parts
+        taille = sum(p.length for p in parts) if parts else 0
+        if parts and 0 <= STREAM_THRESHOLD < taille:
+            # gros volume : envoi en flux depuis un thread, le lot est encodé une seule fois pour tous
+            # les destinataires et la mémoire reste bornée
+            jointes = parts
+            results = await self._run(deliver_streamed, self._threaded.pool, message.recipients, self.email_exp,
+                                      message.subject, parts, None, self.logger)
+        else:
+            payload, jointes = await self._run(build_payload, self.email_exp, message.subject, parts)
+            if parts is not None and not jointes:
+                if self.logger:
+                    self.logger.info("Aucun fichier n'a pu être joint (pipeline asynchrone)")
+                await self._abandon(message)
+                return
+
+            async def send(email):
+                await self._sender.send(email, SMTP.fold_binary("To", email) + payload)
+
+            errors = await asyncio.gather(*(self._deliver(send, email) for email in message.recipients))
+            results = dict(zip(message.recipients, errors))
+        octets = sum(p.length for p in jointes) if parts else 0
+
+        # un fichier est parvenu à un destinataire quand toutes ses parties lui ont été envoyées
+        recues = [p.path for p in jointes] if parts is not None else list(message.jobs)
+        livres = []
+        for email, exc in results.items():
+            if exc is not None:
+                for job in message.jobs.values():
+                    job.failed.setdefault(email, exc)
+                continue
+            metrics.attachment_bytes.inc(octets)
+            for path in recues:
+                job = message.jobs[path]
+                job.received[email] = job.received.get(email, 0) + 1
+                if job.received[email] == job.expected:
+                    livres.append((job, email))
+        if livres:
+            await self._run(self._mark_delivered, livres)
+
+        for job in set(message.jobs.values()):
+            job.pending_lots -= 1
+            if job.pending_lots == 0:
+                await self._complete(job)
+
+    def _mark_delivered(self, livres):
+        for job, email in livres:
+            self.journal.mark_delivered(job.record.id, email)
+            if self.logger:
+                self.logger.info(f"Email envoyé à {email} - {os.path.basename(job.path)}", extra={"file": job.path})
+
+    def _digest(self, job):
+        termines = self.digest([job.path], self.route, self.journal)
+        if termines and self.on_done is not None:
+            self.on_done(termines)
+
+    def _record_failures(self, job):
+        for email, exc in job.failed.items():
+            dead = self.journal.record_failure(job.record.id, email, exc, permanent=_is_permanent(exc))
+            metrics.delivery_failures.inc(outcome="dead" if dead else "retry")
+            if self.logger:
+                etat = "abandonné" if dead else "nouvelle tentative différée"
+                self.logger.warning(f"Échec de livraison de {os.path.basename(job.path)} à {email} ({etat}): {exc}",
+                                    extra={"file": job.path})
+        abandonnes = self.dead_letter([job.path], self.journal, self.route.emails())
+        if abandonnes and self.on_dead_letter is not None:
+            self.on_dead_letter(abandonnes)
+
+    async def _complete(self, job):
+        if job.failed:
+            await self._run(self._record_failures, job)
+            await self._finish(job.path, job)
+        elif job.blocked or any(job.received.get(e, 0) < job.expected for e in job.recipients):
+            await self._finish(job.path, job)  # reste dans la source pour la prochaine tentative
+        else:
+            await self._to_backup.put(job)
+
+    async def _send_worker(self):
+        await self._worker_loop(self._messages, self._send_message)
+
+    # ----- étage 5 : sauvegarde -----
+
+    async def _backup_worker(self):
+        while True:
+            jobs = [await self._to_backup.get()]
+            while len(jobs) < 64 and not self._to_backup.empty():
+                jobs.append(self._to_backup.get_nowait())
+            try:
+                await self._run(self._backup, jobs)
+            except Exception as exc:
+                if self.logger:
+                    self.logger.exception(f"{self.route.name}: erreur de sauvegarde: {exc}")
+                await self._report_error(exc)
+            finally:
+                for job in jobs:
+                    await self._finish(job.path, job)
+
+
+    def _backup(self, jobs):
+        termines = self.backup([job.path for job in jobs], self.route, self.journal)
+        if termines and self.on_done is not None:
+            self.on_done(termines)
+
+
+def make_executor():
+    return ThreadPoolExecutor(max_workers=max(1, ASYNC_IO_THREADS), thread_name_prefix="async-io")
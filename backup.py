@@ -1,5 +1,26 @@
+import hashlib
 import os
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import metrics
+from discovery import scandir_files
+
+
+BACKUP_WORKERS = int(os.getenv('BACKUP_WORKERS', '4'))  # copies simultanées vers la sauvegarde
+BACKUP_VERIFY = os.getenv('BACKUP_VERIFY', 'none').lower()  # 'none', 'size' ou 'sha256'
+# 'copy' : copie (la source reste en place) ; 'link' : lien physique si même volume ; 'move' : renommage si même volume.
+# Hors du même volume, 'link' et 'move' retombent sur une copie ('move' supprime alors la source).
+BACKUP_MODE = os.getenv('BACKUP_MODE', 'copy').lower()
+COPY_BUFFER = 1024 * 1024
+_FICLONE = 0x40049409  # ioctl Linux de clonage (reflink) sur btrfs/XFS
 
 
 def ensure_backup_dir(backup_dir, logger=None):
@@ -14,76 +35,211 @@ def ensure_backup_dir(backup_dir, logger=None):
         return False
 
 
-def copy_files_to_backup(files, backup_dir, logger=None):
-    copied = []
-    for f in files:
+def _clone_or_copy(src_f, dst_f, size):
+    """Copie le contenu sans passer par l'espace utilisateur quand le système le permet :
+    reflink (FICLONE), puis copy_file_range, puis sendfile/lecture-écriture via shutil."""
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(dst_f.fileno(), _FICLONE, src_f.fileno())
+            return
+        except OSError:
+            pass
+    if hasattr(os, 'copy_file_range'):
+        try:
+            copied = 0
+            while copied < size:
+                n = os.copy_file_range(src_f.fileno(), dst_f.fileno(), size - copied)
+                if n == 0:
+                    break
+                copied += n
+            if copied == size:
+                return
+        except OSError:
+            pass
+        src_f.seek(0)
+        dst_f.seek(0)
+        dst_f.truncate()
+    shutil.copyfileobj(src_f, dst_f, COPY_BUFFER)
+
+
+def _temp_path(dest):
+    # fichier caché dans le dossier cible, pour que le renommage final soit atomique
+    return os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def copy_file(src, dest, verify=None):
+    """Copie atomique de src vers dest : écriture dans un fichier temporaire du dossier cible, puis renommage.
+    - verify: None/'none', 'size' ou 'sha256' - contrôle de la copie avant renommage (ValueError si différente)
+    Retourne le nombre d'octets copiés.
+    """
+    verify = verify or BACKUP_VERIFY
+    size = os.path.getsize(src)
+    tmp = _temp_path(dest)
+    try:
+        with open(src, 'rb') as src_f, open(tmp, 'wb') as dst_f:
+            _clone_or_copy(src_f, dst_f, size)
+        shutil.copystat(src, tmp)
+        if verify in ('size', 'sha256') and os.path.getsize(tmp) != size:
+            raise ValueError(f"taille copiée différente ({os.path.getsize(tmp)} != {size})")
+        if verify == 'sha256' and _sha256(src) != _sha256(tmp):
+            raise ValueError("empreinte SHA-256 de la copie différente de la source")
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return size
+
+
+def same_device(path, directory):
+    try:
+        return os.stat(path).st_dev == os.stat(directory).st_dev
+    except OSError:
+        return False
+
+
+def move_to_backup(src, dest, mode=None, verify=None):
+    """Place src en dest selon le mode de sauvegarde (BACKUP_MODE par défaut) :
+    renommage ou lien physique en O(1) quand source et sauvegarde sont sur le même volume, copie sinon.
+    Retourne (méthode utilisée: 'rename' | 'link' | 'copy', octets copiés).
+    Durée, octets sauvegardés et débit de copie sont publiés dans les métriques (sendfiles_backup_*).
+    """
+    mode = mode or BACKUP_MODE
+    size = os.path.getsize(src)
+    start = time.perf_counter()
+    method, copied = None, 0
+    if mode in ('move', 'link') and same_device(src, os.path.dirname(dest) or '.'):
         try:
-            dest = os.path.join(backup_dir, os.path.basename(f))
-            shutil.copy2(f, dest)
-            copied.append(dest)
+            if mode == 'move':
+                os.replace(src, dest)
+                method = 'rename'
+            else:
+                tmp = _temp_path(dest)
+                os.link(src, tmp)
+                os.replace(tmp, dest)
+                method = 'link'
+        except OSError:
+            # liens non supportés (FAT, partage réseau...) : on retombe sur la copie
+            pass
+    if method is None:
+        copy_file(src, dest, verify=verify)
+        if mode == 'move':
+            os.remove(src)
+        method, copied = 'copy', size
+    elapsed = time.perf_counter() - start
+    metrics.backup_seconds.observe(elapsed, method=method)
+    metrics.backup_bytes.inc(size, method=method)
+    if copied and elapsed > 0:
+        metrics.backup_throughput.observe(copied / elapsed)
+    return method, copied
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _run_parallel(func, items, workers):
+    workers = max(1, min(workers or BACKUP_WORKERS, len(items) or 1))
+    if workers == 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backup-copy") as executor:
+        return list(executor.map(func, items))
+
+
+def backup_path(src, backup_dir, relative_to=None):
+    """Chemin de sauvegarde de src : à plat (nom seul), ou sous son chemin relatif à relative_to (dossier surveillé récursivement)."""
+    if relative_to is None:
+        return os.path.join(backup_dir, os.path.basename(src))
+    return os.path.join(backup_dir, os.path.relpath(src, relative_to))
+
+
+def copy_files_to_backup(files, backup_dir, logger=None, workers=None, verify=None, mode=None, relative_to=None):
+    """Sauvegarde les fichiers dans backup_dir, BACKUP_WORKERS à la fois, selon le mode (cf. move_to_backup) :
+    en mode 'move' la source a disparu au retour, dans les autres modes elle est toujours en place.
+    - relative_to: reproduit l'arborescence des fichiers sous ce dossier (cf. backup_path)
+    Retourne les chemins de destination sauvegardés, dans l'ordre des fichiers fournis.
+    """
+    def copy_one(f):
+        dest = backup_path(f, backup_dir, relative_to)
+        try:
+            if relative_to is not None:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+            method, copied = move_to_backup(f, dest, mode=mode, verify=verify)
             if logger:
-                logger.info(f"Copié vers sauvegarde: {dest}")
+                logger.info(f"Sauvegardé ({method}): {dest}")
+            return dest, method, copied
         except Exception as e:
             if logger:
                 logger.error(f"Erreur copie vers sauvegarde {f}: {e}")
-    return copied
+            return None, None, 0
 
+    results = _run_parallel(copy_one, list(files), workers)
+    if logger and results:
+        methods = [m for _, m, _ in results if m]
+        logger.info(
+            f"Sauvegarde: renommés={methods.count('rename')}, liés={methods.count('link')}, "
+            f"copiés={methods.count('copy')}, octets copiés={sum(c for _, _, c in results)}"
+        )
+    return [dest for dest, _, _ in results if dest]
 
-def cleanup_success_in_source(source_dir, logger=None):
-    removed = []
-    try:
-        for fpath in os.listdir(source_dir):
-            full = os.path.join(source_dir, fpath)
-            if os.path.isfile(full) and full.endswith('.success'):
-                try:
-                    os.remove(full)
-                    removed.append(full)
-                    if logger:
-                        logger.info(f"Supprimé .success dans source: {full}")
-                except Exception as e:
-                    if logger:
-                        logger.error(f"Impossible de supprimer {full}: {e}")
-    except Exception as e:
-        if logger:
-            logger.exception(f"Erreur lors de la suppression des fichiers .success dans {source_dir}: {e}")
-    return removed
+
+def _success_files(source_dir, files=None):
+    if files is None:
+        return scandir_files(source_dir, lambda name: name.endswith('.success'))
+    return [f for f in files if f.endswith('.success')]
 
 
-def process_success_files(source_dir, backup_dir, logger=None):
+def process_success_files(source_dir, backup_dir, logger=None, files=None, workers=None, mode=None):
     """Traite les fichiers existants se terminant par .success :
-    - copie chaque fichier vers backup en enlevant le suffixe '.success'
+    - copie chaque fichier vers backup en enlevant le suffixe '.success' (en parallèle ; renommage
+      sur le même volume si BACKUP_MODE vaut 'move' ou 'link')
     - supprime le fichier .success dans la source
+    - files: chemins déjà connus (événements du mode watch) pour éviter de relister le dossier
     Retourne la liste des fichiers copiés (dest paths) et supprimés (source paths)
     """
+    def process_one(full):
+        if not os.path.isfile(full):
+            return None, None
+        try:
+            orig_name = os.path.basename(full)[:-len('.success')]
+            dest = os.path.join(backup_dir, orig_name)
+            # la source est supprimée juste après : un renommage sur le même volume suffit
+            method, _ = move_to_backup(full, dest, mode='move' if (mode or BACKUP_MODE) != 'copy' else 'copy')
+            if logger:
+                logger.info(f"Sauvegardé ({method}) depuis .success: {full} -> {dest}")
+        except Exception as e:
+            if logger:
+                logger.error(f"Erreur copie depuis .success {full}: {e}")
+            return None, None
+
+        if not os.path.exists(full):
+            return dest, full
+        try:
+            os.remove(full)
+            if logger:
+                logger.info(f"Supprimé .success après copie: {full}")
+            return dest, full
+        except Exception as e:
+            if logger:
+                logger.error(f"Impossible de supprimer {full} après copie: {e}")
+            return dest, None
+
     copied = []
     removed = []
-
     try:
-        for fpath in os.listdir(source_dir):
-            full = os.path.join(source_dir, fpath)
-            if os.path.isfile(full) and full.endswith('.success'):
-                try:
-                    orig_name = fpath[:-len('.success')]
-                    dest = os.path.join(backup_dir, orig_name)
-                    shutil.copy2(full, dest)
-                    copied.append(dest)
-                    if logger:
-                        logger.info(f"Copié depuis .success vers sauvegarde: {full} -> {dest}")
-                except Exception as e:
-                    if logger:
-                        logger.error(f"Erreur copie depuis .success {full}: {e}")
-                    continue
-
-                try:
-                    os.remove(full)
-                    removed.append(full)
-                    if logger:
-                        logger.info(f"Supprimé .success après copie: {full}")
-                except Exception as e:
-                    if logger:
-                        logger.error(f"Impossible de supprimer {full} après copie: {e}")
+        for dest, full in _run_parallel(process_one, _success_files(source_dir, files), workers):
+            if dest:
+                copied.append(dest)
+            if full:
+                removed.append(full)
     except Exception as e:
         if logger:
             logger.exception(f"Erreur lors du traitement des fichiers .success dans {source_dir}: {e}")
 
-    return copied, removed
\ No newline at end of file
+    return copied, removed
@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+import zlib
+
+
+class BatchScheduler:
+    """Regroupe les événements fichiers et les traite par lots dans un thread dédié.
+    - submit() ne bloque jamais : il peut être appelé depuis le thread de l'observer watchdog
+    - un lot est vidé dès qu'il atteint batch_size chemins, ou après `window` secondes sans
+      nouvel événement, ou au plus tard `max_wait` secondes après le premier événement du lot
+    - les chemins en double dans un même lot sont fusionnés
+    - process_batch(paths) reçoit la liste ordonnée des chemins du lot
+    """
+
+    def __init__(self, process_batch, window=1.0, batch_size=500, max_wait=10.0, logger=None, name="batch-scheduler"):
+        self.process_batch = process_batch
+        self.window = window
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.logger = logger
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._batched = 0  # chemins du lot en cours de constitution ou de traitement
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, path):
+        self._queue.put(path)
+
+    def depth(self):
+        """Chemins en attente (file d'entrée + lot courant), pour le suivi de l'arriéré."""
+        return self._queue.qsize() + self._batched
+
+    def stop(self, timeout=None):
+        """Arrête le worker après avoir vidé le lot en cours."""
+        self._stop.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        pending = {}
+        first_at = None
+        while True:
+            if pending:
+                now = time.monotonic()
+                timeout = min(self.window, max(0.0, first_at + self.max_wait - now))
+            else:
+                timeout = None
+            try:
+                path = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                path = None
+                self._flush(pending)
+                pending, first_at = {}, None
+                continue
+
+            if path is not None:
+                if not pending:
+                    first_at = time.monotonic()
+                pending[path] = None
+                self._batched = len(pending)
+
+            if pending and (
+                path is None
+                or len(pending) >= self.batch_size
+                or time.monotonic() - first_at >= self.max_wait
+            ):
+                self._flush(pending)
+                pending, first_at = {}, None
+
+            if self._stop.is_set() and self._queue.empty():
+                if pending:
+                    self._flush(pending)
+                return
+
+    def _flush(self, pending):
+        if not pending:
+            return
+        paths = list(pending)
+        if self.logger:
+            self.logger.info(f"{self.name}: traitement d'un lot de {len(paths)} fichier(s)")
+        try:
+            self.process_batch(paths)
+        except Exception as exc:
+            if self.logger:
+                self.logger.exception(f"{self.name}: erreur lors du traitement du lot: {exc}")
+        finally:
+            self._batched = 0
+
+
+class ShardedScheduler:
+    """Répartit les chemins entre `shards` BatchScheduler indépendants (un thread chacun).
+    Un chemin va toujours au même shard (hachage du chemin) : un fichier n'est jamais traité par deux lots à la fois,
+    et un gros lot en cours sur un shard n'empêche pas les autres d'avancer.
+    """
+
+    def __init__(self, process_batch, shards=1, name="batch-scheduler", **kwargs):
+        shards = max(1, shards)
+        self.name = name
+        self.shards = [
+            BatchScheduler(process_batch, name=name if shards == 1 else f"{name}-{i + 1}", **kwargs)
+            for i in range(shards)
+        ]
+
+    def start(self):
+        for shard in self.shards:
+            shard.start()
+        return self
+
+    def submit(self, path):
+        self.shards[zlib.crc32(path.encode("utf-8", "surrogateescape")) % len(self.shards)].submit(path)
+
+    def depth(self):
+        return sum(shard.depth() for shard in self.shards)
+
+    def stop(self, timeout=None):
+        for shard in self.shards:
+            shard.stop(timeout)
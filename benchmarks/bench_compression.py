@@ -0,0 +1,84 @@
+"""Mesure le gain de la compression des pièces jointes : ratio obtenu contre temps passé.
+
+    python benchmarks/bench_compression.py chemin/vers/fichiers [--methods gzip,zip,zstd] [--level 6]
+
+Sans chemin, un jeu de données synthétique (CSV, log, dump SQL, binaire aléatoire) est généré.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import compress_file, resolve_method, should_compress  # noqa: E402
+
+
+def generate_samples(dest_dir, size=8 * 1024 * 1024):
+    rnd = random.Random(42)
+    samples = {
+        "donnees.csv": lambda: "".join(f"{i};{rnd.randint(0, 10**6)};client_{rnd.randint(0, 500)};OK\n" for i in range(size // 32)),
+        "application.log": lambda: "".join(f"2024-01-01 12:00:{i % 60:02d} - INFO - traitement {rnd.randint(0, 99)} terminé\n" for i in range(size // 56)),
+        "dump.sql": lambda: "".join(f"INSERT INTO t VALUES ({i}, 'valeur {rnd.randint(0, 1000)}');\n" for i in range(size // 40)),
+    }
+    paths = []
+    for name, make in samples.items():
+        path = os.path.join(dest_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(make())
+        paths.append(path)
+    path = os.path.join(dest_dir, "aleatoire.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    paths.append(path)
+    return paths
+
+
+def list_inputs(paths):
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files.extend(os.path.join(p, f) for f in sorted(os.listdir(p)) if os.path.isfile(os.path.join(p, f)))
+        elif os.path.isfile(p):
+            files.append(p)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la compression des pièces jointes")
+    parser.add_argument("paths", nargs="*", help="Fichiers ou dossiers à mesurer (défaut: jeu synthétique)")
+    parser.add_argument("--methods", default="gzip,zip,zstd")
+    parser.add_argument("--level", type=int, default=6)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-compression-") as tmp:
+        files = list_inputs(args.paths) if args.paths else generate_samples(tmp)
+        out_dir = os.path.join(tmp, "out")
+        os.makedirs(out_dir)
+
+        print(f"{'fichier':<28} {'méthode':<6} {'taille':>12} {'compressé':>12} {'ratio':>7} {'temps (s)':>10} {'Mo/s':>8}")
+        for method in [m.strip() for m in args.methods.split(",") if m.strip()]:
+            effective = resolve_method(method)
+            if effective != method:
+                print(f"# {method} indisponible, ignoré")
+                continue
+            total_in = total_out = total_time = 0
+            for path in files:
+                size = os.path.getsize(path)
+                t0 = time.perf_counter()
+                dest = compress_file(path, out_dir, method, args.level)
+                elapsed = time.perf_counter() - t0
+                out = os.path.getsize(dest)
+                os.remove(dest)
+                total_in, total_out, total_time = total_in + size, total_out + out, total_time + elapsed
+                skip = "" if should_compress(path) else " (ignoré en production)"
+                print(f"{os.path.basename(path)[:28]:<28} {method:<6} {size:>12} {out:>12} {size / max(out, 1):>7.2f} "
+                      f"{elapsed:>10.3f} {size / 1e6 / max(elapsed, 1e-9):>8.1f}{skip}")
+            print(f"{'TOTAL':<28} {method:<6} {total_in:>12} {total_out:>12} {total_in / max(total_out, 1):>7.2f} "
+                  f"{total_time:>10.3f} {total_in / 1e6 / max(total_time, 1e-9):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
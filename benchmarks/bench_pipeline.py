@@ -0,0 +1,353 @@
+"""Mesure le débit de bout en bout (envoi, sauvegarde, .success, mode watch) contre un serveur SMTP local.
+
+    python benchmarks/bench_pipeline.py [--modes send,from-backup,success,watch] [--files 50,500]
+        [--sizes 4k,256k] [--recipients 1,5] [--latency 0.01] [--fail-rate 0]
+        [--env COMPRESSION=gzip --env BACKUP_MODE=move] [--output resultats.json]
+        [--baseline precedent.json --tolerance 0.15]
+
+Chaque scénario (mode x nombre de fichiers x taille x destinataires) tourne dans un processus neuf, sur un
+dossier synthétique généré à l'avance, avec une configuration .env propre : le temps d'import et le pic de
+mémoire (RSS) sont donc ceux d'un vrai démarrage. Le serveur SMTP (benchmarks/smtp_sink.py) tourne dans le
+processus parent ; il parle en clair, smtplib.SMTP_SSL est remplacé par smtplib.SMTP dans le processus mesuré.
+
+Résultats : fichiers/s, Mo/s, latence par fichier p50/p99 (de la mise à disposition au passage à l'état
+'done' dans le journal) et pic de RSS. Avec --baseline, le code de sortie vaut 1 si un scénario perd plus de
+--tolerance de débit ou de p99 par rapport aux résultats précédents (--output d'une exécution antérieure).
+Le temps d'import de send_files (python -X importtime, meilleur de --import-runs processus neufs) est
+mesuré à part, avec les modules qui coûtent le plus, et suivi de la même façon.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from smtp_sink import SMTPSink  # noqa: E402
+
+
+MODES = ("send", "from-backup", "success", "watch")
+UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit, factor in (("G", 1024 ** 3), ("M", 1024 ** 2), ("k", 1024)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2 ** 20
+        except Exception:
+            return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == "darwin" else rss / 1024
+
+
+def write_files(dest_dir, count, size, seed, suffix=""):
+    """Fichiers .csv de contenu pseudo-aléatoire (reproductible), suffix ajouté au nom (ex: '.success')."""
+    rnd = random.Random(seed)
+    os.makedirs(dest_dir, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(dest_dir, f"fichier_{i:06d}.csv{suffix}")
+        with open(path, "wb") as f:
+            remaining = size
+            while remaining > 0:
+                chunk = min(remaining, 1024 * 1024)
+                f.write(rnd.randbytes(chunk))
+                remaining -= chunk
+        paths.append(path)
+    return paths
+
+
+# ----- processus mesuré -----
+
+def _done_times(journal_file):
+    try:
+        db = sqlite3.connect(journal_file)
+        try:
+            return dict(db.execute("SELECT path, updated FROM files WHERE state = 'done'").fetchall())
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return {}
+
+
+def run_worker(spec):
+    import smtplib
+    smtplib.SMTP_SSL = smtplib.SMTP  # le sink parle SMTP en clair
+
+    mode = spec["mode"]
+    t_import = time.perf_counter()
+    if mode == "success":
+        # mesure du traitement des .success seul, sans la configuration de send_files
+        from backup import process_success_files
+    else:
+        import send_files
+    import_s = time.perf_counter() - t_import
+
+    available = {}
+    start = time.perf_counter()
+    t0 = time.time()
+    if mode == "send":
+        available = dict.fromkeys(spec["files"], t0)
+        send_files.send_and_backup()
+    elif mode == "from-backup":
+        available = dict.fromkeys(spec["files"], t0)
+        send_files.send_from_backup()
+    elif mode == "success":
+        process_success_files(spec["source"], spec["backup"])
+    elif mode == "watch":
+        try:
+            import watchdog  # noqa: F401
+        except ImportError:
+            print(json.dumps({"error": "watchdog non installé"}))
+            return
+        threading.Thread(target=send_files.watch_folder, kwargs={"poll_interval": 0.2}, daemon=True).start()
+        time.sleep(spec.get("watch_warmup", 1.0))
+        start = time.perf_counter()
+        for src in spec["staged"]:
+            dest = os.path.join(spec["source"], os.path.basename(src))
+            available[dest] = time.time()
+            shutil.copyfile(src, dest)
+        deadline = time.monotonic() + spec.get("timeout", 600)
+        while time.monotonic() < deadline and len(_done_times(spec["journal"])) < len(available):
+            time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    done = _done_times(spec["journal"]) if mode != "success" else {}
+    latencies = [done[p] - t for p, t in available.items() if p in done]
+    processed = len(done) if mode != "success" else len(os.listdir(spec["backup"]))
+    print(json.dumps({
+        "elapsed_s": elapsed, "import_s": import_s, "processed": processed,
+        "latencies": latencies, "peak_rss_mb": peak_rss_mb(),
+    }))
+    sys.stdout.flush()
+    os._exit(0)  # ne pas attendre les threads du mode watch
+
+
+def measure_importtime(module="send_files", runs=3):
+    """Import de module dans des processus neufs avec python -X importtime.
+    Retourne le meilleur temps cumulé (s) et les modules au temps propre le plus élevé lors de cette exécution."""
+    best = None
+    work = tempfile.mkdtemp(prefix="bench-import-")
+    env = dict(os.environ)
+    env.update({
+        "LOG_FILE": os.path.join(work, "bench.log"),
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get("PYTHONPATH")])),
+    })
+    try:
+        for _ in range(max(1, runs)):
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                  cwd=work, env=env, capture_output=True, text=True)
+            if proc.returncode != 0:
+                return {"error": (proc.stderr.strip().splitlines() or ["échec"])[-1]}
+            timings = []  # (propre µs, cumulé µs, module)
+            for line in proc.stderr.splitlines():
+                if not line.startswith("import time:") or "|" not in line:
+                    continue
+                fields = [f.strip() for f in line[len("import time:"):].split("|")]
+                if fields[0].isdigit():
+                    timings.append((int(fields[0]), int(fields[1]), fields[2]))
+            total = next((t[1] for t in timings if t[2] == module), None)
+            if total is not None and (best is None or total < best[0]):
+                best = (total, timings)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    if best is None:
+        return {"error": f"{module} absent de la sortie -X importtime"}
+    total, timings = best
+    top = sorted(timings, reverse=True)[:8]
+    return {"cumulative_s": total / 1e6, "top": [[name, own / 1e6] for own, _, name in top]}
+
+
+# ----- orchestration -----
+
+def run_scenario(sink, mode, count, size, recipients, args):
+    work = tempfile.mkdtemp(prefix="bench-pipeline-")
+    try:
+        source = os.path.join(work, "files")
+        backup = os.path.join(work, "backup")
+        os.makedirs(source)
+        os.makedirs(backup)
+        journal = os.path.join(work, "journal.db")
+        with open(os.path.join(work, "users.json"), "w", encoding="utf-8") as f:
+            json.dump([{"email": f"dest{i}@bench.invalid"} for i in range(recipients)], f)
+        with open(os.path.join(work, "extension.json"), "w", encoding="utf-8") as f:
+            json.dump({"ext": ["csv"]}, f)
+
+        spec = {"mode": mode, "source": source, "backup": backup, "journal": journal, "timeout": args.timeout}
+        if mode == "send":
+            spec["files"] = write_files(source, count, size, args.seed)
+        elif mode == "from-backup":
+            spec["files"] = write_files(backup, count, size, args.seed)
+        elif mode == "success":
+            write_files(source, count, size, args.seed, suffix=".success")
+        else:
+            spec["staged"] = write_files(os.path.join(work, "staging"), count, size, args.seed)
+
+        host, port = sink.address
+        env = dict(os.environ)
+        env.update({
+            "EMAIL_EXPEDITEUR": "bench@bench.invalid", "MOT_DE_PASSE": "bench", "SMTP_SERVER": host,
+            "SMTP_PORT": str(port), "DOSSIER_FICHIERS": source, "DOSSIER_SAUVEGARDE": backup,
+            "USERS_FILE": os.path.join(work, "users.json"), "EXTENSIONS_FILE": os.path.join(work, "extension.json"),
+            "LOG_FILE": os.path.join(work, "bench.log"), "JOURNAL_FILE": journal,
+            "ROUTES_FILE": os.path.join(work, "routes.json"), "DOSSIER_DEAD_LETTER": os.path.join(work, "dead_letter"),
+            "SEND_ATTACHMENTS": "1" if args.attachments else "0", "NOTIFY_ON_ERROR": "0", "NOTIFY_ON_SUCCESS": "0",
+            "PYTHONPATH": os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get("PYTHONPATH")])),
+        })
+        env.update(dict(item.split("=", 1) for item in args.env))
+
+        before = sink.stats.snapshot()
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(spec)],
+            cwd=work, env=env, capture_output=True, text=True, timeout=args.timeout + 60,
+        )
+        after = sink.stats.snapshot()
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            return {"error": (proc.stderr.strip().splitlines() or ["échec"])[-1]}
+        result = json.loads(lines[-1])
+        if "error" in result:
+            return result
+
+        elapsed = max(result["elapsed_s"], 1e-9)
+        latencies = result.pop("latencies")
+        result.update({
+            "files_per_s": result["processed"] / elapsed,
+            "mb_per_s": result["processed"] * size / 1e6 / elapsed,
+            "p50_s": percentile(latencies, 50),
+            "p99_s": percentile(latencies, 99),
+            "smtp_messages": after["messages"] - before["messages"],
+            "smtp_connections": after["connections"] - before["connections"],
+        })
+        return result
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance):
+    """Liste des régressions (débit ou p99) au-delà de tolerance, par rapport à baseline."""
+    regressions = []
+    for key, result in results.items():
+        old = baseline.get(key)
+        if not old or "error" in result or "error" in old:
+            continue
+        if key.startswith("import/"):
+            # marge absolue de 5 ms : en dessous, c'est le bruit d'un démarrage de processus
+            if result["cumulative_s"] > max(old["cumulative_s"] * (1 + tolerance), old["cumulative_s"] + 0.005):
+                regressions.append(f"{key}: {old['cumulative_s'] * 1000:.1f} -> {result['cumulative_s'] * 1000:.1f} ms")
+            continue
+        if result["files_per_s"] < old["files_per_s"] * (1 - tolerance):
+            regressions.append(f"{key}: débit {old['files_per_s']:.1f} -> {result['files_per_s']:.1f} fichiers/s")
+        if result.get("p99_s") and old.get("p99_s") and result["p99_s"] > old["p99_s"] * (1 + tolerance):
+            regressions.append(f"{key}: p99 {old['p99_s']:.3f} -> {result['p99_s']:.3f} s")
+    return regressions
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de bout en bout contre un serveur SMTP local")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--files", default="50,500", help="Nombres de fichiers (liste)")
+    parser.add_argument("--sizes", default="4k,256k", help="Tailles de fichier (liste, suffixes k/M/G)")
+    parser.add_argument("--recipients", default="1,5", help="Nombres de destinataires (liste)")
+    parser.add_argument("--latency", type=float, default=0.01, help="Latence (s) du serveur SMTP par message")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Proportion de destinataires refusés en 451")
+    parser.add_argument("--attachments", type=int, default=1, help="1: pièces jointes, 0: message informatif")
+    parser.add_argument("--env", action="append", default=[], help="Variable KEY=VALUE pour le processus mesuré")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="Écrit les résultats (JSON) dans ce fichier")
+    parser.add_argument("--baseline", help="Résultats précédents (JSON) à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--import-runs", type=int, default=3, help="Processus neufs pour mesurer l'import (0: pas de mesure)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(json.loads(args.worker))
+        return
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip() in MODES]
+    counts = [int(c) for c in args.files.split(",") if c.strip()]
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    recipients = [int(r) for r in args.recipients.split(",") if r.strip()]
+
+    results = {}
+    if args.import_runs > 0:
+        result = results["import/send_files"] = measure_importtime("send_files", args.import_runs)
+        if "error" in result:
+            print(f"import send_files: {result['error']}")
+        else:
+            top = ", ".join(f"{name} {own * 1000:.1f}" for name, own in result["top"][:5])
+            print(f"import send_files: {result['cumulative_s'] * 1000:.1f} ms (temps propre, ms : {top})")
+
+    sink = SMTPSink(latency=args.latency, fail_rate=args.fail_rate, seed=args.seed).start()
+    print(f"{'scénario':<34} {'fichiers/s':>10} {'Mo/s':>8} {'p50 (s)':>8} {'p99 (s)':>8} {'RSS (Mo)':>9} {'import (s)':>10} {'msg':>6}")
+    try:
+        for mode, count, size, rcpt in itertools.product(modes, counts, sizes, recipients):
+            if mode == "success" and rcpt != recipients[0]:
+                continue  # sans envoi : le nombre de destinataires ne change rien
+            key = f"{mode}/{count}x{format_size(size)}/{rcpt}dest"
+            result = run_scenario(sink, mode, count, size, rcpt, args)
+            results[key] = result
+            if "error" in result:
+                print(f"{key:<34} ignoré: {result['error']}")
+                continue
+            print(f"{key:<34} {result['files_per_s']:>10.1f} {result['mb_per_s']:>8.1f} {_fmt(result['p50_s'], '8.3f'):>8} "
+                  f"{_fmt(result['p99_s'], '8.3f'):>8} {_fmt(result['peak_rss_mb'], '9.1f'):>9} {result['import_s']:>10.3f} "
+                  f"{result['smtp_messages']:>6}")
+    finally:
+        sink.stop()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"RÉGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Serveur SMTP local qui accepte et jette les messages, pour les benchmarks (et les essais sans vrai serveur).
+
+    python benchmarks/smtp_sink.py [--port 2525] [--latency 0.05] [--fail-rate 0.01] [--permanent-rate 0.001]
+
+- latency : délai (s) ajouté avant la réponse à DATA, comme un vrai relais qui analyse le message
+- fail-rate / permanent-rate : proportion de destinataires refusés en 451 (temporaire) / 550 (définitif)
+Le serveur parle SMTP en clair : le client doit remplacer smtplib.SMTP_SSL par smtplib.SMTP (cf. bench_pipeline).
+"""
+import argparse
+import random
+import socketserver
+import threading
+import time
+
+
+class SinkStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.recipients = 0
+        self.refused = 0
+        self.bytes = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(connections=self.connections, messages=self.messages, recipients=self.recipients,
+                        refused=self.refused, bytes=self.bytes)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        sink = self.server.sink
+        sink.stats.add(connections=1)
+        self.reply("220 smtp-sink ESMTP")
+        rcpts = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].split(":", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250-smtp-sink")
+                self.reply("250-SIZE 0")
+                self.reply("250-8BITMIME")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif verb == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                rcpts = []
+                self.reply("250 2.1.0 Ok")
+            elif verb == "RCPT":
+                code = sink.recipient_code()
+                if code == 250:
+                    rcpts.append(command)
+                    self.reply("250 2.1.5 Ok")
+                else:
+                    sink.stats.add(refused=1)
+                    self.reply(f"{code} {'4.2.0 Try again later' if code < 500 else '5.1.1 User unknown'}")
+            elif verb == "DATA":
+                if not rcpts:
+                    self.reply("554 5.5.1 No valid recipients")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b".\r\n", b".\n"):
+                        break
+                    size += len(chunk)
+                if sink.latency:
+                    time.sleep(sink.latency)
+                sink.stats.add(messages=1, recipients=len(rcpts), bytes=size)
+                self.reply("250 2.0.0 Ok: queued")
+            elif verb in ("NOOP", "RSET"):
+                if verb == "RSET":
+                    rcpts = []
+                self.reply("250 2.0.0 Ok")
+            elif verb == "QUIT":
+                self.reply("221 2.0.0 Bye")
+                return
+            else:
+                self.reply("502 5.5.2 Command not recognized")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SMTPSink:
+    """Serveur SMTP jetable, servi par un thread par connexion."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, fail_rate=0.0, permanent_rate=0.0, seed=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.permanent_rate = permanent_rate
+        self.stats = SinkStats()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.sink = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def recipient_code(self):
+        with self._random_lock:
+            draw = self._random.random()
+        if draw < self.permanent_rate:
+            return 550
+        if draw < self.permanent_rate + self.fail_rate:
+            return 451
+        return 250
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="smtp-sink", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur SMTP local qui jette les messages reçus")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--permanent-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port, args.latency, args.fail_rate, args.permanent_rate).start()
+    host, port = sink.address
+    print(f"smtp-sink en écoute sur {host}:{port} (Ctrl+C pour arrêter)")
+    try:
+        while True:
+            time.sleep(10)
+            print(sink.stats.snapshot())
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
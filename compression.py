@@ -0,0 +1,93 @@
+import gzip
+import os
+import shutil
+import tempfile
+import zipfile
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+
+COMPRESSION = os.getenv('COMPRESSION', 'none').lower()  # 'none', 'gzip', 'zip' ou 'zstd' (si le paquet zstandard est installé)
+COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', '6'))
+COPY_BUFFER = 1024 * 1024
+
+# formats déjà compressés : les recompresser coûte du CPU sans rien gagner
+SKIP_EXTENSIONS = frozenset(
+    ['.gz', '.tgz', '.zip', '.bz2', '.xz', '.7z', '.rar', '.zst', '.lz4', '.br',
+     '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.mkv', '.avi', '.mov',
+     '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.pdf']
+    + [e.strip().lower() for e in os.getenv('COMPRESSION_SKIP', '').split(',') if e.strip()]
+)
+
+SUFFIXES = {'gzip': '.gz', 'zip': '.zip', 'zstd': '.zst'}
+
+
+def resolve_method(method=COMPRESSION, logger=None):
+    """Retourne la méthode effectivement utilisable ('none' si désactivée) ; zstd retombe sur gzip si absent."""
+    method = (method or 'none').lower()
+    if method == 'zstd' and zstandard is None:
+        if logger:
+            logger.warning("Compression zstd demandée mais le paquet 'zstandard' n'est pas installé : utilisation de gzip")
+        return 'gzip'
+    if method not in SUFFIXES:
+        return 'none'
+    return method
+
+
+def should_compress(path):
+    return os.path.splitext(path)[1].lower() not in SKIP_EXTENSIONS
+
+
+def compress_file(path, dest_dir, method, level=COMPRESSION_LEVEL):
+    """Compresse path en flux (tampon de COPY_BUFFER octets) vers dest_dir et retourne le chemin produit."""
+    name = os.path.basename(path)
+    dest = os.path.join(dest_dir, name + SUFFIXES[method])
+    with open(path, 'rb') as src:
+        if method == 'gzip':
+            with open(dest, 'wb') as raw, gzip.GzipFile(filename=name, mode='wb', fileobj=raw, compresslevel=level) as out:
+                shutil.copyfileobj(src, out, COPY_BUFFER)
+        elif method == 'zip':
+            with zipfile.ZipFile(dest, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=level) as zf:
+                with zf.open(name, 'w', force_zip64=True) as out:
+                    shutil.copyfileobj(src, out, COPY_BUFFER)
+        else:
+            with open(dest, 'wb') as raw:
+                zstandard.ZstdCompressor(level=level).copy_stream(src, raw, read_size=COPY_BUFFER, write_size=COPY_BUFFER)
+    return dest
+
+
+def prepare_attachments(fichiers, dest_dir, method=COMPRESSION, level=COMPRESSION_LEVEL, logger=None):
+    """Compresse les fichiers compressibles dans dest_dir.
+    Retourne {chemin à joindre: fichier source} ; un fichier ignoré (extension déjà compressée), en erreur,
+    ou qui ne gagne rien à la compression est joint tel quel.
+    """
+    method = resolve_method(method, logger=logger)
+    attachments = {}
+    noms = set()
+    for fichier in fichiers:
+        if method == 'none' or not should_compress(fichier):
+            attachments[fichier] = fichier
+            continue
+        # même nom venant d'un autre sous-dossier : compressé à part pour ne pas écraser le premier
+        nom = os.path.basename(fichier)
+        cible = tempfile.mkdtemp(dir=dest_dir) if nom in noms else dest_dir
+        noms.add(nom)
+        try:
+            compresse = compress_file(fichier, cible, method, level)
+        except Exception as e:
+            if logger:
+                logger.error(f"Erreur compression {fichier}, envoi sans compression: {e}")
+            attachments[fichier] = fichier
+            continue
+        taille, taille_compressee = os.path.getsize(fichier), os.path.getsize(compresse)
+        if taille_compressee >= taille:
+            os.remove(compresse)
+            attachments[fichier] = fichier
+            continue
+        attachments[compresse] = fichier
+        if logger:
+            logger.info(f"Compressé ({method}) {fichier}: {taille} -> {taille_compressee} octets")
+    return attachments
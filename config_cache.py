@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+
+
+class CachedJSON:
+    """Contenu d'un fichier JSON, relu uniquement quand le fichier change (mtime, taille ou inode).
+    - transform(data) est appliqué une fois par rechargement (ex: compilation en set)
+    - un appel à get() coûte un simple stat tant que le fichier n'a pas changé
+    """
+
+    def __init__(self, path, transform=None):
+        self.path = path
+        self.transform = transform
+        self._lock = threading.Lock()
+        self._key = None
+        self._value = None
+
+    def get(self):
+        st = os.stat(self.path)
+        key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if key == self._key:
+            return self._value
+        with self._lock:
+            if key != self._key:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self._value = self.transform(data) if self.transform else data
+                self._key = key
+            return self._value
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def cached_json(path, transform=None):
+    """Retourne le CachedJSON partagé pour (path, transform)."""
+    key = (os.path.abspath(path), transform)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            entry = _cache[key] = CachedJSON(path, transform)
+        return entry
+
+
+def normalize_extensions(extensions):
+    """frozenset d'extensions en minuscules avec le point ("CSV", ".csv" -> ".csv")."""
+    return frozenset(("." + e.lower().lstrip(".")) for e in extensions if isinstance(e, str) and e.strip("."))
+
+
+def _compile_extensions(data):
+    return normalize_extensions(data.get("ext", []))
+
+
+def _extract_emails(users):
+    return tuple(u.get("email") for u in users if u.get("email"))
+
+
+def load_extensions(extensions_file):
+    """Extensions autorisées (minuscules, avec le point) sous forme de frozenset, rechargées si le fichier change."""
+    return cached_json(extensions_file, _compile_extensions).get()
+
+
+def load_recipients(users_file):
+    """Adresses e-mail de users.json, rechargées si le fichier change."""
+    return list(cached_json(users_file, _extract_emails).get())
+
+
+def is_allowed(path, extensions):
+    return os.path.splitext(path)[1].lower() in extensions
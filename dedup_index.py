@@ -0,0 +1,152 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+HASH_BUFFER = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    backup_path TEXT,
+    delivered REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contents_size ON contents (size);
+CREATE INDEX IF NOT EXISTS contents_backup_path ON contents (backup_path);
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_BUFFER)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DedupIndex:
+    """Index SQLite des contenus déjà livrés et sauvegardés, adressé par SHA-256.
+    - un fichier dont aucune entrée n'a la même taille ne peut pas être un doublon : il n'est pas haché
+    - le hash d'un chemin est mis en cache sous la clé (taille, mtime, inode) pour ne pas relire un fichier inchangé
+    Les recherches passent par des index B-tree et restent en O(log n) avec des millions d'entrées.
+    """
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def digest(self, path, st=None):
+        """SHA-256 du fichier, relu seulement si taille/mtime/inode ont changé depuis le dernier calcul."""
+        st = st or os.stat(path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256 FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ? AND ino = ?",
+                (path, st.st_size, st.st_mtime_ns, st.st_ino),
+            ).fetchone()
+        if row:
+            return row[0]
+        digest = sha256_file(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, ino, sha256) VALUES (?, ?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, st.st_ino, digest),
+            )
+        return digest
+
+    def find_duplicate(self, path):
+        """Retourne (sha256, chemin de sauvegarde) si le contenu de path a déjà été livré et que sa sauvegarde
+        le contient toujours, sinon None. Une entrée dont la sauvegarde a disparu ou a été remplacée (fichier
+        de même nom au contenu différent) est retirée de l'index."""
+        st = os.stat(path)
+        with self._lock:
+            known_size = self._db.execute("SELECT 1 FROM contents WHERE size = ? LIMIT 1", (st.st_size,)).fetchone()
+        if not known_size:
+            return None
+        digest = self.digest(path, st)
+        with self._lock:
+            row = self._db.execute("SELECT backup_path FROM contents WHERE sha256 = ?", (digest,)).fetchone()
+        if not row:
+            return None
+        if self._holds(row[0], st.st_size, digest):
+            return digest, row[0]
+        with self._lock:
+            self._db.execute("DELETE FROM contents WHERE sha256 = ? AND backup_path = ?", (digest, row[0]))
+        if self.logger:
+            self.logger.warning(f"Sauvegarde indexée absente ou modifiée, entrée retirée de l'index: {row[0]}")
+        return None
+
+    def _holds(self, backup_path, size, digest):
+        """True si backup_path existe et contient encore ce contenu (taille puis SHA-256)."""
+        try:
+            st = os.stat(backup_path) if backup_path else None
+            return st is not None and st.st_size == size and self.digest(backup_path, st) == digest
+        except OSError:
+            return False
+
+    def record(self, path, backup_path):
+        """Enregistre le contenu de path (ou de sa copie backup_path) comme livré et sauvegardé."""
+        source = path if os.path.exists(path) else backup_path
+        st = os.stat(source)
+        digest = self.digest(source, st)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO contents (sha256, size, backup_path, delivered) VALUES (?, ?, ?, ?)",
+                (digest, st.st_size, backup_path, time.time()),
+            )
+            # backup_path a pu écraser la sauvegarde d'un autre contenu (même nom) : elle ne le contient plus
+            self._db.execute("DELETE FROM contents WHERE backup_path = ? AND sha256 != ?", (backup_path, digest))
+            self._db.execute("DELETE FROM hashes WHERE path IN (?, ?)", (path, backup_path))
+        return digest
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path, logger=None):
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = DedupIndex(path, logger=logger)
+        return index
+
+
+def link_or_skip(existing_backup, dest, logger=None):
+    """Crée dest comme lien physique vers la sauvegarde existante du même contenu (si possible).
+    Retourne True si dest est à la sortie ce même fichier ; un dest existant d'un autre contenu est laissé
+    tel quel (False) : le fichier doit alors suivre le chemin normal (envoi puis sauvegarde)."""
+    if not existing_backup or not os.path.exists(existing_backup):
+        return False
+    if os.path.exists(dest):
+        return os.path.samefile(existing_backup, dest)
+    try:
+        os.link(existing_backup, dest)
+        if logger:
+            logger.info(f"Doublon lié dans la sauvegarde: {dest} -> {existing_backup}")
+        return True
+    except OSError as e:
+        if logger:
+            logger.warning(f"Impossible de créer le lien physique {dest} -> {existing_backup}: {e}")
+        return False
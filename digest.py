@@ -0,0 +1,177 @@
+import atexit
+import csv
+import io
+import os
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+from urllib.parse import quote
+
+import metrics
+from send_email import _rate_limiter, is_permanent_error
+from smtp_pool import get_pool
+
+
+DIGEST_WINDOW = float(os.getenv('DIGEST_WINDOW', '300'))  # durée (s) pendant laquelle les nouveaux fichiers sont regroupés
+DIGEST_MAX_FILES = int(os.getenv('DIGEST_MAX_FILES', '5000'))  # fichiers max listés par message (au-delà : plusieurs messages)
+# URL sous laquelle le dossier de sauvegarde est publié (partage, serveur web) ; vide = pas de lien dans le récapitulatif
+DIGEST_LINK_BASE = os.getenv('DIGEST_LINK_BASE', '')
+
+SUJET_DIGEST = "Nouveaux fichiers sauvegardés"
+
+
+def backup_link(dest, backup_root, base=DIGEST_LINK_BASE):
+    """Lien vers dest (chemin dans la sauvegarde) sous base, ou None sans base ou hors de backup_root."""
+    if not base:
+        return None
+    rel = os.path.relpath(os.path.abspath(dest), os.path.abspath(backup_root))
+    if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+        return None
+    return base.rstrip("/") + "/" + quote(rel.replace(os.sep, "/"))
+
+
+def format_size(size):
+    for unit in ("o", "Ko", "Mo", "Go"):
+        if size < 1024 or unit == "Go":
+            return f"{size:.0f} {unit}" if unit == "o" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def build_digest(email_exp, recipient, entries, subject=SUJET_DIGEST):
+    """Message récapitulatif : liste des fichiers (nom, taille, SHA-256, lien) dans le texte et en manifest.csv."""
+    debut = datetime.fromtimestamp(entries[0].added).strftime("%Y-%m-%d %H:%M:%S")
+    fin = datetime.fromtimestamp(entries[-1].added).strftime("%Y-%m-%d %H:%M:%S")
+    lines = [
+        "Bonjour,", "",
+        f"{len(entries)} nouveau(x) fichier(s) sauvegardé(s) entre le {debut} et le {fin} :", "",
+    ]
+    for entry in entries:
+        lines.append(f"- {entry.name} ({format_size(entry.size)}) sha256={entry.sha256 or '-'}")
+        if entry.link:
+            lines.append(f"  {entry.link}")
+    lines += ["", "Le manifeste complet est joint (manifest.csv). Ce message est informatif uniquement.", "", "Cordialement."]
+
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(["name", "size", "sha256", "link", "added"])
+    for entry in entries:
+        added = datetime.fromtimestamp(entry.added).isoformat(timespec="seconds")
+        writer.writerow([entry.name, entry.size, entry.sha256 or "", entry.link or "", added])
+
+    msg = EmailMessage()
+    msg["From"] = email_exp
+    msg["To"] = recipient
+    msg["Subject"] = subject
+    msg.set_content("\n".join(lines))
+    msg.add_attachment(manifest.getvalue().encode("utf-8"), maintype="text", subtype="csv", filename="manifest.csv")
+    return msg
+
+
+class RecipientDigest:
+    """Récapitulatif par destinataire des nouveaux fichiers (mode informatif, SEND_ATTACHMENTS désactivé).
+    - les fichiers sont inscrits dans le journal (DeliveryJournal.queue_digest) : rien n'est perdu en cas d'arrêt
+    - wake() démarre une fenêtre de `window` secondes ; à son terme, chaque destinataire reçoit un seul message
+      listant tous ses fichiers en attente, et ces fichiers lui sont alors comptés comme livrés
+    - un échec temporaire laisse les lignes en attente pour la fenêtre suivante ; un refus définitif (5xx)
+      les abandonne et l'enregistre comme échec dans le journal
+    """
+
+    def __init__(self, journal, smtp_server, smtp_port, email_exp, password, window=DIGEST_WINDOW, logger=None):
+        self.journal = journal
+        self.smtp = (smtp_server, smtp_port, email_exp, password)
+        self.email_exp = email_exp
+        self.window = window
+        self.logger = logger
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="digest", daemon=True)
+        self._thread.start()
+        if journal.stats()["digest"]["entries"]:
+            self.wake()  # récapitulatifs laissés en attente par une exécution précédente
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=30):
+        """Envoie les récapitulatifs en attente sans attendre la fin de la fenêtre, puis arrête le thread."""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            if self._stop.wait(self.window):
+                return
+            self._wake.clear()
+            if self.flush():
+                self._wake.set()  # échecs temporaires : nouvel essai à la fenêtre suivante
+
+    def flush(self):
+        """Envoie un message par destinataire en attente ; retourne le nombre de lignes restées en attente."""
+        with self._flush_lock:
+            restant = 0
+            pool = None
+            for recipient, entries in self.journal.pending_digest().items():
+                for start in range(0, len(entries), DIGEST_MAX_FILES):
+                    lot = entries[start:start + DIGEST_MAX_FILES]
+                    count = (len(entries) + DIGEST_MAX_FILES - 1) // DIGEST_MAX_FILES
+                    subject = SUJET_DIGEST if count == 1 else f"{SUJET_DIGEST} ({start // DIGEST_MAX_FILES + 1}/{count})"
+                    pool = pool or get_pool(*self.smtp, logger=self.logger)
+                    if not self._send(pool, recipient, lot, subject):
+                        restant += len(lot)
+            return restant
+
+    def _send(self, pool, recipient, entries, subject):
+        msg = build_digest(self.email_exp, recipient, entries, subject)
+        _rate_limiter.wait(recipient)
+        start = time.perf_counter()
+        try:
+            with pool.connection() as serveur:
+                serveur.send_message(msg)
+        except Exception as exc:
+            metrics.smtp_send_seconds.observe(time.perf_counter() - start, result="error")
+            if not is_permanent_error(exc):
+                if self.logger:
+                    self.logger.warning(f"Récapitulatif pour {recipient} non envoyé, nouvel essai plus tard: {exc}")
+                return False
+            for entry in entries:
+                self.journal.record_failure(entry.file_id, recipient, exc, permanent=True)
+            self.journal.drop_digest(entries)
+            metrics.delivery_failures.inc(len(entries), outcome="dead")
+            if self.logger:
+                self.logger.error(f"Récapitulatif refusé définitivement par {recipient} ({len(entries)} fichier(s)): {exc}")
+            return True
+        metrics.smtp_send_seconds.observe(time.perf_counter() - start, result="ok")
+        self.journal.digest_sent(recipient, entries)
+        if self.logger:
+            self.logger.info(f"Récapitulatif envoyé à {recipient}: {len(entries)} fichier(s)")
+        return True
+
+
+_digest = None
+_digest_lock = threading.Lock()
+
+
+def get_digest(journal, smtp_server, smtp_port, email_exp, password, logger=None):
+    """Retourne le RecipientDigest partagé (démarré au premier appel, vidé à la sortie du programme)."""
+    global _digest
+    with _digest_lock:
+        if _digest is None:
+            _digest = RecipientDigest(journal, smtp_server, smtp_port, email_exp, password, logger=logger)
+        return _digest
+
+
+def flush_digests():
+    global _digest
+    with _digest_lock:
+        digest, _digest = _digest, None
+    if digest is not None:
+        digest.stop()
+
+
+# enregistré après smtp_pool (importé par send_email) : les récapitulatifs partent avant la fermeture des sessions
+atexit.register(flush_digests)
@@ -0,0 +1,47 @@
+import os
+
+
+def scandir_files(directory, predicate=None):
+    """Liste les fichiers réguliers de directory en une seule passe os.scandir.
+    Le type vient de l'entrée de répertoire (d_type) : pas de stat supplémentaire par fichier sur la plupart des systèmes.
+    - predicate(name): filtre optionnel sur le nom
+    """
+    paths = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if predicate is None or predicate(entry.name):
+                    paths.append(entry.path)
+    except FileNotFoundError:
+        return []
+    return paths
+
+
+def walk_files(directory, predicate=None):
+    """Comme scandir_files, mais en descendant dans les sous-dossiers (liens symboliques de dossiers non suivis)."""
+    paths = []
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if predicate is None or predicate(entry.name):
+                        paths.append(entry.path)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+    return paths
+
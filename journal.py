@@ -0,0 +1,293 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import quote
+
+
+# états d'un fichier : pending -> sent (tous les destinataires servis) -> backed_up -> done (source supprimée)
+# ou dead (échec définitif pour au moins un destinataire, fichier déplacé dans le dossier dead-letter)
+PENDING, SENT, BACKED_UP, DONE, DEAD = "pending", "sent", "backed_up", "done", "dead"
+
+JOURNAL_RETENTION_DAYS = float(os.getenv('JOURNAL_RETENTION_DAYS', '30'))
+# nouvelles tentatives : délai initial et maximal (s) du backoff exponentiel, nombre max de tentatives
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '30'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '3600'))
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '10'))
+
+FileRecord = namedtuple("FileRecord", "id path size mtime_ns state")
+# une ligne du récapitulatif en attente d'un destinataire (mode digest)
+DigestEntry = namedtuple("DigestEntry", "id file_id name size sha256 link added")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (path, size, mtime_ns)
+);
+CREATE INDEX IF NOT EXISTS files_state ON files (state);
+CREATE TABLE IF NOT EXISTS deliveries (
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    recipient TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (file_id, recipient)
+);
+CREATE TABLE IF NOT EXISTS failures (
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    recipient TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (file_id, recipient)
+);
+CREATE INDEX IF NOT EXISTS failures_due ON failures (dead, next_attempt);
+CREATE TABLE IF NOT EXISTS digest (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    recipient TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT,
+    link TEXT,
+    added REAL NOT NULL,
+    UNIQUE (file_id, recipient)
+);
+CREATE INDEX IF NOT EXISTS digest_recipient ON digest (recipient, id);
+"""
+
+
+def _in_directory(path, directory, recursive=False):
+    if directory is None:
+        return True
+    if not recursive:
+        return os.path.dirname(path) == directory
+    return path.startswith(os.path.join(directory, ""))
+
+
+def backoff_delay(attempts, base=RETRY_BASE_DELAY, maximum=RETRY_MAX_DELAY):
+    """Délai avant la tentative suivante : base * 2^(attempts-1), plafonné, avec une gigue de ±50 %."""
+    return min(base * (2 ** max(0, attempts - 1)), maximum) * random.uniform(0.5, 1.5)
+
+
+class DeliveryJournal:
+    """Journal SQLite de l'état de livraison, par fichier et par destinataire.
+    Un fichier est identifié par (chemin, taille, mtime) : un nouveau fichier déposé sous le même nom
+    est donc une nouvelle entrée. Chaque transition est validée sur disque avant de passer à l'étape
+    suivante, si bien qu'après un arrêt brutal seul le travail inachevé est repris, sans doublon d'envoi.
+    read_only : consultation seule (--stats) ; le fichier n'est ni créé, ni migré, ni modifié.
+    """
+
+    def __init__(self, path, logger=None, read_only=False):
+        self.path = path
+        self.logger = logger
+        self._lock = threading.Lock()
+        if read_only:
+            self._db = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True,
+                                       check_same_thread=False, isolation_level=None)
+            return
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+
+    def begin(self, path):
+        """Enregistre le fichier s'il est inconnu et retourne son FileRecord (existant ou nouveau)."""
+        st = os.stat(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO files (path, size, mtime_ns, state, updated) VALUES (?, ?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, PENDING, time.time()),
+            )
+            row = self._db.execute(
+                "SELECT id, path, size, mtime_ns, state FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+        return FileRecord(*row)
+
+    def delivered_to(self, file_id):
+        with self._lock:
+            rows = self._db.execute("SELECT recipient FROM deliveries WHERE file_id = ?", (file_id,)).fetchall()
+        return {r[0] for r in rows}
+
+    def mark_delivered(self, file_id, recipient):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO deliveries (file_id, recipient, updated) VALUES (?, ?, ?)",
+                (file_id, recipient, time.time()),
+            )
+            self._db.execute("DELETE FROM failures WHERE file_id = ? AND recipient = ?", (file_id, recipient))
+
+    def record_failure(self, file_id, recipient, error, permanent=False, max_attempts=RETRY_MAX_ATTEMPTS):
+        """Enregistre un échec de livraison ; au-delà de max_attempts ou si permanent, le destinataire est abandonné.
+        Retourne True si le destinataire est abandonné (dead)."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT attempts FROM failures WHERE file_id = ? AND recipient = ?", (file_id, recipient)
+            ).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            dead = permanent or attempts >= max_attempts
+            self._db.execute(
+                "INSERT OR REPLACE INTO failures (file_id, recipient, attempts, next_attempt, last_error, dead) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_id, recipient, attempts, time.time() + backoff_delay(attempts), str(error)[:1000], int(dead)),
+            )
+        return dead
+
+    def blocked_recipients(self, file_id, now=None):
+        """Destinataires à ne pas servir maintenant : {email: 'dead' | 'waiting'} (abandonnés ou en attente de backoff)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT recipient, dead, next_attempt FROM failures WHERE file_id = ?", (file_id,)
+            ).fetchall()
+        return {r: ('dead' if dead else 'waiting') for r, dead, due in rows if dead or due > now}
+
+    def failures(self, file_id):
+        """{destinataire: (tentatives, dernière erreur, abandonné)} pour un fichier."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT recipient, attempts, last_error, dead FROM failures WHERE file_id = ?", (file_id,)
+            ).fetchall()
+        return {r: (attempts, error, bool(dead)) for r, attempts, error, dead in rows}
+
+    def claim_due_retries(self, directory=None, limit=100, lease=RETRY_BASE_DELAY, recursive=False):
+        """Chemins des fichiers dont une nouvelle tentative est due (au plus limit), dans directory
+        (et ses sous-dossiers si recursive).
+        Ils sont réservés pendant `lease` secondes pour ne pas être resoumis pendant leur traitement."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT f.id, f.path FROM failures r JOIN files f ON f.id = r.file_id "
+                "WHERE r.dead = 0 AND r.next_attempt <= ? AND r.claimed_until <= ? AND f.state NOT IN (?, ?) "
+                "ORDER BY r.next_attempt",
+                (now, now, DONE, DEAD),
+            ).fetchall()
+            paths = []
+            for file_id, path in rows:
+                if not _in_directory(path, directory, recursive):
+                    continue
+                self._db.execute(
+                    "UPDATE failures SET claimed_until = ? WHERE file_id = ? AND dead = 0", (now + lease, file_id)
+                )
+                paths.append(path)
+                if len(paths) >= limit:
+                    break
+        return paths
+
+    def queue_digest(self, file_id, recipients, name, size, sha256=None, link=None):
+        """Inscrit le fichier dans le récapitulatif en attente de chaque destinataire (une fois par destinataire)."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO digest (file_id, recipient, name, size, sha256, link, added) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(file_id, r, name, size, sha256, link, now) for r in recipients],
+            )
+
+    def pending_digest(self):
+        """{destinataire: [DigestEntry...]} des récapitulatifs en attente, dans l'ordre d'arrivée."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT recipient, id, file_id, name, size, sha256, link, added FROM digest ORDER BY recipient, id"
+            ).fetchall()
+        pending = {}
+        for recipient, *entry in rows:
+            pending.setdefault(recipient, []).append(DigestEntry(*entry))
+        return pending
+
+    def digest_sent(self, recipient, entries):
+        """Récapitulatif envoyé : chaque fichier listé est livré au destinataire, les lignes sont retirées."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for entry in entries:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO deliveries (file_id, recipient, updated) VALUES (?, ?, ?)",
+                        (entry.file_id, recipient, now),
+                    )
+                    self._db.execute("DELETE FROM failures WHERE file_id = ? AND recipient = ?", (entry.file_id, recipient))
+                    self._db.execute("DELETE FROM digest WHERE id = ?", (entry.id,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def drop_digest(self, entries):
+        with self._lock:
+            self._db.executemany("DELETE FROM digest WHERE id = ?", [(entry.id,) for entry in entries])
+
+    def stats(self, now=None):
+        """Vue d'ensemble : {"files": {état: nombre}, "failures": {"waiting": n, "due": n, "dead": n},
+        "digest": {"entries": n, "recipients": n}}."""
+        now = time.time() if now is None else now
+        with self._lock:
+            states = self._db.execute("SELECT state, COUNT(*) FROM files GROUP BY state").fetchall()
+            waiting, due, dead = self._db.execute(
+                "SELECT COALESCE(SUM(dead = 0 AND next_attempt > ?), 0), COALESCE(SUM(dead = 0 AND next_attempt <= ?), 0), "
+                "COALESCE(SUM(dead), 0) FROM failures",
+                (now, now),
+            ).fetchone()
+            entries, recipients = self._db.execute("SELECT COUNT(*), COUNT(DISTINCT recipient) FROM digest").fetchone()
+        return {"files": dict(states), "failures": {"waiting": waiting, "due": due, "dead": dead},
+                "digest": {"entries": entries, "recipients": recipients}}
+
+    def set_state(self, file_id, state):
+        with self._lock:
+            self._db.execute("UPDATE files SET state = ?, updated = ? WHERE id = ?", (state, time.time(), file_id))
+
+    def unfinished(self, directory=None, recursive=False):
+        """Chemins dont le traitement n'est pas terminé et dont le fichier source est toujours présent et inchangé."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, size, mtime_ns FROM files WHERE state NOT IN (?, ?) ORDER BY id", (DONE, DEAD)
+            ).fetchall()
+        paths = []
+        for path, size, mtime_ns in rows:
+            if not _in_directory(path, directory, recursive):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_size == size and st.st_mtime_ns == mtime_ns:
+                paths.append(path)
+        return paths
+
+    def purge(self, days=JOURNAL_RETENTION_DAYS):
+        """Supprime les entrées terminées (ou abandonnées) depuis plus de `days` jours."""
+        with self._lock:
+            cur = self._db.execute(
+                "DELETE FROM files WHERE state IN (?, ?) AND updated < ?", (DONE, DEAD, time.time() - days * 86400)
+            )
+        return cur.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(path, logger=None):
+    """Retourne le journal partagé pour ce fichier (ouvert, et purgé des vieilles entrées, au premier appel)."""
+    with _journals_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            journal = DeliveryJournal(path, logger=logger)
+            removed = journal.purge()
+            if removed and logger:
+                logger.info(f"Journal de livraison: {removed} entrée(s) terminée(s) purgée(s)")
+            _journals[path] = journal
+        return journal
@@ -0,0 +1,185 @@
+import atexit
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+LEASE_TTL = float(os.getenv('LEASE_TTL', '120'))  # durée (s) d'un bail sans renouvellement avant qu'il puisse être repris
+
+
+def lease_key(path, root=None, namespace=""):
+    """Identifiant d'un fichier commun à toutes les instances : chemin relatif au dossier surveillé (root),
+    préfixé par namespace (nom de la route), indépendant du point de montage du partage sur chaque machine."""
+    rel = os.path.relpath(path, root) if root else os.path.basename(path)
+    rel = rel.replace(os.sep, "/")
+    return hashlib.sha1(f"{namespace}/{rel}".encode("utf-8", "surrogateescape")).hexdigest()
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _read_owner(lease_file):
+    try:
+        with open(lease_file, "r", encoding="utf-8") as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+class LeaseManager:
+    """Baux exclusifs sur des fichiers, partagés par plusieurs processus ou machines via un dossier commun.
+    - un bail est un fichier <clé>.lease créé avec O_CREAT|O_EXCL (atomique, y compris sur SMB/NFSv3+)
+    - les baux détenus sont renouvelés (mtime) par un thread toutes les ttl/3 secondes ; le bail d'une instance
+      arrêtée brutalement expire après ttl secondes et peut alors être repris par une autre
+    - la reprise d'un bail expiré passe par un verrou <clé>.lease.break, pour qu'une seule instance le casse
+    - les fichiers refusés (bail détenu ailleurs) sont mémorisés pour être resoumis plus tard (take_skipped)
+    """
+
+    def __init__(self, lease_dir, ttl=LEASE_TTL, owner=None, logger=None):
+        self.lease_dir = lease_dir
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._held = {}  # chemin -> fichier de bail
+        self._skipped = {}  # chemin -> étiquette (route) pour la resoumission
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(lease_dir, exist_ok=True)
+
+    def _lease_file(self, key):
+        return os.path.join(self.lease_dir, key + ".lease")
+
+    def _create(self, lease_file, path):
+        try:
+            fd = os.open(lease_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{self.owner}\n{path}\n")
+        return True
+
+    def _expired(self, lease_file):
+        try:
+            return time.time() - os.stat(lease_file).st_mtime > self.ttl
+        except FileNotFoundError:
+            return True
+
+    def _break(self, lease_file):
+        """Supprime un bail expiré ; retourne True si la place est libre."""
+        breaker = lease_file + ".break"
+        if not self._create(breaker, lease_file):
+            if self._expired(breaker):
+                _unlink(breaker)  # instance morte pendant la reprise
+            return False
+        try:
+            if not self._expired(lease_file):
+                return False
+            owner = _read_owner(lease_file)
+            _unlink(lease_file)
+            if self.logger and owner:
+                self.logger.warning(f"Bail expiré de {owner} repris: {lease_file}")
+            return True
+        finally:
+            _unlink(breaker)
+
+    def acquire(self, path, root=None, namespace=""):
+        """Prend le bail de path ; False s'il est détenu (et non expiré) par une autre instance."""
+        with self._lock:
+            if path in self._held:
+                return True
+        lease_file = self._lease_file(lease_key(path, root, namespace))
+        for _ in range(2):
+            if self._create(lease_file, path):
+                with self._lock:
+                    self._held[path] = lease_file
+                self._start_renewer()
+                return True
+            if not self._expired(lease_file) or not self._break(lease_file):
+                return False
+        return False
+
+    def claim(self, paths, root=None, namespace="", tag=None):
+        """Prend les baux disponibles et retourne les chemins obtenus ; les autres sont mémorisés avec tag."""
+        claimed = []
+        for path in paths:
+            if self.acquire(path, root, namespace):
+                claimed.append(path)
+            else:
+                with self._lock:
+                    self._skipped[path] = tag
+        if self.logger and len(claimed) < len(paths):
+            self.logger.info(f"{len(paths) - len(claimed)} fichier(s) en cours de traitement par une autre instance")
+        return claimed
+
+    def release(self, paths):
+        for path in paths:
+            with self._lock:
+                lease_file = self._held.pop(path, None)
+            if lease_file is not None and _read_owner(lease_file) == self.owner:
+                _unlink(lease_file)
+
+    def take_skipped(self):
+        """{chemin: tag} des fichiers refusés depuis le dernier appel et toujours présents."""
+        with self._lock:
+            skipped, self._skipped = self._skipped, {}
+        return {path: tag for path, tag in skipped.items() if os.path.exists(path)}
+
+    def stop(self):
+        """Arrête le renouvellement et libère les baux détenus."""
+        self._stop.set()
+        with self._lock:
+            held = list(self._held)
+        self.release(held)
+
+    def _start_renewer(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._renew, name="leases", daemon=True)
+                self._thread.start()
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl / 3):
+            with self._lock:
+                held = list(self._held.items())
+            for path, lease_file in held:
+                try:
+                    os.utime(lease_file)
+                except FileNotFoundError:
+                    with self._lock:
+                        self._held.pop(path, None)
+                    if self.logger:
+                        self.logger.warning(f"Bail perdu (expiré et repris par une autre instance): {path}")
+                except OSError as exc:
+                    if self.logger:
+                        self.logger.error(f"Impossible de renouveler le bail de {path}: {exc}")
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_leases(lease_dir, ttl=LEASE_TTL, logger=None):
+    """Retourne le LeaseManager partagé pour ce dossier de baux."""
+    with _managers_lock:
+        manager = _managers.get(lease_dir)
+        if manager is None:
+            manager = _managers[lease_dir] = LeaseManager(lease_dir, ttl=ttl, logger=logger)
+        return manager
+
+
+def release_all():
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        manager.stop()
+
+
+atexit.register(release_all)
@@ -0,0 +1,246 @@
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+
+LOG_BLOCK_SIZE = 64 * 1024  # octets lus à chaque pas en remontant le fichier
+
+# en-tête d'une entrée au format texte : "2024-01-31 12:00:00,123 - LEVEL - message"
+_TEXT_HEADER = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:[,.]\d+)?) - ([A-Z]+) - (.*)$")
+_RELATIVE = re.compile(r"^(\d+(?:\.\d+)?)\s*([smhdw])$")
+_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Une entrée par ligne JSON : time, level, message, et file / exc quand ils existent.
+    file vient de extra={"file": chemin} dans l'appel au logger."""
+
+    def format(self, record):
+        data = {
+            "time": f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}",
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        fichier = getattr(record, "file", None)
+        if fichier:
+            data["file"] = fichier
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def parse_time(text, now=None):
+    """Date ISO ("2024-01-31", "2024-01-31 12:00", "2024-01-31T12:00+02:00") ou durée relative à maintenant
+    ("30m", "2h", "7d"). Retourne une date locale naïve, comparable aux dates des entrées du log ;
+    une saisie invalide lève argparse.ArgumentTypeError (erreur d'usage de la ligne de commande)."""
+    match = _RELATIVE.match(text.strip().lower())
+    if match:
+        return (now or datetime.now()) - timedelta(**{_UNITS[match.group(2)]: float(match.group(1))})
+    try:
+        when = datetime.fromisoformat(text.strip())
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"date invalide: {text!r} (attendu : date ISO comme 2024-01-31 12:00, ou durée comme 30m, 2h, 7d)"
+        ) from None
+    if when.tzinfo is not None:
+        when = when.astimezone().replace(tzinfo=None)
+    return when
+
+
+def parse_level(text):
+    """Nom de niveau de log (insensible à la casse), normalisé en majuscules ;
+    un nom inconnu lève argparse.ArgumentTypeError (erreur d'usage de la ligne de commande)."""
+    level = text.strip().upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise argparse.ArgumentTypeError(
+            f"niveau de log inconnu: {text!r} (attendu : DEBUG, INFO, WARNING, ERROR ou CRITICAL)"
+        )
+    return level
+
+
+def log_files(log_file):
+    """Le fichier de log puis ses sauvegardes de rotation (log.1, log.2...), du plus récent au plus ancien."""
+    directory = os.path.dirname(os.path.abspath(log_file))
+    prefix = os.path.basename(log_file) + "."
+    rotated = []
+    try:
+        for entry in os.scandir(directory):
+            suffix = entry.name[len(prefix):]
+            if entry.name.startswith(prefix) and suffix.isdigit():
+                rotated.append((int(suffix), entry.path))
+    except FileNotFoundError:
+        return []
+    files = [log_file] if os.path.isfile(log_file) else []
+    return files + [path for _, path in sorted(rotated)]
+
+
+def reverse_lines(path, block_size=LOG_BLOCK_SIZE):
+    """Lignes d'un fichier de la dernière à la première, lues par blocs depuis la fin : le coût dépend
+    du nombre de lignes consommées, pas de la taille du fichier."""
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        reste = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            lignes = (f.read(step) + reste).split(b"\n")
+            reste = lignes.pop(0)
+            for ligne in reversed(lignes):
+                if ligne.strip():
+                    yield ligne.rstrip(b"\r").decode("utf-8", "replace")
+        if reste.strip():
+            yield reste.rstrip(b"\r").decode("utf-8", "replace")
+
+
+def parse_entry(lines):
+    """Entrée (liste de lignes : en-tête puis suite éventuelle, trace d'exception...) -> dict time/level/message/file."""
+    first = lines[0]
+    if first.startswith("{"):
+        try:
+            data = json.loads(first)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            try:
+                data["time"] = datetime.fromisoformat(data.get("time", ""))
+            except (TypeError, ValueError):
+                data["time"] = None
+            data["raw"] = "\n".join(lines)
+            return data
+    match = _TEXT_HEADER.match(first)
+    if match is None:
+        return {"time": None, "level": None, "message": "\n".join(lines), "raw": "\n".join(lines)}
+    return {
+        "time": datetime.fromisoformat(match.group(1).replace(",", ".")),
+        "level": match.group(2),
+        "message": "\n".join([match.group(3)] + lines[1:]),
+        "raw": "\n".join(lines),
+    }
+
+
+def _is_header(line):
+    return line.startswith("{") or _TEXT_HEADER.match(line) is not None
+
+
+def reverse_entries(log_file, block_size=LOG_BLOCK_SIZE):
+    """Entrées du log, rotations comprises, de la plus récente à la plus ancienne ;
+    les lignes de suite (traces d'exception) sont rattachées à leur en-tête."""
+    for path in log_files(log_file):
+        suite = []
+        try:
+            for line in reverse_lines(path, block_size):
+                if _is_header(line):
+                    yield parse_entry([line] + suite[::-1])
+                    suite = []
+                else:
+                    suite.append(line)
+        except FileNotFoundError:
+            continue  # rotation pendant la lecture
+        if suite:
+            yield parse_entry(suite[::-1])
+
+
+class LogFilter:
+    """Critères d'une requête : niveau minimal, fichier (champ file, sinon présence dans le message), intervalle de temps."""
+
+    def __init__(self, level=None, file=None, since=None, until=None):
+        self.level = logging.getLevelName(level.upper()) if level else None
+        if self.level is not None and not isinstance(self.level, int):
+            raise ValueError(f"Niveau de log inconnu: {level}")
+        self.file = file
+        self.since = since
+        self.until = until
+
+    def __bool__(self):
+        return any(v is not None for v in (self.level, self.file, self.since, self.until))
+
+    def matches(self, entry):
+        if self.level is not None:
+            level = logging.getLevelName(entry.get("level") or "")
+            if not isinstance(level, int) or level < self.level:
+                return False
+        if self.file is not None:
+            fichier = entry.get("file")
+            if self.file not in (fichier if fichier else entry.get("message", "")):
+                return False
+        when = entry.get("time")
+        if self.since is not None and (when is None or when < self.since):
+            return False
+        if self.until is not None and (when is None or when > self.until):
+            return False
+        return True
+
+    def past(self, entry):
+        """True quand entry (et donc tout ce qui précède) est antérieure à since : la remontée peut s'arrêter."""
+        when = entry.get("time")
+        return self.since is not None and when is not None and when < self.since
+
+
+def tail(log_file, count=100, query=None, block_size=LOG_BLOCK_SIZE):
+    """Les count dernières entrées (satisfaisant query), dans l'ordre chronologique.
+    Seuls les blocs nécessaires sont lus, en remontant au besoin dans les fichiers de rotation."""
+    query = query or LogFilter()
+    found = []
+    for entry in reverse_entries(log_file, block_size):
+        if query.past(entry):
+            break
+        if query.matches(entry):
+            found.append(entry)
+            if len(found) >= count:
+                break
+    return found[::-1]
+
+
+def follow(log_file, query=None, interval=0.5, stop=None):
+    """Suit le log (comme tail -f) et produit les nouvelles entrées satisfaisant query ;
+    une rotation (fichier remplacé ou tronqué) est détectée et le nouveau fichier repris depuis son début.
+    stop : threading.Event facultatif pour arrêter le suivi."""
+    query = query or LogFilter()
+    f = None
+    from_start = False  # après une rotation, le nouveau fichier est lu en entier
+    pending = b""
+    shown = not query  # les lignes de suite (traces d'exception) suivent le sort de leur en-tête
+    try:
+        while stop is None or not stop.is_set():
+            if f is None:
+                try:
+                    f = open(log_file, "rb")
+                except FileNotFoundError:
+                    from_start = True
+                    time.sleep(interval)
+                    continue
+                if not from_start:
+                    f.seek(0, os.SEEK_END)
+            chunk = f.read(LOG_BLOCK_SIZE)
+            if chunk:
+                *lines, pending = (pending + chunk).split(b"\n")
+                for line in lines:
+                    text = line.rstrip(b"\r").decode("utf-8", "replace")
+                    if not text.strip():
+                        continue
+                    if _is_header(text):
+                        entry = parse_entry([text])
+                        shown = query.matches(entry)
+                    else:
+                        entry = {"time": None, "level": None, "message": text, "raw": text}
+                    if shown:
+                        yield entry
+                continue
+            try:
+                st = os.stat(log_file)
+                replaced = st.st_ino != os.fstat(f.fileno()).st_ino or st.st_size < f.tell()
+            except FileNotFoundError:
+                replaced = True
+            if replaced:
+                f.close()
+                f, from_start, pending = None, True, b""
+                continue
+            time.sleep(interval)
+    finally:
+        if f is not None:
+            f.close()
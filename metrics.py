@@ -0,0 +1,240 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# adresse du point /metrics (format texte Prometheus) en mode watch ; port 0 = désactivé
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# secondes : de la milliseconde (NOOP, copie par renommage) à plusieurs minutes (gros envoi)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _labels_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = [(n, v) for n, v in zip(labelnames, key)] + list(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Compteur cumulatif, éventuellement décliné par étiquettes (inc(route="compta"))."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+    def snapshot(self):
+        with self._lock:
+            return {",".join(k) if k else "": v for k, v in self._values.items()}
+
+
+class Gauge(Counter):
+    """Valeur instantanée : fixée par set(), ou calculée à chaque lecture par callback() -> {(étiquettes...): valeur}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = _labels_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _current(self):
+        if self.callback is None:
+            with self._lock:
+                return dict(self._values)
+        try:
+            return {tuple(map(str, k)) if isinstance(k, tuple) else (str(k),): v for k, v in self.callback().items()}
+        except Exception:
+            return {}
+
+    def samples(self):
+        for key, value in sorted(self._current().items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+    def snapshot(self):
+        return {",".join(k) if k else "": v for k, v in self._current().items()}
+
+
+class Histogram:
+    """Distribution de valeurs (durées en secondes, débits...) par paliers cumulés, avec somme et nombre."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}  # étiquettes -> [comptes par palier..., somme, nombre]
+
+    def observe(self, value, **labels):
+        key = _labels_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {k: list(v) for k, v in self._values.items()}
+        for key, data in sorted(values.items()):
+            cumul = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data):
+                cumul += count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, [("le", _format_value(bound))]), cumul
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), data[-2]
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), data[-1]
+
+    def snapshot(self):
+        with self._lock:
+            values = {k: list(v) for k, v in self._values.items()}
+        result = {}
+        for key, data in values.items():
+            count, total = data[-1], data[-2]
+            result[",".join(key) if key else ""] = {
+                "count": count, "sum": round(total, 6), "avg": round(total / count, 6) if count else 0.0,
+            }
+        return result
+
+
+class Registry:
+    """Ensemble des métriques du processus ; render() produit le format texte d'exposition Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        gauge = self._register(Gauge(name, documentation, labelnames, callback))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+
+files_discovered = REGISTRY.counter("sendfiles_files_discovered_total", "Fichiers trouvés dans les dossiers surveillés", ["route"])
+files_accepted = REGISTRY.counter("sendfiles_files_accepted_total", "Fichiers à extension autorisée", ["route"])
+files_rejected = REGISTRY.counter("sendfiles_files_rejected_total", "Fichiers refusés (extension non autorisée)", ["route"])
+files_done = REGISTRY.counter("sendfiles_files_done_total", "Fichiers envoyés, sauvegardés et retirés de la source", ["route"])
+batch_seconds = REGISTRY.histogram("sendfiles_batch_seconds", "Durée de traitement d'un lot", ["route"])
+attachment_bytes = REGISTRY.counter("sendfiles_attachment_bytes_total", "Octets de pièces jointes envoyés (par destinataire)")
+smtp_connect_seconds = REGISTRY.histogram("sendfiles_smtp_connect_seconds", "Durée d'ouverture d'une connexion SMTP (TLS compris)")
+smtp_login_seconds = REGISTRY.histogram("sendfiles_smtp_login_seconds", "Durée de l'authentification SMTP")
+smtp_send_seconds = REGISTRY.histogram("sendfiles_smtp_send_seconds", "Durée d'envoi d'un message à un destinataire", ["result"])
+delivery_failures = REGISTRY.counter("sendfiles_delivery_failures_total", "Échecs de livraison par fichier et destinataire", ["outcome"])
+dead_letters = REGISTRY.counter("sendfiles_dead_letters_total", "Fichiers déplacés dans le dossier dead-letter")
+backup_bytes = REGISTRY.counter("sendfiles_backup_bytes_total", "Octets sauvegardés, par méthode", ["method"])
+backup_seconds = REGISTRY.histogram("sendfiles_backup_seconds", "Durée de sauvegarde d'un fichier, par méthode", ["method"])
+backup_throughput = REGISTRY.histogram(
+    "sendfiles_backup_copy_bytes_per_second", "Débit des copies vers la sauvegarde",
+    buckets=(1e6, 5e6, 1e7, 5e7, 1e8, 2.5e8, 5e8, 1e9, 2e9),
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST, registry=REGISTRY):
+    """Sert registry sur http://host:port/metrics dans un thread dédié ; retourne le serveur (None si port <= 0)."""
+    if port <= 0:
+        return None
+    handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,104 @@
+import base64
+import os
+import re
+import smtplib
+from email.message import EmailMessage, MIMEPart
+from email.policy import SMTP
+from email.utils import make_msgid, formatdate
+
+
+STREAM_BUFFER = int(os.getenv('STREAM_BUFFER', str(57 * 4096)))  # octets lus par bloc (arrondi à un multiple de 57)
+
+_LINE_BYTES = 57  # 57 octets bruts = une ligne base64 de 76 caractères
+
+
+def _headers_bytes(msg):
+    return b"".join(SMTP.fold_binary(name, value) for name, value in msg.items())
+
+
+def iter_message(headers, text, attachments, buffer_size=STREAM_BUFFER):
+    """Génère un message multipart/mixed par blocs, prêt pour la phase DATA (CRLF, dot-stuffing).
+    - headers: liste de (nom, valeur) d'en-têtes de premier niveau (From, To, Subject...)
+    - attachments: liste de (chemin, nom du fichier joint, offset, longueur) - cf. packing.Part -
+      lus et encodés en base64 bloc par bloc
+    La mémoire utilisée est bornée par buffer_size, quelle que soit la taille des fichiers.
+    """
+    chunk_size = max(_LINE_BYTES, buffer_size - buffer_size % _LINE_BYTES)
+    boundary = "===============" + make_msgid().strip("<>").replace("@", ".").replace("=", "")
+
+    top = EmailMessage()
+    for name, value in headers:
+        top[name] = value
+    if "Date" not in top:
+        top["Date"] = formatdate(localtime=True)
+    top["MIME-Version"] = "1.0"
+    top["Content-Type"] = f'multipart/mixed; boundary="{boundary}"'
+    yield _headers_bytes(top) + b"\r\n"
+
+    delimiter = b"--" + boundary.encode("ascii") + b"\r\n"
+
+    text_part = MIMEPart()
+    text_part.set_content(text)
+    # seule la partie texte peut contenir une ligne commençant par '.'
+    yield delimiter + re.sub(rb"(?m)^\.", b"..", text_part.as_bytes(policy=SMTP)) + b"\r\n"
+
+    for path, filename, offset, length in attachments:
+        part = MIMEPart()
+        part["Content-Type"] = "application/octet-stream"
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", "attachment", filename=filename)
+        yield delimiter + _headers_bytes(part) + b"\r\n"
+        with open(path, "rb") as f:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield base64.encodebytes(chunk).replace(b"\n", b"\r\n")
+        yield b"\r\n"
+
+    yield b"--" + boundary.encode("ascii") + b"--\r\n"
+
+
+def send_streamed(serveur, from_addr, to_addrs, chunks):
+    """Envoie un message généré par blocs (iter_message) directement sur la socket SMTP,
+    sans jamais le construire entièrement en mémoire. Lève les mêmes exceptions que sendmail().
+    """
+    serveur.ehlo_or_helo_if_needed()
+    code, resp = serveur.mail(from_addr)
+    if code != 250:
+        _rset_quietly(serveur)
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+    refused = {}
+    for addr in to_addrs:
+        code, resp = serveur.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+    if len(refused) == len(to_addrs):
+        _rset_quietly(serveur)
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    serveur.putcmd("data")
+    code, resp = serveur.getreply()
+    if code != 354:
+        _rset_quietly(serveur)
+        raise smtplib.SMTPDataError(code, resp)
+
+    for chunk in chunks:
+        serveur.send(chunk)
+    serveur.send(b".\r\n")
+    code, resp = serveur.getreply()
+    if code != 250:
+        _rset_quietly(serveur)
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+def _rset_quietly(serveur):
+    try:
+        serveur.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
@@ -0,0 +1,127 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from send_email import send_notification
+
+
+NOTIFY_WINDOW = float(os.getenv('NOTIFY_WINDOW', '60'))  # durée (s) pendant laquelle les événements sont regroupés
+MAX_LISTED_FILES = 50
+
+
+class NotificationDigest:
+    """Collecte les événements de succès/erreur et envoie un seul e-mail récapitulatif par fenêtre.
+    - event() ne fait qu'empiler l'événement : le traitement des fichiers n'attend jamais le SMTP
+    - la fenêtre démarre au premier événement ; un événement isolé est envoyé avec son sujet et son texte d'origine
+    """
+
+    def __init__(self, smtp_server, smtp_port, email_exp, password, users_file=None, notify_email=None,
+                 window=NOTIFY_WINDOW, logger=None):
+        self.smtp = dict(smtp_server=smtp_server, smtp_port=smtp_port, email_exp=email_exp, password=password,
+                         users_file=users_file, notify_email=notify_email)
+        self.window = window
+        self.logger = logger
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="notifications", daemon=True)
+        self._thread.start()
+
+    def event(self, success, subject, body, files=()):
+        self._queue.put((time.time(), success, subject, body, list(files)))
+
+    def stop(self, timeout=30):
+        """Envoie le récapitulatif en attente puis arrête le thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            events = [item]
+            deadline = time.monotonic() + self.window
+            stopping = False
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                events.append(item)
+            self._send(events)
+            if stopping:
+                return
+
+    def _send(self, events):
+        try:
+            subject, body = format_digest(events)
+            send_notification(subject=subject, body=body, logger=self.logger, **self.smtp)
+        except Exception as exc:
+            if self.logger:
+                self.logger.exception(f"Erreur lors de l'envoi du récapitulatif de notifications: {exc}")
+
+
+def format_digest(events):
+    """Retourne (sujet, texte) pour une liste d'événements (horodatage, succès, sujet, texte, fichiers)."""
+    if len(events) == 1:
+        _, _, subject, body, files = events[0]
+        if files:
+            body += "\n\nFichiers :\n" + "\n".join(f"- {os.path.basename(f)}" for f in files[:MAX_LISTED_FILES])
+        return subject, body
+
+    succes = [e for e in events if e[1]]
+    erreurs = [e for e in events if not e[1]]
+    debut = datetime.fromtimestamp(events[0][0]).strftime("%Y-%m-%d %H:%M:%S")
+    fin = datetime.fromtimestamp(events[-1][0]).strftime("%Y-%m-%d %H:%M:%S")
+    if erreurs:
+        subject = f"Erreur de sauvegarde ({len(erreurs)} erreur(s), {len(succes)} succès)"
+    else:
+        subject = f"Sauvegarde réussie ({len(succes)} traitement(s))"
+
+    lines = [f"Récapitulatif des traitements du {debut} au {fin} :", "",
+             f"- Succès : {len(succes)}", f"- Erreurs : {len(erreurs)}"]
+    fichiers = [f for e in succes for f in e[4]]
+    if fichiers:
+        lines += ["", f"Fichiers traités ({len(fichiers)}) :"]
+        lines += [f"- {os.path.basename(f)}" for f in fichiers[:MAX_LISTED_FILES]]
+        if len(fichiers) > MAX_LISTED_FILES:
+            lines.append(f"- ... et {len(fichiers) - MAX_LISTED_FILES} autre(s)")
+    if erreurs:
+        lines += ["", "Erreurs :"]
+        lines += [f"- {datetime.fromtimestamp(e[0]).strftime('%H:%M:%S')} {e[2]} : {e[3]}" for e in erreurs]
+    return subject, "\n".join(lines)
+
+
+_digest = None
+_digest_lock = threading.Lock()
+
+
+def get_digest(smtp_server, smtp_port, email_exp, password, users_file=None, notify_email=None, logger=None):
+    """Retourne le NotificationDigest partagé (démarré au premier appel, vidé à la sortie du programme)."""
+    global _digest
+    with _digest_lock:
+        if _digest is None:
+            _digest = NotificationDigest(smtp_server, smtp_port, email_exp, password, users_file=users_file,
+                                         notify_email=notify_email, logger=logger)
+        return _digest
+
+
+def flush_notifications():
+    global _digest
+    with _digest_lock:
+        digest, _digest = _digest, None
+    if digest is not None:
+        digest.stop()
+
+
+# enregistré après smtp_pool (importé par send_email) : le récapitulatif part avant la fermeture des sessions
+atexit.register(flush_notifications)
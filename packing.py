@@ -0,0 +1,70 @@
+import os
+from collections import namedtuple
+
+
+# une pièce jointe : tout ou partie (offset/length) d'un fichier source
+Part = namedtuple("Part", "path filename offset length")
+
+# marge réservée aux en-têtes, au texte et aux délimiteurs MIME d'un message
+MESSAGE_OVERHEAD = 64 * 1024
+# coût fixe d'une pièce jointe, compté en octets bruts : en-têtes MIME et délimiteur, dernière ligne base64 entamée
+PART_OVERHEAD = 1024
+
+
+def raw_budget(max_message_bytes):
+    """Octets bruts de pièces jointes qui tiennent dans un message de max_message_bytes une fois encodés en base64 :
+    57 octets bruts donnent une ligne de 76 caractères suivie de CRLF, soit 78 octets."""
+    return max(1, (max_message_bytes - MESSAGE_OVERHEAD) * 57 // 78)
+
+
+def part_cost(part):
+    """Place occupée par une pièce jointe dans le budget d'un lot : son contenu, ses en-têtes (nom de fichier
+    éventuellement encodé en RFC 2231, jusqu'à 3 octets par octet) et le reste fixe de PART_OVERHEAD."""
+    return part.length + PART_OVERHEAD + 3 * len(part.filename.encode("utf-8"))
+
+
+def split_file(path, budget):
+    """Découpe un fichier en parties numérotées d'au plus budget octets.
+    Un fichier qui tient dans le budget donne une seule Part portant son nom d'origine ;
+    sinon les parties s'appellent nom.part001, nom.part002... (reconstitution : cat nom.part* > nom).
+    """
+    size = os.path.getsize(path)
+    name = os.path.basename(path)
+    if size <= budget:
+        return [Part(path, name, 0, size)]
+    count = (size + budget - 1) // budget
+    width = max(3, len(str(count)))
+    return [
+        Part(path, f"{name}.part{i + 1:0{width}d}", i * budget, min(budget, size - i * budget))
+        for i in range(count)
+    ]
+
+
+def pack_files(fichiers, budget):
+    """Répartit les fichiers (découpés si nécessaire) en lots dont le coût total (part_cost) reste sous budget.
+    First-fit decreasing : les plus grosses parties sont placées d'abord dans le premier lot qui a la place.
+    Les parties d'un même fichier gardent leur ordre. Retourne une liste de lots (listes de Part).
+    """
+    parts = []
+    for fichier in fichiers:
+        # la taille des parties laisse la place de leurs en-têtes (nom.partNNN compris)
+        marge = PART_OVERHEAD + 3 * (len(os.path.basename(fichier).encode("utf-8")) + 16)
+        parts.extend(split_file(fichier, max(1, budget - marge)))
+
+    lots = []
+    restes = []
+    for part in sorted(parts, key=part_cost, reverse=True):
+        cost = part_cost(part)
+        for i, reste in enumerate(restes):
+            if cost <= reste:
+                lots[i].append(part)
+                restes[i] -= cost
+                break
+        else:
+            lots.append([part])
+            restes.append(budget - cost)
+
+    ordre = {(p.path, p.offset): i for i, p in enumerate(parts)}
+    lots = [sorted(lot, key=lambda p: ordre[(p.path, p.offset)]) for lot in lots]
+    lots.sort(key=lambda lot: ordre[(lot[0].path, lot[0].offset)])
+    return lots
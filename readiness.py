@@ -0,0 +1,117 @@
+import heapq
+import os
+import threading
+import time
+
+
+class ReadinessGate:
+    """Ne transmet un fichier (forward(path)) qu'une fois son écriture terminée.
+    - closed(path) : événement de fermeture après écriture (on_closed / IN_CLOSE_WRITE), le fichier est prêt aussitôt
+    - sinon, sondage de (taille, mtime) : prêt quand le relevé n'a pas bougé depuis au moins `quiet` secondes
+      (et, sous Windows, quand plus aucun processus ne garde le fichier ouvert) ; l'intervalle entre relevés
+      double à chaque changement, de min_delay à max_delay
+    submit() et closed() ne bloquent jamais : les sondages sont faits par un thread dédié.
+    """
+
+    def __init__(self, forward, min_delay=0.05, max_delay=5.0, quiet=0.5, logger=None, name="readiness"):
+        self.forward = forward
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.quiet = quiet
+        self.logger = logger
+        self.name = name
+        self._cond = threading.Condition()
+        self._heap = []  # [(échéance, chemin)]
+        self._pending = {}  # chemin -> (dernier relevé, stable depuis, délai courant)
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, path):
+        with self._cond:
+            if path in self._pending:
+                return
+            self._pending[path] = (None, None, self.min_delay)
+            heapq.heappush(self._heap, (time.monotonic() + self.min_delay, path))
+            self._cond.notify()
+
+    def depth(self):
+        """Fichiers dont la fin d'écriture est encore attendue."""
+        with self._cond:
+            return len(self._pending)
+
+    def closed(self, path):
+        with self._cond:
+            if self._pending.pop(path, None) is None:
+                return
+        self._emit(path)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _emit(self, path):
+        try:
+            self.forward(path)
+        except Exception as exc:
+            if self.logger:
+                self.logger.exception(f"{self.name}: erreur en transmettant {path}: {exc}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                if self._stop:
+                    return
+                _, path = heapq.heappop(self._heap)
+                if path not in self._pending:
+                    continue  # déjà transmis par closed()
+                previous, stable_since, delay = self._pending[path]
+
+            try:
+                st = os.stat(path)
+                current = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                current = None
+
+            with self._cond:
+                if path not in self._pending:
+                    continue
+                if current is None:
+                    # fichier disparu (renommé, supprimé) : plus rien à attendre
+                    del self._pending[path]
+                    continue
+                now = time.monotonic()
+                if current != previous:
+                    delay = delay if previous is None else min(delay * 2, self.max_delay)
+                    self._pending[path] = (current, now, delay)
+                    heapq.heappush(self._heap, (now + delay, path))
+                    continue
+                if now - stable_since < self.quiet or _open_elsewhere(path):
+                    heapq.heappush(self._heap, (max(stable_since + self.quiet, now + self.min_delay), path))
+                    continue
+                del self._pending[path]
+            self._emit(path)
+
+
+def _open_elsewhere(path):
+    """Sous Windows, un fichier encore ouvert en écriture par un autre processus ne peut pas être renommé."""
+    if os.name != 'nt':
+        return False
+    try:
+        os.rename(path, path)
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
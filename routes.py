@@ -0,0 +1,82 @@
+import json
+import os
+from collections import namedtuple
+
+from config_cache import load_extensions, load_recipients, normalize_extensions
+
+
+_Route = namedtuple(
+    "Route", "name directory recursive recipients users_file extensions extensions_file backup_dir workers sessions",
+    defaults=(None,),
+)
+
+
+class Route(_Route):
+    """Un dossier surveillé et ses règles : destinataires, extensions autorisées, dossier de sauvegarde,
+    nombre de workers (shards) et quota de sessions SMTP (sessions, SMTP_POOL_SIZE si None) qui lui sont propres.
+    - recipients / extensions: listes fixées dans la configuration, sinon lues (et rechargées) depuis
+      users_file / extensions_file
+    """
+
+    __slots__ = ()
+
+    def emails(self):
+        if self.recipients is not None:
+            return list(self.recipients)
+        return load_recipients(self.users_file)
+
+    def allowed_extensions(self):
+        if self.extensions is not None:
+            return self.extensions
+        return load_extensions(self.extensions_file)
+
+    def relative_to(self):
+        """Racine de l'arborescence reproduite dans la sauvegarde (routes récursives uniquement)."""
+        return self.directory if self.recursive else None
+
+
+def _resolve(path, base_dir):
+    path = os.path.expanduser(path)
+    return os.path.normpath(path if os.path.isabs(path) else os.path.join(base_dir, path))
+
+
+def load_routes(routes_file, base_dir, users_file, extensions_file, backup_dir):
+    """Lit la configuration des routes (JSON) :
+        {"routes": [{"name": "compta", "dir": "depots/compta", "recursive": true,
+                     "recipients": ["a@example.com"] | "users_file": "compta_users.json",
+                     "extensions": ["pdf", "xlsx"] | "extensions_file": "compta_ext.json",
+                     "backup_dir": "sauvegarde/compta", "workers": 2, "sessions": 2}]}
+    Les chemins relatifs partent de base_dir. Sans destinataires ni extensions propres, une route utilise
+    users_file / extensions_file ; sans backup_dir, elle sauvegarde dans backup_dir/<name>.
+    Chaque route a son propre pool de `sessions` connexions SMTP : un arriéré sur une route n'occupe pas
+    les sessions des autres (le serveur voit au plus la somme des quotas).
+    """
+    with open(routes_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("routes", []) if isinstance(data, dict) else data
+
+    routes = []
+    names = set()
+    for i, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not entry.get("dir"):
+            raise ValueError(f"{routes_file}: route n°{i} sans dossier ('dir')")
+        directory = _resolve(entry["dir"], base_dir)
+        name = str(entry.get("name") or os.path.basename(directory) or f"route{i}")
+        if name in names:
+            raise ValueError(f"{routes_file}: nom de route en double '{name}'")
+        names.add(name)
+        recipients = entry.get("recipients")
+        extensions = entry.get("extensions")
+        routes.append(Route(
+            name=name,
+            directory=directory,
+            recursive=bool(entry.get("recursive", False)),
+            recipients=tuple(dict.fromkeys(recipients)) if recipients is not None else None,
+            users_file=_resolve(entry["users_file"], base_dir) if entry.get("users_file") else users_file,
+            extensions=normalize_extensions(extensions) if extensions is not None else None,
+            extensions_file=_resolve(entry["extensions_file"], base_dir) if entry.get("extensions_file") else extensions_file,
+            backup_dir=_resolve(entry["backup_dir"], base_dir) if entry.get("backup_dir") else os.path.join(backup_dir, name),
+            workers=max(1, int(entry.get("workers", 1))),
+            sessions=max(1, int(entry["sessions"])) if entry.get("sessions") is not None else None,
+        ))
+    return routes
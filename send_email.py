@@ -1,24 +1,308 @@
 import os
 import smtplib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
-import json
+from email.policy import SMTP
+
+import metrics
+from smtp_pool import get_pool, SMTP_POOL_SIZE
+from mime_stream import iter_message, send_streamed
+from packing import pack_files, raw_budget
+from compression import prepare_attachments
+from config_cache import load_recipients
 
 
 SEND_ATTACHMENTS = os.getenv('SEND_ATTACHMENTS', '0')  # '0' disables attachments, '1' enables
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', str(SMTP_POOL_SIZE)))  # envois simultanés (limités aussi par SMTP_POOL_SIZE)
+DOMAIN_RATE_LIMIT = float(os.getenv('DOMAIN_RATE_LIMIT', '0'))  # messages/s max par domaine destinataire, 0 = illimité
+# taille max d'un message une fois encodé (limite SIZE du serveur) ; les pièces jointes sont réparties en conséquence
+MAX_MESSAGE_BYTES = int(os.getenv('MAX_MESSAGE_BYTES', str(25 * 1024 * 1024)))
+# au-delà de ce volume total de pièces jointes (octets), le message est encodé en flux vers la socket SMTP ; -1 = jamais.
+# Borné à la moitié du budget d'un lot : un lot ne dépasse jamais ce budget (packing), un seuil plus haut
+# ne se déclencherait pas et les gros lots seraient construits en mémoire (brut + base64)
+STREAM_THRESHOLD = int(os.getenv('STREAM_THRESHOLD', str(8 * 1024 * 1024)))
+if STREAM_THRESHOLD >= 0:
+    STREAM_THRESHOLD = min(STREAM_THRESHOLD, raw_budget(MAX_MESSAGE_BYTES) // 2)
+# destinataires max dans l'enveloppe d'un message envoyé en flux (le message est encodé une fois par enveloppe)
+MAX_RCPT_PER_MESSAGE = int(os.getenv('MAX_RCPT_PER_MESSAGE', '50'))
+
+SUJET_FICHIERS = "Nouvelle(s) sauvegarde(s) de fichiers"
+TEXTE_PIECES_JOINTES = "Bonjour,\n\nVeuillez trouver les nouveaux fichiers en pièce jointe.\n\nCordialement."
+TEXTE_INFORMATIF = "Bonjour,\n\nIl y a de nouveaux fichiers sauvegardés. Ce message est informatif uniquement.\n\nCordialement."
+
+
+class DomainRateLimiter:
+    """Espace les envois vers un même domaine d'au moins 1/rate secondes (rate <= 0 : pas de limite)."""
+
+    def __init__(self, rate=DOMAIN_RATE_LIMIT):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def reserve(self, email):
+        """Réserve le prochain créneau d'envoi vers le domaine de email ; retourne l'attente (s) avant ce créneau."""
+        if not self.interval:
+            return 0.0
+        domain = email.rsplit('@', 1)[-1].lower()
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(domain, now))
+            self._next[domain] = slot + self.interval
+        return slot - now
+
+    def wait(self, email):
+        delay = self.reserve(email)
+        if delay > 0:
+            time.sleep(delay)
+
+
+_rate_limiter = DomainRateLimiter()
+
+
+def deliver(pool, recipients, send_one, workers=None, rate_limiter=None, logger=None):
+    """Exécute send_one(serveur, email) pour chaque destinataire, en parallèle sur les sessions du pool.
+    - workers: nombre d'envois simultanés (SEND_WORKERS par défaut)
+    - rate_limiter: DomainRateLimiter appliqué avant chaque envoi (limiteur global par défaut)
+    Retourne un dict {email: None si succès, sinon l'exception levée}, dans l'ordre des destinataires.
+    """
+    recipients = list(dict.fromkeys(recipients))
+    workers = max(1, min(workers or SEND_WORKERS, len(recipients) or 1))
+    rate_limiter = rate_limiter or _rate_limiter
+
+    def task(email):
+        rate_limiter.wait(email)
+        try:
+            with pool.connection() as serveur:
+                send_one(serveur, email)
+            return None
+        except Exception as exc:
+            if logger:
+                logger.error(f"Échec de l'envoi à {email}: {exc}")
+            return exc
+
+    if workers == 1:
+        return {email: task(email) for email in recipients}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smtp-send") as executor:
+        return dict(zip(recipients, executor.map(task, recipients)))
+
+
+def deliver_streamed(pool, recipients, email_exp, subject, parts, rate_limiter=None, logger=None):
+    """Envoie un lot en flux à tous les destinataires : les fichiers sont relus et encodés une seule fois
+    par enveloppe (MAX_RCPT_PER_MESSAGE destinataires au plus), et non une fois par destinataire.
+    Les refus RCPT sont rapportés au seul destinataire concerné.
+    Retourne un dict {email: None si succès, sinon l'exception}, dans l'ordre des destinataires.
+    """
+    recipients = list(dict.fromkeys(recipients))
+    rate_limiter = rate_limiter or _rate_limiter
+    # destinataires en Bcc : l'en-tête To ne révèle pas les autres adresses de l'enveloppe
+    headers = [("From", email_exp), ("To", "undisclosed-recipients:;"), ("Subject", subject)]
+    results = {}
+    taille = max(1, MAX_RCPT_PER_MESSAGE)
+    for debut in range(0, len(recipients), taille):
+        enveloppe = recipients[debut:debut + taille]
+        for email in enveloppe:
+            rate_limiter.wait(email)
+        start = time.perf_counter()
+        try:
+            with pool.connection() as serveur:
+                refused = send_streamed(serveur, email_exp, enveloppe, iter_message(headers, TEXTE_PIECES_JOINTES, parts))
+        except smtplib.SMTPRecipientsRefused as exc:
+            refused = exc.recipients  # tous les destinataires de l'enveloppe refusés
+        except Exception as exc:
+            metrics.smtp_send_seconds.observe(time.perf_counter() - start, result="error")
+            for email in enveloppe:
+                results[email] = exc
+                if logger:
+                    logger.error(f"Échec de l'envoi à {email}: {exc}")
+            continue
+        metrics.smtp_send_seconds.observe(time.perf_counter() - start,
+                                          result="error" if len(refused) == len(enveloppe) else "ok")
+        for email in enveloppe:
+            if email in refused:
+                results[email] = smtplib.SMTPRecipientsRefused({email: refused[email]})
+                if logger:
+                    logger.error(f"Échec de l'envoi à {email}: {results[email]}")
+            else:
+                results[email] = None
+    return results
+
+
+def is_permanent_error(exc):
+    """True pour un refus définitif du serveur (code 5xx) : inutile de réessayer.
+    Les erreurs 4xx, réseau, de délai et d'authentification sont temporaires.
+    """
+    if isinstance(exc, smtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        return bool(codes) and all(500 <= code < 600 for code in codes)
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 500 <= exc.smtp_code < 600
+    return False
 
 
 def load_emails(users_file):
-    with open(users_file, "r", encoding="utf-8") as f:
-        users = json.load(f)
-    return [u.get("email") for u in users if u.get("email")]
+    # mis en cache : users.json n'est relu que lorsqu'il a changé
+    return load_recipients(users_file)
+
+
+def build_payload(email_exp, subject, parts=None):
+    """Construit et encode le message commun à tous les destinataires (sans en-tête To).
+    - parts: pièces jointes (packing.Part) ; None pour le message informatif sans pièce jointe
+    Retourne (octets du message au format SMTP, parts effectivement jointes).
+    """
+    msg = EmailMessage()
+    msg["From"] = email_exp
+    msg["Subject"] = subject
+
+    if parts is None:
+        # attachments disabled: send a short informational message only
+        msg.set_content(TEXTE_INFORMATIF)
+        return msg.as_bytes(policy=SMTP), []
+
+    msg.set_content(TEXTE_PIECES_JOINTES)
+    parts_jointes = []
+    for part in parts:
+        try:
+            with open(part.path, "rb") as f:
+                f.seek(part.offset)
+                msg.add_attachment(f.read(part.length), maintype="application", subtype="octet-stream", filename=part.filename)
+            parts_jointes.append(part)
+        except FileNotFoundError:
+            continue
+    return msg.as_bytes(policy=SMTP), parts_jointes
 
 
-def send_files(fichiers, smtp_server, smtp_port, email_exp, password, users_file, logger=None):
+def _send_lot(pool, emails, email_exp, subject, parts, logger=None):
+    """Envoie un message (un lot de pièces jointes, ou le message informatif si parts est None) à tous les destinataires.
+    Retourne (parts jointes au message, résultats par destinataire: None si succès, sinon l'exception).
+    """
+    taille = sum(p.length for p in parts) if parts else 0
+    if parts and 0 <= STREAM_THRESHOLD < taille:
+        # gros volume : le lot est relu par blocs et encodé une seule fois pour tous les destinataires,
+        # la mémoire reste bornée
+        if logger:
+            logger.info(f"Envoi en flux de {len(parts)} pièce(s) jointe(s) ({taille} octets)")
+        results = deliver_streamed(pool, emails, email_exp, subject, parts, logger=logger)
+        for email, exc in results.items():
+            if exc is None:
+                metrics.attachment_bytes.inc(taille)
+                if logger:
+                    logger.info(f"Email envoyé à {email} - {subject} - mode pièces jointes=oui")
+        return parts, results
+
+    # le message (et l'encodage base64 des pièces jointes) est construit une seule fois pour tout le lot ;
+    # seul l'en-tête To est ajouté pour chaque destinataire
+    payload, parts_jointes = build_payload(email_exp, subject, parts)
+    if parts is not None and not parts_jointes:
+        if logger:
+            logger.info("Aucun fichier n'a pu être joint (send_email)")
+        return [], {}
+    octets = sum(p.length for p in parts_jointes)
+
+    def send_one(serveur, email):
+        start = time.perf_counter()
+        try:
+            serveur.sendmail(email_exp, [email], SMTP.fold_binary("To", email) + payload)
+        except Exception:
+            metrics.smtp_send_seconds.observe(time.perf_counter() - start, result="error")
+            raise
+        metrics.smtp_send_seconds.observe(time.perf_counter() - start, result="ok")
+        metrics.attachment_bytes.inc(octets)
+        if logger:
+            logger.info(f"Email envoyé à {email} - {subject} - mode pièces jointes={'oui' if parts is not None else 'non'}")
+
+    return parts_jointes, deliver(pool, emails, send_one, logger=logger)
+
+
+def _send_group(pool, emails, email_exp, fichiers, attachments_mode, on_delivered, on_failed=None, logger=None):
+    """Envoie les fichiers à un groupe de destinataires ; on_delivered(fichier, email) est appelé
+    dès qu'un fichier est entièrement parvenu à un destinataire, on_failed(fichier, email, exc) une fois
+    par fichier et destinataire en échec (première erreur rencontrée).
+    Retourne les fichiers parvenus à tous les destinataires du groupe.
+    """
+    echecs_fichiers = {}
+
+    def failed(fichier, email, exc):
+        echecs_fichiers.setdefault((fichier, email), exc)
+
+    if not attachments_mode:
+        _, results = _send_lot(pool, emails, email_exp, SUJET_FICHIERS, None, logger=logger)
+        for email, exc in results.items():
+            for fichier in fichiers:
+                if exc is None:
+                    on_delivered(fichier, email)
+                else:
+                    failed(fichier, email, exc)
+        echecs = sum(1 for exc in results.values() if exc is not None)
+        if logger:
+            logger.info(f"send_email: Envoi terminé - réussis={len(results) - echecs}, échecs={echecs}")
+        _report_failures(echecs_fichiers, on_failed)
+        # still report the candidate files back (full paths) so caller can backup/rename
+        return [] if echecs else list(fichiers)
+
+    with tempfile.TemporaryDirectory(prefix="sendfiles-") as tmp:
+        # {pièce à joindre: fichier source} - compressée dans tmp si COMPRESSION est activée
+        sources = prepare_attachments(fichiers, tmp, logger=logger)
+        lots = pack_files(list(sources), raw_budget(MAX_MESSAGE_BYTES))
+        attendues = {}
+        for lot in lots:
+            for part in lot:
+                attendues[part.path] = attendues.get(part.path, 0) + 1
+
+        # un fichier est parvenu à un destinataire quand toutes ses parties lui ont été envoyées
+        recues = {}
+        completes = {}
+        for numero, lot in enumerate(lots, 1):
+            subject = SUJET_FICHIERS if len(lots) == 1 else f"{SUJET_FICHIERS} ({numero}/{len(lots)})"
+            parts_jointes, results = _send_lot(pool, emails, email_exp, subject, lot, logger=logger)
+            for email, exc in results.items():
+                if exc is not None:
+                    for part in lot:
+                        failed(sources[part.path], email, exc)
+                    continue
+                for part in parts_jointes:
+                    key = (part.path, email)
+                    recues[key] = recues.get(key, 0) + 1
+                    if recues[key] == attendues[part.path]:
+                        on_delivered(sources[part.path], email)
+                        completes[sources[part.path]] = completes.get(sources[part.path], 0) + 1
+            if logger:
+                echecs = sum(1 for exc in results.values() if exc is not None)
+                logger.info(f"Message {numero}/{len(lots)} ({len(lot)} pièce(s)): réussis={len(results) - echecs}, échecs={echecs}")
+
+    _report_failures(echecs_fichiers, on_failed)
+    fichiers_envoyes = [f for f in fichiers if completes.get(f, 0) == len(emails)]
+    if logger:
+        logger.info(f"send_email: Envoi terminé - fichiers envoyés={len(fichiers_envoyes)}/{len(fichiers)}, messages={len(lots)}")
+    return fichiers_envoyes
+
+
+def _report_failures(echecs, on_failed):
+    if on_failed is None:
+        return
+    for (fichier, email), exc in echecs.items():
+        on_failed(fichier, email, exc)
+
+
+def send_files(fichiers, smtp_server, smtp_port, email_exp, password, users_file, logger=None, journal=None, recipients=None,
+               pool=None):
     """Envoie les fichiers fournis à tous les e-mails listés dans users_file.
     Si SEND_ATTACHMENTS == '0', envoie un message court (sans pièces jointes) indiquant qu'il y a de nouveaux fichiers.
-    Retourne la liste des fichiers candidats (les chemins complets) pour que le caller puisse les sauvegarder/renommer.
+    Sinon les fichiers sont répartis en messages d'au plus MAX_MESSAGE_BYTES (les fichiers trop gros sont découpés
+    en parties numérotées), chaque message étant envoyé et suivi séparément.
+    - journal: DeliveryJournal ; chaque fichier n'est envoyé qu'aux destinataires qui ne l'ont pas encore reçu,
+      et chaque livraison y est enregistrée aussitôt. Les échecs y sont aussi enregistrés : un destinataire en
+      échec temporaire (4xx, réseau) n'est resservi qu'après son délai de backoff, un refus définitif (5xx) ou
+      trop de tentatives l'abandonnent (voir DeliveryJournal.record_failure)
+    - recipients: liste d'adresses à utiliser à la place de users_file (route configurée)
+    - pool: SMTPPool à utiliser (celui de la route) ; par défaut le pool commun du compte
+    Retourne la liste des fichiers parvenus à tous les destinataires (les chemins complets) pour que le caller puisse les sauvegarder.
     """
-    emails = load_emails(users_file)
+    emails = list(dict.fromkeys(recipients if recipients is not None else load_emails(users_file)))
     fichiers_a_envoyer = [f for f in fichiers if os.path.isfile(f) and not f.endswith('.success')]
 
     if not fichiers_a_envoyer:
@@ -26,41 +310,54 @@ def send_files(fichiers, smtp_server, smtp_port, email_exp, password, users_file
             logger.info("Aucun nouveau fichier à envoyer (send_email)")
         return []
 
+    attachments_mode = SEND_ATTACHMENTS in ('1', 'true', 'True')
+
     try:
-        with smtplib.SMTP_SSL(smtp_server, smtp_port) as serveur:
-            serveur.login(email_exp, password)
-
-            for email in emails:
-                msg = EmailMessage()
-                msg["From"] = email_exp
-                msg["To"] = email
-                msg["Subject"] = "Nouvelle(s) sauvegarde(s) de fichiers"
-
-                if SEND_ATTACHMENTS in ('1', 'true', 'True'):
-                    msg.set_content("Bonjour,\n\nVeuillez trouver les nouveaux fichiers en pièce jointe.\n\nCordialement.")
-                    fichiers_envoyes = []
-                    for fichier in fichiers_a_envoyer:
-                        try:
-                            with open(fichier, "rb") as f:
-                                msg.add_attachment(f.read(), maintype="application", subtype="octet-stream", filename=os.path.basename(fichier))
-                            fichiers_envoyes.append(fichier)
-                        except FileNotFoundError:
-                            continue
-                else:
-                    # attachments disabled: send a short informational message only
-                    msg.set_content("Bonjour,\n\nIl y a de nouveaux fichiers sauvegardés. Ce message est informatif uniquement.\n\nCordialement.")
-                    # still report the candidate files back (full paths) so caller can backup/rename
-                    fichiers_envoyes = list(fichiers_a_envoyer)
+        # regroupe les fichiers selon les destinataires qui restent à servir (tous, sans journal)
+        groupes = {}
+        records = {}
+        bloques = set()  # fichiers dont un destinataire attend son backoff ou est abandonné
+        for fichier in fichiers_a_envoyer:
+            if journal is not None:
+                records[fichier] = journal.begin(fichier)
+                deja = journal.delivered_to(records[fichier].id)
+                attente = journal.blocked_recipients(records[fichier].id)
+                restants = tuple(e for e in emails if e not in deja and e not in attente)
+                if any(e in attente for e in emails if e not in deja):
+                    bloques.add(fichier)
+            else:
+                restants = tuple(emails)
+            groupes.setdefault(restants, []).append(fichier)
 
-                if fichiers_envoyes:
-                    serveur.send_message(msg)
-                    if logger:
-                        logger.info(f"Email envoyé à {email} - mode pièces jointes={'oui' if SEND_ATTACHMENTS in ('1','true','True') else 'non'}")
+        def on_delivered(fichier, email):
+            if journal is not None:
+                journal.mark_delivered(records[fichier].id, email)
 
-        if logger:
-            logger.info("send_email: Envoi terminé")
-        # Renvoie les fichiers qui étaient candidats (la fonction de backup/rename s'en chargera ensuite)
-        return fichiers_a_envoyer
+        def on_failed(fichier, email, exc):
+            if journal is None:
+                metrics.delivery_failures.inc(outcome="untracked")
+                return
+            permanent = is_permanent_error(exc)
+            dead = journal.record_failure(records[fichier].id, email, exc, permanent=permanent)
+            metrics.delivery_failures.inc(outcome="dead" if dead else "retry")
+            if logger:
+                etat = "abandonné" if dead else "nouvelle tentative différée"
+                logger.warning(f"Échec de livraison de {os.path.basename(fichier)} à {email} ({etat}): {exc}",
+                               extra={"file": fichier})
+
+        pool = pool or get_pool(smtp_server, smtp_port, email_exp, password, logger=logger)
+        envoyes = set()
+        for restants, groupe in groupes.items():
+            if not restants:
+                # déjà reçus par tout le monde lors d'une exécution précédente (ou en attente de nouvelle tentative)
+                if logger:
+                    logger.info(f"{len(groupe)} fichier(s) sans destinataire à servir maintenant, pas de nouvel envoi")
+                envoyes.update(groupe)
+                continue
+            envoyes.update(_send_group(pool, list(restants), email_exp, groupe, attachments_mode, on_delivered,
+                                       on_failed=on_failed, logger=logger))
+
+        return [f for f in fichiers_a_envoyer if f in envoyes and f not in bloques]
 
     except Exception as exc:
         if logger:
@@ -78,9 +375,7 @@ def send_notification(subject, body, smtp_server, smtp_port, email_exp, password
         recipients = [e.strip() for e in notify_email.split(',') if e.strip()]
     elif users_file:
         try:
-            with open(users_file, 'r', encoding='utf-8') as f:
-                users = json.load(f)
-            recipients = [u.get('email') for u in users if u.get('email')]
+            recipients = load_recipients(users_file)
         except Exception:
             if logger:
                 logger.exception("Impossible de charger les destinataires depuis users_file pour la notification")
@@ -92,8 +387,7 @@ def send_notification(subject, body, smtp_server, smtp_port, email_exp, password
         return False
 
     try:
-        with smtplib.SMTP_SSL(smtp_server, smtp_port) as serveur:
-            serveur.login(email_exp, password)
+        with get_pool(smtp_server, smtp_port, email_exp, password, logger=logger).connection() as serveur:
             msg = EmailMessage()
             msg['From'] = email_exp
             msg['To'] = ', '.join(recipients)
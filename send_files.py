@@ -1,14 +1,13 @@
-import smtplib
-import json
 import os
 import time
 import shutil
 import logging
 from logging.handlers import RotatingFileHandler
-from email.message import EmailMessage
 from dotenv import load_dotenv
 
 # ===== CHARGER .env =====
+# seul travail fait à l'import avec la configuration du logger : smtplib, email, watchdog, la création des dossiers
+# et le traitement des .success ne sont faits que par les commandes qui en ont besoin (--show-log reste instantané)
 load_dotenv()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -23,19 +22,27 @@ DOSSIER_SAUVEGARDE = os.getenv("DOSSIER_SAUVEGARDE", r"D:\souvgarde")
 # ----- Extensions autorisées -----
 EXTENSIONS_FILE = os.getenv("EXTENSIONS_FILE", os.path.join(BASE_DIR, "extension.json"))
 
+# fichiers abandonnés (refus définitif ou trop de tentatives pour un destinataire), avec un rapport d'erreur
+DOSSIER_DEAD_LETTER = os.getenv("DOSSIER_DEAD_LETTER", os.path.join(BASE_DIR, "dead_letter"))
+
 # normalize to absolute path
 if not os.path.isabs(DOSSIER_SAUVEGARDE):
     DOSSIER_SAUVEGARDE = os.path.join(BASE_DIR, DOSSIER_SAUVEGARDE)
+if not os.path.isabs(DOSSIER_DEAD_LETTER):
+    DOSSIER_DEAD_LETTER = os.path.join(BASE_DIR, DOSSIER_DEAD_LETTER)
 # Notifications: adresse(s) (comma-separated) ou users.json, et options
 NOTIFY_EMAIL = os.getenv("NOTIFY_EMAIL")  # ex: "ops@example.com,admin@example.com"
 NOTIFY_ON_SUCCESS = os.getenv("NOTIFY_ON_SUCCESS", "0")  # '1' to enable
 NOTIFY_ON_ERROR = os.getenv("NOTIFY_ON_ERROR", "1")  # default enabled
-# ===== VERIFICATIONS =====
-if not EMAIL_EXPEDITEUR or not MOT_DE_PASSE:
-    raise ValueError("EMAIL_EXPEDITEUR ou MOT_DE_PASSE manquant dans .env")
 
-if SMTP_PORT is None:
-    raise ValueError("SMTP_PORT manquant dans .env")
+
+def check_config():
+    """Vérifie la configuration SMTP ; appelée par les commandes qui envoient des e-mails."""
+    if not EMAIL_EXPEDITEUR or not MOT_DE_PASSE:
+        raise ValueError("EMAIL_EXPEDITEUR ou MOT_DE_PASSE manquant dans .env")
+
+    if SMTP_PORT is None:
+        raise ValueError("SMTP_PORT manquant dans .env")
 
 # ----- Logging -----
 LOG_FILE = os.getenv("LOG_FILE", "error.log")
@@ -44,8 +51,15 @@ logger.setLevel(logging.INFO)
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 
 LOG_FILE = os.getenv("LOG_FILE", os.path.join(BASE_DIR, "error.log"))
-file_handler = RotatingFileHandler(LOG_FILE, maxBytes=5*1024*1024, backupCount=3, encoding="utf-8")
-file_handler.setFormatter(formatter)
+# format du fichier de log : 'text' (lisible) ou 'json' (une entrée JSON par ligne, pour --show-log --level/--file...)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# delay : le fichier n'est ouvert qu'à la première écriture
+file_handler = RotatingFileHandler(LOG_FILE, maxBytes=5*1024*1024, backupCount=3, encoding="utf-8", delay=True)
+if LOG_FORMAT == "json":
+    from log_query import JsonFormatter
+    file_handler.setFormatter(JsonFormatter())
+else:
+    file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 
 console_handler = logging.StreamHandler()
@@ -53,94 +67,435 @@ console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
 
+def startup():
+    """Diagnostic de démarrage et création des dossiers, pour les commandes qui envoient."""
+    check_config()
+    logger.info(f"Script démarré. BASE_DIR={BASE_DIR} CWD={os.getcwd()}")
+    logger.info(f"DOSSIER_FICHIERS={DOSSIER_FICHIERS}, USERS_FILE={USERS_FILE}, LOG_FILE={LOG_FILE}")
+    try:
+        os.makedirs(DOSSIER_FICHIERS, exist_ok=True)
+        logger.info(f"Dossier de fichiers vérifié/créé: {DOSSIER_FICHIERS}")
+    except Exception as e:
+        logger.exception(f"Impossible de créer/le vérifier le dossier {DOSSIER_FICHIERS}: {e}")
 
-# Startup diagnostics
-logger.info(f"Script démarré. BASE_DIR={BASE_DIR} CWD={os.getcwd()}")
-logger.info(f"DOSSIER_FICHIERS={DOSSIER_FICHIERS}, USERS_FILE={USERS_FILE}, LOG_FILE={LOG_FILE}")
-try:
-    os.makedirs(DOSSIER_FICHIERS, exist_ok=True)
-    logger.info(f"Dossier de fichiers vérifié/créé: {DOSSIER_FICHIERS}")
-except Exception as e:
-    logger.exception(f"Impossible de créer/le vérifier le dossier {DOSSIER_FICHIERS}: {e}")
-
-# ensure backup folder exists
-try:
-    os.makedirs(DOSSIER_SAUVEGARDE, exist_ok=True)
-    logger.info(f"Dossier de sauvegarde vérifié/créé: {DOSSIER_SAUVEGARDE}")
-except Exception as e:
-    logger.exception(f"Impossible de créer/le vérifier le dossier de sauvegarde {DOSSIER_SAUVEGARDE}: {e}")
+    # ensure backup folder exists
+    try:
+        os.makedirs(DOSSIER_SAUVEGARDE, exist_ok=True)
+        logger.info(f"Dossier de sauvegarde vérifié/créé: {DOSSIER_SAUVEGARDE}")
+    except Exception as e:
+        logger.exception(f"Impossible de créer/le vérifier le dossier de sauvegarde {DOSSIER_SAUVEGARDE}: {e}")
 
-# --- Process existing .success automatically at startup
-try:
-    from backup import process_success_files, ensure_backup_dir
-    ensure_backup_dir(DOSSIER_SAUVEGARDE, logger=logger)
-    copied, removed = process_success_files(DOSSIER_FICHIERS, DOSSIER_SAUVEGARDE, logger=logger)
-    if copied or removed:
-        logger.info(f"Startup process-success: copiés={len(copied)}, supprimés={len(removed)}")
-except Exception as e:
-    logger.exception(f"Erreur lors du traitement automatique des fichiers .success au démarrage: {e}")
 
-def show_log(lines=100):
+def process_startup_success():
+    """Traitement des .success déjà présents au démarrage (dossier de fichiers par défaut)."""
     try:
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            content = f.readlines()
-        for line in content[-lines:]:
-            print(line.rstrip())
-    except FileNotFoundError:
+        from backup import process_success_files, ensure_backup_dir
+        ensure_backup_dir(DOSSIER_SAUVEGARDE, logger=logger)
+        copied, removed = process_success_files(DOSSIER_FICHIERS, DOSSIER_SAUVEGARDE, logger=logger)
+        if copied or removed:
+            logger.info(f"Startup process-success: copiés={len(copied)}, supprimés={len(removed)}")
+    except Exception as e:
+        logger.exception(f"Erreur lors du traitement automatique des fichiers .success au démarrage: {e}")
+
+def show_log(lines=100, follow=False, level=None, file=None, since=None, until=None):
+    """Affiche les dernières entrées du log (rotations error.log.N comprises), filtrées par niveau minimal,
+    fichier et intervalle de temps ; follow : continue d'afficher les nouvelles entrées (Ctrl+C pour arrêter).
+    Le log est lu par blocs depuis la fin : le coût ne dépend pas de sa taille."""
+    import log_query
+    query = log_query.LogFilter(
+        level=level, file=file,
+        since=log_query.parse_time(since) if isinstance(since, str) else since,
+        until=log_query.parse_time(until) if isinstance(until, str) else until,
+    )
+    if not log_query.log_files(LOG_FILE) and not follow:
         print(f"No log file found: {LOG_FILE}")
+        return
+    for entry in log_query.tail(LOG_FILE, lines, query):
+        print(entry["raw"])
+    if follow:
+        try:
+            for entry in log_query.follow(LOG_FILE, query):
+                print(entry["raw"], flush=True)
+        except KeyboardInterrupt:
+            pass
+
+
+def parse_time_arg(text):
+    # type argparse de --since / --until : log_query n'est importé que si l'option est donnée
+    import log_query
+    return log_query.parse_time(text)
+
+
+def parse_level_arg(text):
+    # type argparse de --level
+    import log_query
+    return log_query.parse_level(text)
 
 # ----- Fonctions réutilisables -----
 
+# journal SQLite de l'état de livraison (par fichier et par destinataire), pour reprendre sans doublon après un arrêt
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", os.path.join(BASE_DIR, "journal.db"))
+
+
+def get_journal():
+    from journal import get_journal as open_journal
+    return open_journal(JOURNAL_FILE, logger=logger)
+
+
+def register_journal_metrics():
+    """Arriéré tenu dans le journal (fichiers par état, échecs en attente / dus / abandonnés, récapitulatifs
+    en attente), relu à chaque lecture."""
+    import metrics
+    metrics.REGISTRY.gauge(
+        "sendfiles_journal_files", "Fichiers du journal par état", ["state"],
+        callback=lambda: get_journal().stats()["files"],
+    )
+    metrics.REGISTRY.gauge(
+        "sendfiles_retry_backlog", "Livraisons en échec : en attente de backoff, dues, abandonnées", ["status"],
+        callback=lambda: get_journal().stats()["failures"],
+    )
+    metrics.REGISTRY.gauge(
+        "sendfiles_digest_backlog", "Récapitulatifs en attente : lignes (fichier x destinataire), destinataires", ["kind"],
+        callback=lambda: get_journal().stats()["digest"],
+    )
+
+
+def show_stats():
+    """Affiche les métriques de l'instance en cours (METRICS_PORT) si elle répond ;
+    sinon l'état du journal et le nombre de fichiers en attente dans chaque dossier surveillé."""
+    import json
+    import metrics
+    if metrics.METRICS_PORT > 0:
+        from urllib.request import urlopen
+        url = f"http://{metrics.METRICS_HOST}:{metrics.METRICS_PORT}/metrics"
+        try:
+            with urlopen(url, timeout=5) as response:
+                print(response.read().decode("utf-8"), end="")
+            return
+        except OSError as e:
+            print(f"# {url} injoignable ({e}), état lu depuis le journal")
+    # lecture seule : consulter l'état ne purge ni ne crée le journal
+    from journal import DeliveryJournal
+    if os.path.exists(JOURNAL_FILE):
+        journal = DeliveryJournal(JOURNAL_FILE, logger=logger, read_only=True)
+        try:
+            stats = journal.stats()
+        finally:
+            journal.close()
+    else:
+        stats = {"files": {}}
+    stats["backlog"] = {route.name: len(list_files(route)) for route in get_routes()}
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+
+
+# déduplication par contenu (SHA-256) : 'off', 'skip' (doublon ignoré) ou 'link' (lien physique dans la sauvegarde)
+DEDUP_MODE = os.getenv("DEDUP_MODE", "off").lower()
+DEDUP_INDEX_FILE = os.getenv("DEDUP_INDEX_FILE", os.path.join(BASE_DIR, "dedup.db"))
+
+
+def get_dedup_index():
+    if DEDUP_MODE not in ('skip', 'link'):
+        return None
+    from dedup_index import get_index
+    return get_index(DEDUP_INDEX_FILE, logger=logger)
+
+
+def skip_duplicates(fichiers, journal, route=None):
+    """Retire les fichiers dont le contenu a déjà été livré et sauvegardé : ils ne sont ni renvoyés ni recopiés
+    (en mode 'link', un lien physique vers la sauvegarde existante est créé sous le nouveau nom).
+    Seules comptent les sauvegardes de la même route : ses destinataires n'ont pas reçu celles des autres.
+    Retourne les fichiers restant à envoyer."""
+    index = get_dedup_index()
+    if index is None:
+        return fichiers
+    from backup import backup_path
+    from dedup_index import link_or_skip
+    from journal import DONE
+    route = route or default_route()
+    racine = os.path.join(os.path.abspath(route.backup_dir), "")
+
+    a_envoyer = []
+    for fichier in fichiers:
+        try:
+            doublon = index.find_duplicate(fichier)
+        except Exception as e:
+            logger.error(f"Erreur de déduplication pour {fichier}: {e}")
+            doublon = None
+        if doublon is None or not os.path.abspath(doublon[1]).startswith(racine):
+            a_envoyer.append(fichier)
+            continue
+        digest, existing = doublon
+        if DEDUP_MODE == 'link' and not link_or_skip(existing, backup_path(fichier, route.backup_dir, route.relative_to()),
+                                                     logger=logger):
+            a_envoyer.append(fichier)  # lien impossible : la source ne peut pas être retirée sans sauvegarde
+            continue
+        try:
+            rec = journal.begin(fichier)
+            os.remove(fichier)
+            journal.set_state(rec.id, DONE)
+            logger.info(f"Doublon déjà livré ignoré: {fichier} (sha256={digest[:12]}…, sauvegarde={existing})", extra={"file": fichier})
+        except Exception as e:
+            logger.error(f"Erreur suppression du doublon {fichier}: {e}")
+    return a_envoyer
+
+
 def load_emails():
-    with open(USERS_FILE, "r", encoding="utf-8") as f:
-        users = json.load(f)
-    return [u["email"] for u in users if "email" in u]
+    from config_cache import load_recipients
+    return load_recipients(USERS_FILE)
+
+
+# baux de traitement partagés entre instances (processus ou machines) sur un même partage : dossier commun
+# hors des dossiers surveillés ; vide = une seule instance, pas de bail
+LEASE_DIR = os.getenv("LEASE_DIR", "")
+# fichiers pris à la fois par une instance : les autres prennent les tranches suivantes en parallèle
+LEASE_BATCH = int(os.getenv("LEASE_BATCH", "50"))
+
+
+def get_leases():
+    if not LEASE_DIR:
+        return None
+    from leases import get_leases as open_leases
+    return open_leases(LEASE_DIR, logger=logger)
+
+
+# routes : plusieurs dossiers surveillés, chacun avec ses destinataires, ses extensions, sa sauvegarde et ses workers
+ROUTES_FILE = os.getenv("ROUTES_FILE", os.path.join(BASE_DIR, "routes.json"))
+
+
+def default_route():
+    """Route unique décrite par l'environnement (DOSSIER_FICHIERS, USERS_FILE, EXTENSIONS_FILE, DOSSIER_SAUVEGARDE)."""
+    from routes import Route
+    return Route(name="fichiers", directory=DOSSIER_FICHIERS, recursive=False, recipients=None, users_file=USERS_FILE,
+                 extensions=None, extensions_file=EXTENSIONS_FILE, backup_dir=DOSSIER_SAUVEGARDE, workers=1)
 
 
-def list_files():
-    if not os.path.isdir(DOSSIER_FICHIERS):
+def get_route_pool(route):
+    """Pool SMTP propre à la route (quota route.sessions) : les routes ne se disputent pas les mêmes sessions."""
+    from smtp_pool import get_pool
+    return get_pool(SMTP_SERVER, SMTP_PORT, EMAIL_EXPEDITEUR, MOT_DE_PASSE, logger=logger, name=route.name,
+                    size=route.sessions)
+
+
+def get_routes():
+    """Routes de ROUTES_FILE s'il existe, sinon la route par défaut."""
+    if not os.path.isfile(ROUTES_FILE):
+        return [default_route()]
+    from routes import load_routes
+    return load_routes(ROUTES_FILE, BASE_DIR, USERS_FILE, EXTENSIONS_FILE, DOSSIER_SAUVEGARDE)
+
+
+def move_dead_letters(fichiers, journal, emails=None):
+    """Déplace dans DOSSIER_DEAD_LETTER les fichiers qui ne peuvent plus être livrés : chaque destinataire
+    l'a reçu ou a été abandonné, et au moins un l'a été. Un rapport <nom>.error.txt les accompagne.
+    Retourne les fichiers déplacés.
+    """
+    import metrics
+    from journal import DEAD
+    emails = load_emails() if emails is None else emails
+    deplaces = []
+    for fichier in fichiers:
+        try:
+            if not os.path.isfile(fichier):
+                continue
+            rec = journal.begin(fichier)
+            echecs = journal.failures(rec.id)
+            abandonnes = {e for e, (_, _, dead) in echecs.items() if dead}
+            livres = journal.delivered_to(rec.id)
+            if not abandonnes or any(e not in livres and e not in abandonnes for e in emails):
+                continue
+            os.makedirs(DOSSIER_DEAD_LETTER, exist_ok=True)
+            dest = os.path.join(DOSSIER_DEAD_LETTER, os.path.basename(fichier))
+            shutil.move(fichier, dest)
+            with open(dest + ".error.txt", "w", encoding="utf-8") as f:
+                f.write(f"Fichier: {fichier}\n")
+                f.write(f"Livré à: {', '.join(sorted(livres)) or '-'}\n\n")
+                for email, (attempts, error, dead) in sorted(echecs.items()):
+                    f.write(f"{email}: {'abandonné' if dead else 'en attente'} après {attempts} tentative(s) - {error}\n")
+            journal.set_state(rec.id, DEAD)
+            metrics.dead_letters.inc()
+            deplaces.append(fichier)
+            logger.error(f"Fichier abandonné, déplacé vers {dest}: échec définitif pour {', '.join(sorted(abandonnes))}",
+                         extra={"file": fichier})
+        except Exception as e:
+            logger.error(f"Erreur lors du déplacement de {fichier} vers le dossier dead-letter: {e}")
+    return deplaces
+
+
+def notify(success, subject, body, files=()):
+    """Empile une notification : elle part dans un récapitulatif envoyé par un thread dédié (cf. notifier),
+    sans que le traitement n'attende la session SMTP."""
+    from notifier import get_digest
+    get_digest(SMTP_SERVER, SMTP_PORT, EMAIL_EXPEDITEUR, MOT_DE_PASSE, users_file=USERS_FILE,
+               notify_email=NOTIFY_EMAIL, logger=logger).event(success, subject, body, files)
+
+
+# mode récapitulatif (sans pièces jointes) : au lieu d'un message par lot, chaque destinataire reçoit toutes les
+# DIGEST_WINDOW secondes un seul message listant les nouveaux fichiers (nom, taille, SHA-256, lien), cf. digest
+DIGEST_MODE = os.getenv("DIGEST_MODE", "0")  # '1' to enable (ignoré si SEND_ATTACHMENTS est activé)
+
+
+def digest_enabled():
+    from send_email import SEND_ATTACHMENTS
+    return DIGEST_MODE in ('1', 'true', 'True') and SEND_ATTACHMENTS not in ('1', 'true', 'True')
+
+
+def get_digests():
+    from digest import get_digest
+    return get_digest(get_journal(), SMTP_SERVER, SMTP_PORT, EMAIL_EXPEDITEUR, MOT_DE_PASSE, logger=logger)
+
+
+def queue_digest(fichiers, route, journal):
+    """Mode récapitulatif : inscrit les fichiers dans le récapitulatif en attente des destinataires qui ne les ont
+    pas encore reçus, puis les sauvegarde et les retire de la source sans attendre l'envoi.
+    Les inscriptions sont faites avant la sauvegarde (empreinte lue sur la source, même en BACKUP_MODE=move) et
+    sont idempotentes : un fichier dont la sauvegarde échoue est réinscrit sans doublon au passage suivant.
+    Retourne les fichiers terminés."""
+    from backup import backup_path
+    from dedup_index import sha256_file
+    from digest import backup_link
+    dedup_index = get_dedup_index()
+    emails = list(dict.fromkeys(route.emails()))
+    relative_to = route.relative_to()
+    inscrits = []
+    for fichier in fichiers:
+        try:
+            rec = journal.begin(fichier)
+            deja = journal.delivered_to(rec.id)
+            restants = [e for e in emails if e not in deja]
+            if restants:
+                sha256 = dedup_index.digest(fichier) if dedup_index is not None else sha256_file(fichier)
+                nom = os.path.relpath(fichier, relative_to) if relative_to else os.path.basename(fichier)
+                link = backup_link(backup_path(fichier, route.backup_dir, relative_to), DOSSIER_SAUVEGARDE)
+                journal.queue_digest(rec.id, restants, nom, os.path.getsize(fichier), sha256=sha256, link=link)
+            inscrits.append(fichier)
+        except Exception as e:
+            logger.error(f"Erreur d'inscription de {fichier} au récapitulatif: {e}", extra={"file": fichier})
+    if not inscrits:
         return []
-    return [
-        os.path.join(DOSSIER_FICHIERS, f)
-        for f in os.listdir(DOSSIER_FICHIERS)
-        if os.path.isfile(os.path.join(DOSSIER_FICHIERS, f))
-    ]
+    get_digests().wake()
+    return backup_sent(inscrits, route, journal)
 
 
-def send_and_backup():
+def notify_done(fichiers):
+    if fichiers and NOTIFY_ON_SUCCESS in ('1', 'true', 'True'):
+        notify(True, "Sauvegarde réussie", "Les fichiers autorisés ont été envoyés et sauvegardés avec succès.", files=fichiers)
+
+
+def notify_dead_letters(abandonnes):
+    if abandonnes and NOTIFY_ON_ERROR in ('1', 'true', 'True'):
+        notify(False, "Fichiers abandonnés", f"{len(abandonnes)} fichier(s) n'ont pas pu être livrés et ont été déplacés vers {DOSSIER_DEAD_LETTER}.", files=abandonnes)
+
+
+def notify_error(exc):
+    if NOTIFY_ON_ERROR in ('1', 'true', 'True'):
+        notify(False, "Erreur de sauvegarde", f"Une erreur est survenue lors du traitement des fichiers ({exc}). Vérifiez les logs.")
+
+
+def list_files(route=None):
+    from discovery import scandir_files, walk_files
+    route = route or default_route()
+    return (walk_files if route.recursive else scandir_files)(route.directory)
+
+
+def backup_sent(fichiers_envoyes, route, journal):
+    """Sauvegarde les fichiers parvenus à tous les destinataires puis les retire de la source,
+    chaque étape (sent -> backed_up -> done) étant validée dans le journal.
+    Retourne les fichiers terminés."""
+    import metrics
+    from backup import backup_path, copy_files_to_backup
+    from journal import PENDING, SENT, BACKED_UP, DONE
+
+    records = {f: journal.begin(f) for f in fichiers_envoyes}
+    for rec in records.values():
+        if rec.state == PENDING:
+            journal.set_state(rec.id, SENT)
+    a_copier = [f for f, rec in records.items() if rec.state != BACKED_UP]
+    copies = set(copy_files_to_backup(a_copier, route.backup_dir, logger=logger, relative_to=route.relative_to()))
+
+    termines = []
+    dedup_index = get_dedup_index()
+    for fichier, rec in records.items():
+        dest = backup_path(fichier, route.backup_dir, route.relative_to())
+        if rec.state != BACKED_UP:
+            if dest not in copies:
+                continue
+            journal.set_state(rec.id, BACKED_UP)
+        if dedup_index is not None:
+            try:
+                dedup_index.record(fichier, dest)
+            except Exception as e:
+                logger.error(f"Erreur d'indexation du contenu de {fichier}: {e}")
+        try:
+            # en BACKUP_MODE=move, la sauvegarde a déjà retiré la source par renommage
+            if os.path.exists(fichier):
+                os.remove(fichier)
+            journal.set_state(rec.id, DONE)
+            metrics.files_done.inc(route=route.name)
+            termines.append(fichier)
+            logger.info(f"Fichier envoyé, sauvegardé et retiré de la source: {fichier}", extra={"file": fichier})
+        except Exception as e:
+            logger.error(f"Erreur suppression {fichier} après sauvegarde: {e}")
+    return termines
+
+
+def send_and_backup(fichiers=None, route=None):
     """
     Orchestration :
+    - fichiers: chemins à traiter (lot du mode watch) ; par défaut tout le dossier de la route
+    - route: dossier, destinataires, extensions et sauvegarde à utiliser (route par défaut : variables d'environnement)
     - vérifie l’extension des fichiers
     - envoie uniquement les extensions autorisées
-    - sauvegarde les fichiers envoyés
-    - marque les fichiers traités en .success
-    - supprime les fichiers non autorisés
+    - sauvegarde les fichiers envoyés puis les retire de la source
+    - l'avancement (par fichier et par destinataire) est tenu dans le journal de livraison :
+      une exécution interrompue reprend là où elle s'était arrêtée
+    - ignore les fichiers non autorisés
     """
+    import metrics
+    route = route or default_route()
+    leases = get_leases()
+    claimed = []
+    debut = None
     try:
-        fichiers = [f for f in list_files() if not f.endswith('.success')]
+        if fichiers is None:
+            fichiers = list_files(route)
+        fichiers = [f for f in fichiers if os.path.isfile(f) and not f.endswith('.success')]
 
         if not fichiers:
-            logger.info("Aucun nouveau fichier à traiter")
+            logger.info(f"Aucun nouveau fichier à traiter ({route.name})")
             return False
 
+        # 🔒 Baux : les fichiers déjà pris par une autre instance sont laissés de côté
+        if leases is not None and len(fichiers) > LEASE_BATCH:
+            resultats = [send_and_backup(fichiers[i:i + LEASE_BATCH], route) for i in range(0, len(fichiers), LEASE_BATCH)]
+            return any(resultats)
+        if leases is not None:
+            claimed = leases.claim(fichiers, root=route.directory, namespace=route.name, tag=route.name)
+            fichiers = [f for f in claimed if os.path.isfile(f)]
+            if not fichiers:
+                return False
+        debut = time.perf_counter()
+        metrics.files_discovered.inc(len(fichiers), route=route.name)
+
         from send_email import send_files as do_send
-        from backup import copy_files_to_backup, cleanup_success_in_source, ensure_backup_dir
+        from backup import ensure_backup_dir
+        from config_cache import is_allowed
+        journal = get_journal()
 
-        ensure_backup_dir(DOSSIER_SAUVEGARDE, logger=logger)
+        ensure_backup_dir(route.backup_dir, logger=logger)
 
         fichiers_valides = []
         fichiers_invalides = []
 
-        # 🔍 Vérification des extensions
+        # 🔍 Vérification des extensions (règles mises en cache, relues seulement si extension.json change)
+        extensions = route.allowed_extensions()
         for fichier in fichiers:
-            ext = os.path.splitext(fichier)[1].lower()
-            with open(EXTENSIONS_FILE, "r", encoding="utf-8") as f:
-                extensions = json.load(f)
-            for ex in extensions["ext"]:
-                if ex in ext:
-                    fichiers_valides.append(fichier)
-                else:
-                    fichiers_invalides.append(fichier)
+            if is_allowed(fichier, extensions):
+                fichiers_valides.append(fichier)
+            else:
+                fichiers_invalides.append(fichier)
+
+        metrics.files_accepted.inc(len(fichiers_valides), route=route.name)
+        metrics.files_rejected.inc(len(fichiers_invalides), route=route.name)
 
         # 🚫 Traitement des fichiers NON autorisés
         for fichier in fichiers_invalides:
@@ -154,135 +509,126 @@ def send_and_backup():
             logger.info("Aucun fichier avec extension autorisée à envoyer")
             return False
 
+        # ♻️ Contenus déjà livrés (même sous un autre nom)
+        fichiers_valides = skip_duplicates(fichiers_valides, journal, route)
+        if not fichiers_valides:
+            logger.info("Tous les fichiers valides étaient des doublons déjà livrés")
+            return True
+
+        # 🗒️ Mode récapitulatif : sauvegarde immédiate, les destinataires sont prévenus par le prochain récapitulatif
+        if digest_enabled():
+            termines = queue_digest(fichiers_valides, route, journal)
+            logger.info(f"send_and_backup ({route.name}): {len(termines)} fichier(s) sauvegardé(s), inscrits au récapitulatif")
+            notify_done(termines)
+            return bool(termines)
+
+        emails = route.emails()
         fichiers_envoyes = do_send(
             fichiers_valides,
             SMTP_SERVER,
             SMTP_PORT,
             EMAIL_EXPEDITEUR,
             MOT_DE_PASSE,
-            USERS_FILE,
-            logger=logger
+            route.users_file,
+            logger=logger,
+            journal=journal,
+            recipients=emails,
+            pool=get_route_pool(route),
         )
 
+        notify_dead_letters(move_dead_letters([f for f in fichiers_valides if f not in fichiers_envoyes], journal, emails))
+
         if not fichiers_envoyes:
             logger.info("Aucun fichier valide n'a été envoyé")
             return False
 
-        # 💾 Sauvegarde + renommage .success
-        copy_files_to_backup(fichiers_envoyes, DOSSIER_SAUVEGARDE, logger=logger)
+        # 💾 Sauvegarde puis suppression de la source, chaque étape étant validée dans le journal
+        backup_sent(fichiers_envoyes, route, journal)
 
-        for fichier in fichiers_envoyes:
-            try:
-                target = fichier + ".success"
-                os.replace(fichier, target)
-                logger.info(f"Fichier envoyé et marqué success: {fichier}")
-            except Exception as e:
-                logger.error(f"Erreur renommage {fichier}: {e}")
-
-        cleanup_success_in_source(DOSSIER_FICHIERS, logger=logger)
-
-        logger.info("send_and_backup: traitement terminé avec succès")
-
-        # 📧 Notification succès
-        if NOTIFY_ON_SUCCESS in ('1', 'true', 'True'):
-            from send_email import send_notification
-            send_notification(
-                subject="Sauvegarde réussie",
-                body="Les fichiers autorisés ont été envoyés et sauvegardés avec succès.",
-                smtp_server=SMTP_SERVER,
-                smtp_port=SMTP_PORT,
-                email_exp=EMAIL_EXPEDITEUR,
-                password=MOT_DE_PASSE,
-                users_file=USERS_FILE,
-                notify_email=NOTIFY_EMAIL,
-                logger=logger,
-            )
+        logger.info(f"send_and_backup ({route.name}): traitement terminé avec succès")
+
+        # 📧 Notification succès (récapitulatif envoyé en arrière-plan)
+        notify_done(fichiers_envoyes)
 
         return True
 
     except Exception as exc:
         logger.exception(f"Erreur durant send_and_backup: {exc}")
 
-        # 📧 Notification erreur
-        if NOTIFY_ON_ERROR in ('1', 'true', 'True'):
-            from send_email import send_notification
-            send_notification(
-                subject="Erreur de sauvegarde",
-                body="Une erreur est survenue lors du traitement des fichiers. Vérifiez les logs.",
-                smtp_server=SMTP_SERVER,
-                smtp_port=SMTP_PORT,
-                email_exp=EMAIL_EXPEDITEUR,
-                password=MOT_DE_PASSE,
-                users_file=USERS_FILE,
-                notify_email=NOTIFY_EMAIL,
-                logger=logger,
-            )
+        # 📧 Notification erreur (récapitulatif envoyé en arrière-plan)
+        notify_error(exc)
 
         return False
 
+    finally:
+        if claimed:
+            leases.release(claimed)
+        if debut is not None:
+            metrics.batch_seconds.observe(time.perf_counter() - debut, route=route.name)
+
 # ----- Envoi depuis dossier de sauvegarde (nouveau comportement demandé) -----
-def send_from_backup():
-    """Envoie les nouveaux fichiers présents dans DOSSIER_SAUVEGARDE et supprime après envoi."""
+def _is_backup_temp(name):
+    # *.tmp cachés : copies atomiques en cours (backup.copy_file)
+    return name.endswith('.sent') or name.endswith('~') or name.startswith('~') or (name.startswith('.') and name.endswith('.tmp'))
+
+
+def send_from_backup(files=None):
+    """Envoie les nouveaux fichiers présents dans DOSSIER_SAUVEGARDE et supprime après envoi.
+    - files: chemins à traiter (lot du mode watch) ; par défaut tout DOSSIER_SAUVEGARDE
+    """
+    leases = get_leases()
+    claimed = []
     try:
         # lister fichiers dans dossier sauvegarde, ignorer fichiers temporaires et déjà traités (*.sent)
-        files = [os.path.join(DOSSIER_SAUVEGARDE, f) for f in os.listdir(DOSSIER_SAUVEGARDE) if os.path.isfile(os.path.join(DOSSIER_SAUVEGARDE, f)) and not f.endswith('.sent') and not f.endswith('~') and not f.startswith('~')]
+        if files is None:
+            from discovery import scandir_files
+            files = scandir_files(DOSSIER_SAUVEGARDE, lambda name: not _is_backup_temp(name))
+        else:
+            files = [f for f in files if os.path.isfile(f) and not _is_backup_temp(os.path.basename(f))]
         if not files:
             logger.info("Aucun nouveau fichier dans le dossier de sauvegarde à envoyer")
             return False
 
+        if leases is not None and len(files) > LEASE_BATCH:
+            resultats = [send_from_backup(files[i:i + LEASE_BATCH]) for i in range(0, len(files), LEASE_BATCH)]
+            return any(resultats)
+        if leases is not None:
+            claimed = leases.claim(files, root=DOSSIER_SAUVEGARDE, namespace="sauvegarde", tag="sauvegarde")
+            files = [f for f in claimed if os.path.isfile(f)]
+            if not files:
+                return False
+
         from send_email import send_files as do_send
+        from journal import DONE
+        journal = get_journal()
 
         # envoyer les fichiers trouvés
-        sent = do_send(files, SMTP_SERVER, SMTP_PORT, EMAIL_EXPEDITEUR, MOT_DE_PASSE, USERS_FILE, logger=logger)
+        sent = do_send(files, SMTP_SERVER, SMTP_PORT, EMAIL_EXPEDITEUR, MOT_DE_PASSE, USERS_FILE, logger=logger, journal=journal)
+
+        abandonnes = move_dead_letters([f for f in files if f not in sent], journal)
+        if abandonnes and NOTIFY_ON_ERROR in ('1', 'true', 'True'):
+            notify(False, "Fichiers abandonnés", f"{len(abandonnes)} fichier(s) de la sauvegarde n'ont pas pu être livrés et ont été déplacés vers {DOSSIER_DEAD_LETTER}.", files=abandonnes)
 
         if not sent:
             logger.info("Aucun envoi depuis la sauvegarde (aucun fichier envoyé)")
             return False
 
-        # marquer comme envoyés et supprimer
+        # supprimer les fichiers envoyés pour libérer l'espace (comportement demandé)
         for f in sent:
             try:
-                target = f + '.sent'
-                try:
-                    os.replace(f, target)
-                    logger.info(f"Marqué envoyé (temp): {f} → {target}")
-                except Exception:
-                    if os.path.exists(target):
-                        try:
-                            os.remove(target)
-                            os.rename(f, target)
-                            logger.info(f"Marqué envoyé après suppression cible: {f} → {target}")
-                        except Exception as e2:
-                            logger.error(f"Erreur marquage envoyé {f}: {e2}")
-                    else:
-                        logger.error(f"Erreur marquage envoyé {f}")
-
-                # supprimer le fichier .sent pour libérer l'espace (comportement demandé)
-                try:
-                    os.remove(target)
-                    logger.info(f"Supprimé du dossier sauvegarde après envoi: {target}")
-                except Exception as e:
-                    logger.error(f"Impossible de supprimer {target}: {e}")
+                rec = journal.begin(f)
+                os.remove(f)
+                journal.set_state(rec.id, DONE)
+                logger.info(f"Supprimé du dossier sauvegarde après envoi: {f}")
             except Exception as e:
-                logger.exception(f"Erreur post-envoi sur fichier {f}: {e}")
+                logger.error(f"Impossible de supprimer {f}: {e}")
 
         logger.info("send_from_backup: traitement terminé")
 
         # notification de succès pour envoi depuis sauvegarde
         try:
             if NOTIFY_ON_SUCCESS in ('1', 'true', 'True'):
-                from send_email import send_notification
-                send_notification(
-                    subject="Envoi depuis sauvegarde réussi",
-                    body="Les fichiers présents dans la sauvegarde ont été envoyés avec succès.",
-                    smtp_server=SMTP_SERVER,
-                    smtp_port=SMTP_PORT,
-                    email_exp=EMAIL_EXPEDITEUR,
-                    password=MOT_DE_PASSE,
-                    users_file=USERS_FILE,
-                    notify_email=NOTIFY_EMAIL,
-                    logger=logger,
-                )
+                notify(True, "Envoi depuis sauvegarde réussi", "Les fichiers présents dans la sauvegarde ont été envoyés avec succès.", files=sent)
         except Exception:
             logger.exception("Erreur lors de l'envoi de la notification de succès depuis sauvegarde")
 
@@ -293,122 +639,451 @@ def send_from_backup():
         # notification d'erreur
         try:
             if NOTIFY_ON_ERROR in ('1', 'true', 'True'):
-                from send_email import send_notification
-                send_notification(
-                    subject="Erreur lors de l'envoi depuis sauvegarde",
-                    body="Une erreur est survenue lors de l'envoi depuis la sauvegarde. Vérifiez les logs.",
-                    smtp_server=SMTP_SERVER,
-                    smtp_port=SMTP_PORT,
-                    email_exp=EMAIL_EXPEDITEUR,
-                    password=MOT_DE_PASSE,
-                    users_file=USERS_FILE,
-                    notify_email=NOTIFY_EMAIL,
-                    logger=logger,
-                )
+                notify(False, "Erreur lors de l'envoi depuis sauvegarde", f"Une erreur est survenue lors de l'envoi depuis la sauvegarde ({exc}). Vérifiez les logs.")
         except Exception:
             logger.exception("Erreur lors de l'envoi de la notification d'erreur depuis sauvegarde")
 
         return False
 
+    finally:
+        if claimed:
+            leases.release(claimed)
+
 
 # ----- Mode watch (optionnel) -----
 
-try:
-    from watchdog.observers import Observer
-    from watchdog.events import FileSystemEventHandler
-except Exception:
-    Observer = None
-    FileSystemEventHandler = object
+def get_observer():
+    """Observer watchdog, importé seulement par le mode watch."""
+    try:
+        from watchdog.observers import Observer
+    except Exception:
+        raise RuntimeError("Le paquet 'watchdog' n'est pas installé. Installez-le: pip install watchdog")
+    return Observer()
+
+
+class FileSystemEventHandler:
+    """Même aiguillage que watchdog.events.FileSystemEventHandler (dispatch -> on_<type>),
+    sans importer watchdog au chargement du module."""
+
+    def dispatch(self, event):
+        handler = getattr(self, f"on_{event.event_type}", None)
+        if handler is not None:
+            handler(event)
 
 
 class NewFileHandler(FileSystemEventHandler):
-    def __init__(self, delay=1.0):
-        self.delay = delay
+    """Transmet les nouveaux fichiers (créés, ou renommés dans le dossier) à la ReadinessGate (puis au scheduler de lots)
+    sans bloquer le thread de l'observer. Les fichiers *.success vont à success_gate s'il est fourni."""
+
+    def __init__(self, gate, success_gate=None):
+        self.gate = gate
+        self.success_gate = success_gate
 
     def on_created(self, event):
         if event.is_directory:
             return
-        time.sleep(self.delay)
-        if event.src_path.endswith('.success') or event.src_path.endswith('~'):
+        if event.src_path.endswith('.success'):
+            if self.success_gate is not None:
+                self.success_gate.submit(event.src_path)
+            return
+        if event.src_path.endswith('~'):
             return
         logger.info(f"Nouveau fichier détecté: {event.src_path}")
-        try:
-            # appeler la nouvelle routine qui fait l'envoi + sauvegarde + nettoyage
-            send_and_backup()
-        except Exception as exc:
-            logger.exception(f"Erreur dans on_created pour {event.src_path}: {exc}")
+        self.gate.submit(event.src_path)
+
+    def on_moved(self, event):
+        # un fichier renommé (temporaire -> nom final, ou en .success) est complet : pas d'attente de fin d'écriture
+        if event.is_directory:
+            return
+        if event.dest_path.endswith('.success'):
+            if self.success_gate is not None:
+                self.success_gate.submit(event.dest_path)
+                self.success_gate.closed(event.dest_path)
+            return
+        if event.dest_path.endswith('~'):
+            return
+        logger.info(f"Nouveau fichier détecté (renommage): {event.dest_path}")
+        self.gate.submit(event.dest_path)
+        self.gate.closed(event.dest_path)
+
+    def on_closed(self, event):
+        # fermeture après écriture (inotify IN_CLOSE_WRITE) : inutile d'attendre la stabilité de la taille
+        if event.is_directory:
+            return
+        if event.src_path.endswith('.success'):
+            if self.success_gate is not None:
+                self.success_gate.closed(event.src_path)
+            return
+        self.gate.closed(event.src_path)
 
 
 class NewBackupHandler(FileSystemEventHandler):
-    def __init__(self, delay=1.0):
-        self.delay = delay
+    """Transmet les nouveaux fichiers de la sauvegarde à la ReadinessGate (puis au scheduler de lots)."""
+
+    def __init__(self, gate):
+        self.gate = gate
 
     def on_created(self, event):
         if event.is_directory:
             return
-        time.sleep(self.delay)
         # ne pas traiter les fichiers temporaires
-        name = os.path.basename(event.src_path)
-        if name.endswith('.sent') or name.endswith('~') or name.startswith('~'):
+        if _is_backup_temp(os.path.basename(event.src_path)):
             return
         logger.info(f"Nouveau fichier dans la sauvegarde détecté: {event.src_path}")
-        try:
-            # envoyer depuis le dossier de sauvegarde
-            send_from_backup()
-        except Exception as exc:
-            logger.exception(f"Erreur dans on_created backup pour {event.src_path}: {exc}")
+        self.gate.submit(event.src_path)
 
+    def on_moved(self, event):
+        # les copies atomiques arrivent par renommage du fichier temporaire : elles sont complètes
+        if event.is_directory or _is_backup_temp(os.path.basename(event.dest_path)):
+            return
+        logger.info(f"Nouveau fichier dans la sauvegarde détecté: {event.dest_path}")
+        self.gate.submit(event.dest_path)
+        self.gate.closed(event.dest_path)
 
-def watch_folder(poll_interval=1):
-    if Observer is None:
-        raise RuntimeError("Le paquet 'watchdog' n'est pas installé. Installez-le: pip install watchdog")
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.gate.closed(event.src_path)
 
-    # interval (s) pour traiter les fichiers existants *.success automatiquement
-    PROCESS_SUCCESS_INTERVAL = int(os.getenv("PROCESS_SUCCESS_INTERVAL", "60"))
 
-    event_handler = NewFileHandler()
-    observer = Observer()
+def process_success_batch(paths, route):
+    """Traite un lot de fichiers *.success signalés par les événements (ou le rapprochement) d'une route."""
+    from backup import process_success_files, ensure_backup_dir
+    ensure_backup_dir(route.backup_dir, logger=logger)
+    copied, removed = process_success_files(route.directory, route.backup_dir, logger=logger, files=paths)
+    if copied or removed:
+        logger.info(f"process-success ({route.name}): copiés={len(copied)}, supprimés={len(removed)}")
+    return copied, removed
+
+
+def start_success_stage(route, ready_options, batch_options):
+    """Étage .success d'une route (dossiers non récursifs) : ReadinessGate -> BatchScheduler -> process_success_batch.
+    Retourne (gate, scheduler)."""
+    from functools import partial
+    from batch_scheduler import BatchScheduler
+    from readiness import ReadinessGate
+    scheduler = BatchScheduler(
+        partial(process_success_batch, route=route), logger=logger, name=f"success-{route.name}", **batch_options,
+    ).start()
+    gate = ReadinessGate(scheduler.submit, logger=logger, name=f"ecriture-success-{route.name}", **ready_options).start()
+    return gate, scheduler
+
+
+def reconcile(targets):
+    """Filet de sécurité des événements : soumet à leur étage les fichiers présents dans chaque dossier
+    (déposés pendant un arrêt, événement perdu) ; les fichiers ordinaires passent par la ReadinessGate de la route,
+    les *.success par leur étage (dossiers non récursifs). Appelé au démarrage de la surveillance, c'est la reprise
+    de tout ce qui attendait déjà. Un fichier déjà en attente dans une gate n'y est pas compté deux fois.
+    targets : [(route, gate, success_scheduler ou None)]"""
+    for route, gate, success_scheduler in targets:
+        fichiers = success = 0
+        for path in list_files(route):
+            if path.endswith('.success'):
+                if success_scheduler is not None:
+                    success_scheduler.submit(path)
+                    success += 1
+            elif not path.endswith('~'):
+                gate.submit(path)
+                fichiers += 1
+        if fichiers or success:
+            logger.info(f"Rapprochement ({route.name}): {fichiers} fichier(s) et {success} .success à traiter")
+
+
+def reconcile_interval():
+    # SUCCESS_RECONCILE_INTERVAL et PROCESS_SUCCESS_INTERVAL (anciens noms) restent acceptés
+    return float(os.getenv("RECONCILE_INTERVAL", os.getenv("SUCCESS_RECONCILE_INTERVAL",
+                                                           os.getenv("PROCESS_SUCCESS_INTERVAL", "3600"))))
+
+
+def watch_settings():
+    """Réglages de la surveillance (variables d'environnement), communs aux moteurs synchrone et asynchrone."""
+    from types import SimpleNamespace
+    # regroupement des événements : fenêtre de calme (s), taille max d'un lot, attente max (s)
+    BATCH_WINDOW = float(os.getenv("BATCH_WINDOW", "0.2"))
+    BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "500"))
+    BATCH_MAX_WAIT = float(os.getenv("BATCH_MAX_WAIT", "10"))
+    # détection de fin d'écriture : intervalle initial et maximal (s) entre deux relevés de taille
+    READY_MIN_DELAY = float(os.getenv("READY_MIN_DELAY", "0.05"))
+    READY_MAX_DELAY = float(os.getenv("READY_MAX_DELAY", "5"))
+    # sans événement de fermeture, durée (s) pendant laquelle taille et mtime doivent rester stables
+    READY_QUIET = float(os.getenv("READY_QUIET", "0.5"))
+    return SimpleNamespace(
+        # rapprochement (s) : les fichiers sont traités dès leur événement, ce parcours n'est qu'un filet de sécurité
+        reconcile_interval=reconcile_interval(),
+        ready_options=dict(min_delay=READY_MIN_DELAY, max_delay=READY_MAX_DELAY, quiet=READY_QUIET),
+        batch_options=dict(window=BATCH_WINDOW, batch_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT),
+        # nouvelles tentatives dues (backoff écoulé) : intervalle (s) de recherche et nombre max de fichiers resoumis
+        retry_interval=float(os.getenv("RETRY_POLL_INTERVAL", "10")),
+        retry_concurrency=int(os.getenv("RETRY_CONCURRENCY", "50")),
+        # avec LEASE_DIR : intervalle (s) de resoumission des fichiers laissés à une autre instance (reprise si elle meurt)
+        lease_recheck_interval=float(os.getenv("LEASE_RECHECK_INTERVAL", "30")),
+    )
+
+
+def watch_route(route, observer, forward, settings):
+    """Met une route sous surveillance : ReadinessGate vers forward (thread-safe), reprise des fichiers inachevés
+    du journal, dossier créé au besoin, étage .success (dossiers non récursifs) et handler de l'observer.
+    Retourne (étages à arrêter en fin de surveillance, cible du rapprochement (route, gate, étage .success ou None))."""
+    from readiness import ReadinessGate
+    gate = ReadinessGate(forward, logger=logger, name=f"ecriture-{route.name}", **settings.ready_options).start()
+    stages = [gate]
+
+    # reprendre les fichiers dont le traitement a été interrompu (arrêt brutal, erreur d'envoi...)
+    try:
+        for path in get_journal().unfinished(route.directory, recursive=route.recursive):
+            forward(path)
+    except Exception as e:
+        logger.exception(f"Impossible de reprendre les fichiers inachevés du journal ({route.name}): {e}")
+
     # ensure folder exists before scheduling (useful when started by Task Scheduler)
     try:
-        os.makedirs(DOSSIER_FICHIERS, exist_ok=True)
-        logger.info(f"Dossier de surveillance prêt: {DOSSIER_FICHIERS}")
+        os.makedirs(route.directory, exist_ok=True)
+        logger.info(f"Dossier de surveillance prêt: {route.directory}")
     except Exception as e:
-        logger.exception(f"Impossible de créer/le vérifier le dossier {DOSSIER_FICHIERS}: {e}")
-    observer.schedule(event_handler, DOSSIER_FICHIERS, recursive=False)
+        logger.exception(f"Impossible de créer/le vérifier le dossier {route.directory}: {e}")
+
+    success_gate = success_scheduler = None
+    if not route.recursive:
+        success_gate, success_scheduler = start_success_stage(route, settings.ready_options, settings.batch_options)
+        stages += [success_gate, success_scheduler]
+    observer.schedule(NewFileHandler(gate, success_gate), route.directory, recursive=route.recursive)
+    return stages, (route, gate, success_scheduler)
+
+
+def start_watch_metrics(depths):
+    """Métriques de l'instance : arriéré des files d'attente (depths() -> {file: profondeur}) et du journal,
+    servies sur METRICS_PORT."""
+    import metrics
+    metrics.REGISTRY.gauge("sendfiles_queue_depth", "Fichiers en attente (fin d'écriture, lot ou pipeline)", ["queue"],
+                           callback=depths)
+    register_journal_metrics()
+    try:
+        if metrics.start_http_server() is not None:
+            logger.info(f"Métriques exposées sur http://{metrics.METRICS_HOST}:{metrics.METRICS_PORT}/metrics")
+    except OSError as e:
+        logger.error(f"Impossible d'exposer les métriques sur le port {metrics.METRICS_PORT}: {e}")
+
+
+def watch_folder(poll_interval=1):
+    observer = get_observer()
+    settings = watch_settings()
+
+    from functools import partial
+    from batch_scheduler import BatchScheduler, ShardedScheduler
+    from readiness import ReadinessGate
+    schedulers = []
+    # dossiers dont les nouvelles tentatives sont resoumises à leur scheduler : (dossier, récursif, scheduler)
+    retry_targets = []
+    # scheduler de chaque route (et de la sauvegarde), pour resoumettre les fichiers dont le bail était pris
+    lease_targets = {}
+    # pour le rapprochement : (route, gate, étage .success des dossiers non récursifs ou None)
+    reconcile_targets = []
+
+    # récapitulatifs laissés en attente par une exécution précédente : envoyés à la fin de leur fenêtre
+    if digest_enabled():
+        get_digests()
+
+    # chaque route a sa propre détection de fin d'écriture et ses propres workers (shards) :
+    # un arriéré sur une route ne retarde pas les autres
+    for route in get_routes():
+        route_scheduler = ShardedScheduler(
+            partial(send_and_backup, route=route), shards=route.workers, logger=logger, name=f"lot-{route.name}",
+            **settings.batch_options,
+        ).start()
+        stages, target = watch_route(route, observer, route_scheduler.submit, settings)
+        schedulers += [route_scheduler] + stages
+        reconcile_targets.append(target)
+        retry_targets.append((route.directory, route.recursive, route_scheduler))
+        lease_targets[route.name] = route_scheduler
+        logger.info(
+            f"Route {route.name}: {route.directory}{' (récursif)' if route.recursive else ''} "
+            f"-> sauvegarde {route.backup_dir}, workers={route.workers}"
+        )
     observer.start()
-    logger.info(f"Surveillance du dossier {DOSSIER_FICHIERS}. Ctrl+C pour arrêter.")
+    logger.info("Surveillance démarrée. Ctrl+C pour arrêter.")
+    # fichiers déjà présents (et .success) : l'observer ne signale que ce qui arrive après son démarrage
+    try:
+        reconcile(reconcile_targets)
+    except Exception as e:
+        logger.exception(f"Erreur lors de la reprise des fichiers présents au démarrage: {e}")
+    last_reconcile = time.time()
+
+    start_watch_metrics(lambda: {s.name: s.depth() for s in schedulers})
 
     # also start a watcher on the backup folder if requested by env var WATCH_BACKUP
     if os.getenv('WATCH_BACKUP', '0') in ('1', 'true', 'True'):
         try:
-            backup_handler = NewBackupHandler()
+            backup_scheduler = BatchScheduler(
+                send_from_backup, logger=logger, name="lot-sauvegarde", **settings.batch_options,
+            ).start()
+            backup_gate = ReadinessGate(
+                backup_scheduler.submit, logger=logger, name="ecriture-sauvegarde", **settings.ready_options,
+            ).start()
+            schedulers += [backup_gate, backup_scheduler]
+            for path in get_journal().unfinished(DOSSIER_SAUVEGARDE):
+                backup_scheduler.submit(path)
+            backup_handler = NewBackupHandler(backup_gate)
+            retry_targets.append((DOSSIER_SAUVEGARDE, False, backup_scheduler))
+            lease_targets["sauvegarde"] = backup_scheduler
             observer.schedule(backup_handler, DOSSIER_SAUVEGARDE, recursive=False)
             logger.info(f"Surveillance du dossier de sauvegarde {DOSSIER_SAUVEGARDE} activée")
         except Exception as e:
             logger.exception(f"Impossible d'activer le watcher sur la sauvegarde: {e}")
 
-    # loop avec traitement périodique des fichiers .success
-    last_process = 0
+    # boucle des tâches périodiques ; elle ne se réveille qu'à la prochaine échéance
+    last_retry = 0
+    last_lease_check = time.time()
+    leases = get_leases()
     try:
         while True:
             try:
-                time.sleep(poll_interval)
+                deadlines = [last_retry + settings.retry_interval, last_reconcile + settings.reconcile_interval]
+                if leases is not None:
+                    deadlines.append(last_lease_check + settings.lease_recheck_interval)
+                time.sleep(max(poll_interval, min(deadlines) - time.time()))
                 now = time.time()
-                if now - last_process >= PROCESS_SUCCESS_INTERVAL:
+                if now - last_retry >= settings.retry_interval:
                     try:
-                        from backup import process_success_files, ensure_backup_dir
-                        ensure_backup_dir(DOSSIER_SAUVEGARDE, logger=logger)
-                        copied, removed = process_success_files(DOSSIER_FICHIERS, DOSSIER_SAUVEGARDE, logger=logger)
-                        if copied or removed:
-                            logger.info(f"Periodic process-success: copiés={len(copied)}, supprimés={len(removed)}")
+                        for directory, recursive, scheduler in retry_targets:
+                            dues = get_journal().claim_due_retries(directory, limit=settings.retry_concurrency, recursive=recursive)
+                            for path in dues:
+                                scheduler.submit(path)
+                            if dues:
+                                logger.info(f"Nouvelle tentative pour {len(dues)} fichier(s) de {directory}")
                     except Exception as e:
-                        logger.exception(f"Erreur périodique de traitement des .success: {e}")
-                    last_process = now
+                        logger.exception(f"Erreur lors de la reprise des envois en échec: {e}")
+                    last_retry = now
+                if leases is not None and now - last_lease_check >= settings.lease_recheck_interval:
+                    # fichiers pris par une autre instance : traités ici si elle a fini sans les retirer ou est morte
+                    for path, tag in leases.take_skipped().items():
+                        if tag in lease_targets:
+                            lease_targets[tag].submit(path)
+                    last_lease_check = now
+                if now - last_reconcile >= settings.reconcile_interval:
+                    try:
+                        reconcile(reconcile_targets)
+                    except Exception as e:
+                        logger.exception(f"Erreur lors du rapprochement: {e}")
+                    last_reconcile = now
             except Exception as exc:
                 logger.exception(f"Erreur dans la boucle de surveillance: {exc}")
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+def run_async(watch=False, poll_interval=1):
+    """Moteur asynchrone (--async) : un AsyncPipeline par route (cf. async_engine), les étages (admission,
+    compression, regroupement, envoi, sauvegarde) se chevauchant au lieu de se suivre lot par lot.
+    Sans watch : traite le contenu actuel des dossiers puis s'arrête. Avec watch : l'observer watchdog alimente
+    les pipelines depuis son thread, les reprises (nouvelles tentatives, baux, .success) sont des tâches asyncio."""
+    import asyncio
+    asyncio.run(_run_async(watch, poll_interval))
+
+
+async def _run_async(watch, poll_interval):
+    import asyncio
+    from async_engine import AsyncPipeline, make_executor
+    from backup import ensure_backup_dir
+    loop = asyncio.get_running_loop()
+    executor = make_executor()
+    journal = get_journal()
+    leases = get_leases()
+    routes = get_routes()
+    pipelines = {}
+    if digest_enabled():
+        get_digests()
+    for route in routes:
+        ensure_backup_dir(route.backup_dir, logger=logger)
+        pipelines[route.name] = await AsyncPipeline(
+            route, SMTP_SERVER, SMTP_PORT, EMAIL_EXPEDITEUR, MOT_DE_PASSE, journal,
+            backup=backup_sent, dead_letter=move_dead_letters, prefilter=skip_duplicates,
+            digest=queue_digest if digest_enabled() else None, leases=leases, executor=executor, logger=logger,
+            on_done=notify_done, on_dead_letter=notify_dead_letters, on_error=notify_error,
+        ).start()
+    try:
+        if not watch:
+            for route in routes:
+                for path in await loop.run_in_executor(executor, list_files, route):
+                    pipelines[route.name].submit(path)
+            await asyncio.gather(*(pipeline.wait_idle() for pipeline in pipelines.values()))
+            return
+        await _watch_async(routes, pipelines, journal, leases, executor, poll_interval)
+    finally:
+        for pipeline in pipelines.values():
+            await pipeline.stop()
+        executor.shutdown(wait=True)
+
+
+async def _watch_async(routes, pipelines, journal, leases, executor, poll_interval):
+    import asyncio
+    observer = get_observer()
+    settings = watch_settings()
+
+    from functools import partial
+    loop = asyncio.get_running_loop()
+    stages = []  # ReadinessGate et schedulers à threads, arrêtés en fin de surveillance
+    # pour le rapprochement : (route, gate, étage .success à threads des dossiers non récursifs ou None)
+    reconcile_targets = []
+    for route in routes:
+        # la détection de fin d'écriture garde son thread ; elle remet les fichiers prêts à la boucle asyncio
+        route_stages, target = await loop.run_in_executor(
+            executor, watch_route, route, observer, pipelines[route.name].submit_threadsafe, settings,
+        )
+        stages += route_stages
+        reconcile_targets.append(target)
+        logger.info(f"Route {route.name} (asynchrone): {route.directory}{' (récursif)' if route.recursive else ''}"
+                    f" -> sauvegarde {route.backup_dir}")
+    observer.start()
+    logger.info("Surveillance asynchrone démarrée. Ctrl+C pour arrêter.")
+
+    start_watch_metrics(
+        lambda: {**{s.name: s.depth() for s in stages}, **{f"async-{n}": p.depth() for n, p in pipelines.items()}},
+    )
+
+    async def every(interval, action, description):
+        while True:
+            try:
+                await action()
+            except Exception as e:
+                logger.exception(f"Erreur lors de {description}: {e}")
+            await asyncio.sleep(max(interval, poll_interval))
+
+    async def retry_due():
+        for route in routes:
+            dues = await loop.run_in_executor(
+                executor, partial(journal.claim_due_retries, route.directory, limit=settings.retry_concurrency, recursive=route.recursive),
+            )
+            for path in dues:
+                pipelines[route.name].submit(path)
+            if dues:
+                logger.info(f"Nouvelle tentative pour {len(dues)} fichier(s) de {route.directory}")
+
+    async def recheck_leases():
+        for path, tag in (await loop.run_in_executor(executor, leases.take_skipped)).items():
+            if tag in pipelines:
+                pipelines[tag].submit(path)
+
+    async def reconcile_all():
+        await loop.run_in_executor(executor, reconcile, reconcile_targets)
+
+    tasks = [
+        asyncio.create_task(every(settings.retry_interval, retry_due, "la reprise des envois en échec")),
+        # premier passage tout de suite, dans l'exécuteur : reprise des fichiers et .success présents au démarrage
+        asyncio.create_task(every(settings.reconcile_interval, reconcile_all, "du rapprochement")),
+    ]
+    if leases is not None:
+        tasks.append(asyncio.create_task(every(settings.lease_recheck_interval, recheck_leases, "la resoumission des baux")))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        observer.stop()
+        await loop.run_in_executor(None, observer.join)
+        for stage in stages:
+            stage.stop()
 
 
 # ----- CLI -----
@@ -417,19 +1092,44 @@ import argparse
 def main():
     parser = argparse.ArgumentParser(description="Envoyer automatiquement les nouveaux fichiers")
     parser.add_argument('--watch', action='store_true', help='Surveiller le dossier et envoyer automatiquement')
-    parser.add_argument('--show-log', nargs='?', const=100, type=int, help='Afficher les dernières lignes du fichier de log (optionnel: nombre de lignes)')
+    parser.add_argument('--show-log', nargs='?', const=100, type=int, help='Afficher les dernières entrées du fichier de log (optionnel: nombre d\'entrées)')
+    parser.add_argument('-f', '--follow', action='store_true', help="Avec --show-log : suivre les nouvelles entrées")
+    parser.add_argument('--level', type=parse_level_arg, help="Avec --show-log : niveau minimal (INFO, WARNING, ERROR...)")
+    parser.add_argument('--file', help="Avec --show-log : entrées concernant ce fichier (nom ou chemin)")
+    parser.add_argument('--since', type=parse_time_arg, help="Avec --show-log : depuis une date ISO ou une durée (30m, 2h, 7d)")
+    parser.add_argument('--until', type=parse_time_arg, help="Avec --show-log : jusqu'à une date ISO ou une durée (30m, 2h, 7d)")
     parser.add_argument('--process-success', action='store_true', help="Traiter les fichiers *.success existants : copier vers sauvegarde puis supprimer")
+    parser.add_argument('--stats', action='store_true', help="Afficher les métriques (instance en cours si METRICS_PORT est défini, sinon journal et arriéré)")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="Moteur asynchrone : étages d'envoi en pipeline, milliers de fichiers en vol (aiosmtplib si installé)")
     args = parser.parse_args()
 
-    if args.show_log is not None:
-        show_log(args.show_log)
+    if args.show_log is not None or args.follow:
+        show_log(args.show_log or 100, follow=args.follow, level=args.level, file=args.file,
+                 since=args.since, until=args.until)
+        return
+
+    if args.stats:
+        show_stats()
         return
 
     if args.process_success:
         from backup import process_success_files, ensure_backup_dir
-        ensure_backup_dir(DOSSIER_SAUVEGARDE, logger=logger)
-        copied, removed = process_success_files(DOSSIER_FICHIERS, DOSSIER_SAUVEGARDE, logger=logger)
-        logger.info(f"process-success: copiés={len(copied)}, supprimés={len(removed)}")
+        for route in get_routes():
+            ensure_backup_dir(route.backup_dir, logger=logger)
+            copied, removed = process_success_files(route.directory, route.backup_dir, logger=logger)
+            logger.info(f"process-success ({route.name}): copiés={len(copied)}, supprimés={len(removed)}")
+        return
+
+    startup()
+    if not args.watch:
+        # en mode watch, ce traitement est lancé en arrière-plan une fois la surveillance démarrée
+        process_startup_success()
+
+    if args.use_async:
+        try:
+            run_async(watch=args.watch)
+        except KeyboardInterrupt:
+            pass
         return
 
     if args.watch:
@@ -439,8 +1139,9 @@ def main():
             logger.exception(f"Erreur en démarrant le mode watch: {exc}")
             raise
     else:
-        # mode manuel -> envoi + backup
-        send_and_backup()
+        # mode manuel -> envoi + backup, route par route
+        for route in get_routes():
+            send_and_backup(route=route)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,145 @@
+import atexit
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '2'))  # sessions SMTP simultanées max par serveur/compte
+SMTP_KEEPALIVE = float(os.getenv('SMTP_KEEPALIVE', '30'))  # inactivité (s) au-delà de laquelle un NOOP vérifie la session
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '60'))
+
+
+class SMTPPool:
+    """Pool de sessions SMTP_SSL authentifiées, réutilisées d'un envoi à l'autre.
+    - au plus max_size sessions ouvertes en même temps (les appelants suivants attendent)
+    - une session inactive depuis plus de keepalive secondes est vérifiée par NOOP avant réutilisation
+    - une session morte ou ayant levé une erreur est fermée et remplacée par une nouvelle connexion
+    """
+
+    def __init__(self, smtp_server, smtp_port, email_exp, password, max_size=SMTP_POOL_SIZE, keepalive=SMTP_KEEPALIVE, timeout=SMTP_TIMEOUT, logger=None):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.email_exp = email_exp
+        self.password = password
+        self.max_size = max(1, max_size)
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.logger = logger
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._idle = []  # [(serveur, last_used)]
+
+    def _connect(self):
+        with metrics.smtp_connect_seconds.time():
+            serveur = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        try:
+            with metrics.smtp_login_seconds.time():
+                serveur.login(self.email_exp, self.password)
+        except Exception:
+            _close_quietly(serveur)
+            raise
+        if self.logger:
+            self.logger.info(f"Session SMTP ouverte vers {self.smtp_server}:{self.smtp_port}")
+        return serveur
+
+    def _is_alive(self, serveur):
+        try:
+            return serveur.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    serveur, last_used = self._idle.pop()
+                if time.monotonic() - last_used < self.keepalive or self._is_alive(serveur):
+                    return serveur
+                if self.logger:
+                    self.logger.info("Session SMTP expirée, reconnexion")
+                _close_quietly(serveur)
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, serveur, healthy):
+        try:
+            if healthy:
+                with self._lock:
+                    self._idle.append((serveur, time.monotonic()))
+            else:
+                _close_quietly(serveur)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Fournit une session authentifiée ; elle est rendue au pool à la sortie du bloc,
+        ou fermée si le bloc a levé une erreur (sauf refus de destinataires, après lequel
+        smtplib a déjà réinitialisé la session)."""
+        serveur = self._acquire()
+        healthy = True
+        try:
+            yield serveur
+        except smtplib.SMTPRecipientsRefused:
+            raise
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self._release(serveur, healthy)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for serveur, _ in idle:
+            try:
+                serveur.quit()
+            except Exception:
+                _close_quietly(serveur)
+
+
+def _close_quietly(serveur):
+    try:
+        serveur.close()
+    except Exception:
+        pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(smtp_server, smtp_port, email_exp, password, logger=None, name=None, size=None):
+    """Retourne le pool partagé pour ce serveur/compte (créé au premier appel).
+    - name: pool distinct (une route), avec son propre quota de size sessions (SMTP_POOL_SIZE par défaut) ;
+      sans name, le pool commun (notifications, récapitulatifs, envoi depuis la sauvegarde)"""
+    key = (smtp_server, smtp_port, email_exp, name)
+    size = size or SMTP_POOL_SIZE
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.password != password or pool.max_size != max(1, size):
+            if pool is not None:
+                pool.close()
+            pool = SMTPPool(smtp_server, smtp_port, email_exp, password, max_size=size, logger=logger)
+            _pools[key] = pool
+        return pool
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_all_pools)
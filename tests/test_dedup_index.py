@@ -0,0 +1,58 @@
+import os
+import shutil
+
+from dedup_index import DedupIndex, link_or_skip
+
+
+def _write(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    return str(path)
+
+
+def _backup(index, source, backup_dir):
+    dest = os.path.join(backup_dir, os.path.basename(source))
+    shutil.copy2(source, dest + ".tmp")
+    os.replace(dest + ".tmp", dest)
+    index.record(source, dest)
+    os.remove(source)
+    return dest
+
+
+def test_overwritten_backup_is_not_a_duplicate(tmp_path):
+    src, bk = tmp_path / "src", tmp_path / "bk"
+    src.mkdir()
+    bk.mkdir()
+    index = DedupIndex(str(tmp_path / "dedup.db"))
+
+    _backup(index, _write(src / "report.csv", "X" * 100), str(bk))
+    report = _backup(index, _write(src / "report.csv", "Y" * 100), str(bk))  # écrase la sauvegarde de X
+    again = _write(src / "again.csv", "X" * 100)
+
+    # X n'est plus dans la sauvegarde : again.csv doit être envoyé et sauvegardé normalement
+    assert index.find_duplicate(again) is None
+
+    # Y est toujours sauvegardé sous report.csv
+    other = _write(src / "other.csv", "Y" * 100)
+    assert index.find_duplicate(other)[1] == report
+    assert link_or_skip(report, str(bk / "other.csv"))
+    with open(bk / "other.csv") as f:
+        assert f.read() == "Y" * 100
+
+
+def test_backup_modified_outside_index(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.db"))
+    backup = _write(tmp_path / "saved.csv", "X" * 100)
+    index.record(str(tmp_path / "gone.csv"), backup)
+    _write(tmp_path / "saved.csv", "Z" * 100)
+
+    assert index.find_duplicate(_write(tmp_path / "new.csv", "X" * 100)) is None
+
+
+def test_link_refuses_existing_destination_with_other_content(tmp_path):
+    existing = _write(tmp_path / "existing.csv", "X")
+    dest = _write(tmp_path / "dest.csv", "Y")
+
+    assert not link_or_skip(existing, dest)
+    with open(dest) as f:
+        assert f.read() == "Y"
@@ -0,0 +1,67 @@
+import multiprocessing
+import random
+import time
+
+from leases import LeaseManager, lease_key
+
+
+def _claim_all(lease_dir, paths, start, queue):
+    manager = LeaseManager(lease_dir, ttl=60)
+    paths = list(paths)
+    random.shuffle(paths)
+    start.wait()
+    # le processus se termine sans libérer ses baux : un chemin ne peut pas être repris entre deux workers
+    queue.put(manager.claim(paths))
+
+
+def _claim_and_exit(lease_dir, path, ttl):
+    LeaseManager(lease_dir, ttl=ttl, owner="mort").claim([path])
+
+
+def test_each_path_is_claimed_by_one_process(tmp_path):
+    lease_dir = str(tmp_path / "leases")
+    paths = [str(tmp_path / f"f{i}.bin") for i in range(200)]
+    start = multiprocessing.Event()
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_claim_all, args=(lease_dir, paths, start, queue)) for _ in range(6)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    claimed = [path for _ in workers for path in queue.get(timeout=60)]
+    for worker in workers:
+        worker.join(60)
+
+    assert sorted(claimed) == sorted(paths)
+
+
+def test_live_lease_is_refused(tmp_path):
+    lease_dir = str(tmp_path / "leases")
+    path = str(tmp_path / "f.bin")
+    owner = LeaseManager(lease_dir, ttl=0.3, owner="a")
+    other = LeaseManager(lease_dir, ttl=0.3, owner="b")
+    try:
+        assert owner.claim([path]) == [path]
+        time.sleep(1)  # plus de ttl : le bail n'est conservé que parce qu'il est renouvelé
+        assert other.claim([path], tag="route") == []
+        assert other.take_skipped() == {}  # le fichier n'existe pas : rien à resoumettre
+    finally:
+        owner.stop()
+        other.stop()
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    lease_dir = str(tmp_path / "leases")
+    path = str(tmp_path / "f.bin")
+    # instance arrêtée brutalement : son bail n'est plus renouvelé
+    dead = multiprocessing.Process(target=_claim_and_exit, args=(lease_dir, path, 0.5))
+    dead.start()
+    dead.join(60)
+    other = LeaseManager(lease_dir, ttl=0.5, owner="b")
+    try:
+        assert other.claim([path]) == []
+        time.sleep(0.7)
+        assert other.claim([path]) == [path]
+        with open(other._lease_file(lease_key(path))) as f:
+            assert f.readline().strip() == "b"
+    finally:
+        other.stop()
@@ -0,0 +1,27 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from log_query import LogFilter, parse_level, parse_time
+
+
+def test_aware_time_is_converted_to_naive_local_time():
+    when = parse_time("2024-01-31T12:00+02:00")
+    assert when.tzinfo is None
+    expected = datetime(2024, 1, 31, 10, 0, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    assert when == expected
+    # comparable aux dates (naïves) des entrées du log
+    entry = {"time": expected + timedelta(minutes=1), "level": "INFO", "message": "m"}
+    assert LogFilter(since=when).matches(entry)
+
+
+def test_invalid_time_is_a_usage_error():
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_time("hier")
+
+
+def test_invalid_level_is_a_usage_error():
+    assert parse_level("warning") == "WARNING"
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_level("bogus")
@@ -0,0 +1,37 @@
+import os
+
+from email.policy import SMTP
+
+from mime_stream import iter_message
+from packing import pack_files, raw_budget
+from send_email import TEXTE_PIECES_JOINTES, build_payload
+
+MAX_MESSAGE_BYTES = 4 * 1024 * 1024
+
+
+def _files(tmp_path):
+    fichiers = []
+    # un fichier à découper, des fichiers moyens et beaucoup de petits fichiers aux noms longs
+    sizes = [9_000_000] + [700_000] * 5 + [300] * 200
+    for i, size in enumerate(sizes):
+        path = tmp_path / f"fichier_{i:04d}_{'é' * 40}.bin"
+        path.write_bytes(os.urandom(size))
+        fichiers.append(str(path))
+    return fichiers
+
+
+def test_encoded_messages_fit_max_message_bytes(tmp_path):
+    lots = pack_files(_files(tmp_path), raw_budget(MAX_MESSAGE_BYTES))
+    assert len(lots) > 1
+    for lot in lots:
+        payload, jointes = build_payload("me@example.com", "Sujet", lot)
+        assert jointes == lot
+        message = SMTP.fold_binary("To", "destinataire@example.com") + payload
+        assert len(message) <= MAX_MESSAGE_BYTES
+
+
+def test_streamed_messages_fit_max_message_bytes(tmp_path):
+    for lot in pack_files(_files(tmp_path), raw_budget(MAX_MESSAGE_BYTES)):
+        headers = [("From", "me@example.com"), ("To", "destinataire@example.com"), ("Subject", "Sujet")]
+        size = sum(len(chunk) for chunk in iter_message(headers, TEXTE_PIECES_JOINTES, lot))
+        assert size <= MAX_MESSAGE_BYTES